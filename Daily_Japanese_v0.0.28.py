@@ -1,32 +1,146 @@
 import google.generativeai as genai
 import requests
 import os
+import sys
 import json
 import random
 import re
 from datetime import datetime, timedelta, timezone
 import time
 import math
+import hashlib
+import threading
+import mmap
+import struct
+import unicodedata
+from functools import lru_cache
+from contextlib import contextmanager
+import io
+import csv
+import sqlite3
+import tempfile
+import zipfile
+import heapq
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+# 選用的快速 JSON 後端 (沒安裝時自動使用標準庫)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import numpy as np # 能力模型的整批擬合，沒有時改用純 Python
+except ImportError:
+    np = None
 
 # ================= 環境變數 =================
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 TG_BOT_TOKEN = os.getenv("TG_BOT_TOKEN")
 TG_CHAT_ID = os.getenv("TG_CHAT_ID")
+# 可改指向本機替身伺服器 (見 fake_services.py) 以離線執行
+TG_API_BASE = os.getenv("TG_API_BASE", "https://api.telegram.org")
 
 # 檔案設定
-VOCAB_FILE = "vocab.json"
-USER_DATA_FILE = "user_data.json"
+VOCAB_FILE = "vocab.jsonl"
+USER_DATA_FILE = "user_data.jsonl"
+# v0.0.28 以前的整份 JSON 格式；讀到時會自動轉成 JSONL 並在提交後刪除
+LEGACY_STATE_FILES = {VOCAB_FILE: "vocab.json", USER_DATA_FILE: "user_data.json"}
+JSONL_APPEND_KEYS = ["translation_log"] # user_data 中逐筆一行、附加在檔尾的清單
+JOURNALED_KEYS = ["stats"] # 以 stats_journal.jsonl 為準 (唯一來源)，不寫進 user_data.jsonl
 LOG_FILE = "TG_MSG.log"
+TRANSLATION_ARCHIVE_FILE = "translation_archive.jsonl" # 超過保留上限的翻譯紀錄移到這裡，不再丟棄
+ASSESSMENTS_FILE = "assessments.jsonl" # 每一題的評分紀錄 (append-only)
+STATS_JOURNAL_FILE = "stats_journal.jsonl" # stats 的事件日誌 (append-only)
+STATS_SNAPSHOT_EVERY = 30 # 每累積幾批事件寫一次完整快照
+STATE_COMMIT_FILE = "state.commit" # 多檔提交進行中的標記，正常結束後會被刪除
+RUN_REPORT_FILE = "run_report.json" # 每次執行的結構化報告 (各階段 span、AI 用量)，每次覆寫；不進版本庫 (CI 以 artifact 上傳)
+JLPT_DICT_SOURCE = "jlpt_dict_seed.tsv" # 可換成由 build_dictionary.py 產生的 JMdict 版本
+JLPT_DICT_FILE = "jlpt_dict.bin"        # 由來源自動編譯的 mmap 查詢檔
+HISTORY_INDEX_FILE = "history_index.bin" # 歸檔部分的檢索索引 (可隨時刪除重建)；不進版本庫，CI 以 actions/cache 保存
 MODEL_NAME = 'models/gemini-2.5-flash' 
+TG_SEND_INTERVAL = 1 # 連續發送訊息的間隔秒數 (避免 TG 限流)
+TG_MESSAGE_LIMIT = 4096 # Telegram 單則訊息的字數上限，超過的訊息拆成多則
+NORMALIZE_CACHE_SIZE = 65536 # normalize_text 的快取筆數
+SPAN_SUMMARY_TOP = 5 # Log 儀表板與執行結束時列出最慢的幾個階段
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto") # auto / orjson / msgspec / stdlib
 
 # N2 衝刺設定 (半年 = 180天)
 SPRINT_DURATION_DAYS = 180
 TARGET_DIFFICULTY = 4.0
 START_DIFFICULTY = 1.0 # 設定 N5 為起點
+FORECAST_HALF_LIFE_DAYS = 30 # 進度趨勢擬合的遺忘半衰期 (越舊的每日難度權重越低)
+FORECAST_MIN_DAYS = 5        # 累積幾天資料後才改用趨勢預測
+FORECAST_Z = 1.645           # 預測區間寬度 (90%)
+FORECAST_HUBER_K = 2.0       # 偏離趨勢超過幾個標準差的點會被降權 (穩健擬合)
+
+# 明日測驗預生成 (難度分桶寬度：同一桶內視為相同難度；一天的批改通常不會跨桶)
+QUIZ_CACHE_BUCKET = 0.5
+
+# Bonus 預取池 (一次呼叫預先生成後續幾個難度階的題組)
+BONUS_PREFETCH_SETS = 3
+BONUS_DIFFICULTY_STEP = 0.5
+
+# 長篇作業分批平行批改 (超過門檻句數才拆批，並限制同時呼叫數)；每日必修 10 句仍是一次呼叫
+GRADING_SPLIT_THRESHOLD = 12
+GRADING_BATCH_SIZE = 6 # 拆批時每次呼叫批改的句數 (每次呼叫都帶完整 prompt，批次太小會放大成本)
+GRADING_CONCURRENCY = 3
+GRADING_MAX_RETRIES = 2
+
+# 學習者輪廓 (Learner Profile)：取代把原始紀錄整包塞進 prompt
+TRANSLATION_LOG_LIMIT = 100 # user_data 中保留的原始翻譯紀錄筆數
+PROFILE_MAX_ITEMS = 30      # 輪廓中每一類最多保留幾項
+PROFILE_PROMPT_ITEMS = 6    # 注入 prompt 時每一類取前幾項
+PROFILE_RECENT_LOGS = 3     # 另外附上最近幾筆原始紀錄
+
+# 歷史作答檢索 (字元 n-gram 雜湊向量)
+INDEX_DIM = 4096
+INDEX_NGRAMS = (2, 3)
+RETRIEVAL_TOP_K = 5
+INDEX_MAX_DF_RATIO = 0.02 # 出現在超過此比例筆數的特徵視為停用詞
+
+# 大量匯入 (貼上 JSON 或上傳 JSON/CSV/Anki 檔案)
+IMPORT_BATCH_SIZE = 1000
+IMPORT_CHUNK_SIZE = 1 << 16
+
+# --- 能力模型 (Elo / IRT) ---
+ABILITY_SLOPE = 1.0           # 能力與難度差 1 級時的鑑別度
+ABILITY_TARGET_SCORE = 7.0    # 出題難度對準的預期得分
+ABILITY_K = 0.3               # 線上更新步長
+ABILITY_HALF_LIFE_DAYS = 21   # 整批擬合時舊作答的權重半衰期
+ABILITY_PRIOR_SD = 1.5
+ABILITY_FIT_ITERATIONS = 20
+ASSESSMENT_WINDOW_DAYS = 30   # 滾動統計保留的天數
+
+# --- 技能標籤 (批改 JSON 中每個 mistake 的固定分類) ---
+SKILL_TAGS = {
+    "particle": "助詞",
+    "conjugation": "活用變化",
+    "tense": "時態",
+    "keigo": "敬語",
+    "vocabulary": "用詞選擇",
+    "grammar_pattern": "句型文法",
+}
+SKILL_HALF_LIFE_DAYS = 14 # 技能錯誤計數的衰減半衰期
+QUIZ_FOCUS_SKILLS = 2     # 每日必修重點加強的技能數
+
+# --- 單字權重時間衰減 ---
+WEIGHT_HALF_LIFE_DAYS = 14 # 權重高於基準值的部分，每過這麼多天減半
+WEIGHT_BASELINE = 1
 
 # 全局日誌緩衝區
 LOG_BUFFER = []
 TW_TZ = timezone(timedelta(hours=8))
+CLOCK = None # 可替換的時鐘 (回傳帶時區的 datetime)；simulate.py 以虛擬時鐘加速跑完整個衝刺
+
+def now_tw():
+    # 所有「現在時間」都經過這裡，不直接呼叫 datetime.now()
+    return CLOCK() if CLOCK else datetime.now(TW_TZ)
 
 # 安全設定
 SAFETY_SETTINGS = [
@@ -36,36 +150,401 @@ SAFETY_SETTINGS = [
     {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
 ]
 
+# ================= 單字資料結構 (Compact Records) =================
+
+_UNSET = object() # WordRecord 中尚未設定的欄位
+
+@lru_cache(maxsize=4096)
+def date_ordinal(date_str):
+    # "YYYY-MM-DD" -> 日序；不是這個格式時回傳 None。單字庫裡不同的日期很少，快取後幾乎不必再解析
+    try: ordinal = datetime.strptime(date_str, "%Y-%m-%d").toordinal()
+    except (TypeError, ValueError): return None
+    return ordinal if ordinal_date_str(ordinal) == date_str else None
+
+@lru_cache(maxsize=4096)
+def ordinal_date_str(ordinal):
+    return datetime.fromordinal(ordinal).strftime("%Y-%m-%d")
+
+class WordRecord:
+    """
+    單字的精簡記錄：固定欄位放在 __slots__ 裡 (沒有每筆一個 dict)，
+    type / 等級這類重複度高的字串會被 intern 共用同一個物件，日期存成日序 (int，讀取時轉回字串)。
+    提供與 dict 相同的 w["kanji"] / w.get() / "x" in w 介面，既有程式碼不用改寫；
+    不認得的欄位放在 _extra，存檔時原樣寫回。沒設定的欄位是 _UNSET (明確的 null 會原樣保留)。
+    """
+    FIELDS = ("kanji", "kana", "meaning", "count", "added_date", "type", "count_ts", "jlpt")
+    INTERNED = frozenset(("type", "jlpt"))
+    DATE_FIELDS = frozenset(("added_date", "count_ts"))
+    __slots__ = FIELDS + ("_extra",)
+
+    def __init__(self, data=None):
+        for field in self.FIELDS: object.__setattr__(self, field, _UNSET)
+        self._extra = None
+        for key, value in (data or {}).items(): self[key] = value
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is _UNSET: raise KeyError(key)
+            return ordinal_date_str(value) if type(value) is int and key in self.DATE_FIELDS else value
+        if self._extra is None or key not in self._extra: raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            if type(value) is str:
+                if key in self.DATE_FIELDS: value = date_ordinal(value) or sys.intern(value) # 格式不符的日期原樣保留
+                elif key in self.INTERNED: value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self._extra is None: self._extra = {}
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [f for f in self.FIELDS if getattr(self, f) is not _UNSET]
+        return keys + list(self._extra or ())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def weight_day(self):
+        # word_weight 的基準日 (count_ts，沒有時用 added_date) 的日序；不是日期時回傳 None
+        value = self.count_ts if self.count_ts is not _UNSET and self.count_ts else self.added_date
+        return value if type(value) is int else None
+
+    def to_dict(self):
+        # 存檔時每筆都會呼叫，直接讀 slot 不經過 __getitem__
+        data = {}
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is _UNSET: continue
+            data[field] = ordinal_date_str(value) if type(value) is int and field in self.DATE_FIELDS else value
+        if self._extra: data.update(self._extra)
+        return data
+
+    def __repr__(self):
+        return f"WordRecord({self.to_dict()!r})"
+
+def json_default(obj):
+    # 讓 json.dump 能直接寫出 WordRecord
+    if isinstance(obj, WordRecord): return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+# ================= 序列化層 (Serializer Backends) =================
+# 所有寫進狀態檔與 append-only 日誌 (單字庫、user_data、stats 日誌、評分紀錄、翻譯歸檔、提交標記) 的 JSON 都經過 get_serializer()。
+# 狀態的型別由執行時真正使用的結構定義：單字是 WordRecord (固定欄位)，stats 是 new_user_stats()，
+# 其餘 user_data 欄位由 new_user_data() / USER_DATA_MIGRATIONS 建立；translation_log 是「日期: 內容」字串。
+# 另外維護一份 TypedDict 沒有任何程式使用，也無法保證與實際資料一致，所以不再保留。
+
+class StdlibSerializer:
+    name = "stdlib"
+
+    def loads(self, text):
+        return json.loads(text)
+
+    def dumps(self, data):
+        # 已提交的狀態檔格式以這個輸出為準
+        return json.dumps(data, ensure_ascii=False, indent=2, default=json_default)
+
+    def dumps_compact(self, data):
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=json_default)
+
+# 快速後端與 stdlib 唯一的差異在浮點數的指數表示 (1e-05 vs 0.00001 / 1e+16 vs 1e16)。
+# NaN / Infinity 另計：stdlib 寫成 NaN、orjson 寫成 null，輸出上看不出來，所以在 AI 回傳的 JSON 進來時就拒收 (見 loads_model_json)。
+# 輸出中只要出現「數字緊接 e」或「0.0000」就改用 stdlib 輸出同一份文件 (字串裡的誤判只影響速度)。
+# 用 bytes.translate + in 檢查，比正規表示式掃描快一個數量級。
+_DIGITS_TO_ZERO = bytes.maketrans(b"123456789", b"000000000")
+
+def _float_format_differs(raw):
+    return b"0.0000" in raw or b"0e" in raw.translate(_DIGITS_TO_ZERO)
+
+class OrjsonSerializer(StdlibSerializer):
+    name = "orjson"
+
+    def loads(self, text):
+        return orjson.loads(text)
+
+    def _dumps(self, data, option, fallback):
+        try:
+            raw = orjson.dumps(data, default=json_default, option=option | orjson.OPT_NON_STR_KEYS)
+        except TypeError: # 超過 64 位元的整數等
+            return fallback(data)
+        return fallback(data) if _float_format_differs(raw) else raw.decode("utf-8")
+
+    def dumps(self, data):
+        return self._dumps(data, orjson.OPT_INDENT_2, super().dumps)
+
+    def dumps_compact(self, data):
+        return self._dumps(data, 0, super().dumps_compact)
+
+class MsgspecSerializer(StdlibSerializer):
+    name = "msgspec"
+
+    def __init__(self):
+        self.encoder = msgspec.json.Encoder(enc_hook=json_default)
+
+    def loads(self, text):
+        return msgspec.json.decode(text)
+
+    def _dumps(self, data, indent, fallback):
+        try:
+            raw = self.encoder.encode(data)
+        except (TypeError, OverflowError, msgspec.EncodeError):
+            return fallback(data)
+        if indent: raw = msgspec.json.format(raw, indent=indent)
+        return fallback(data) if _float_format_differs(raw) else raw.decode("utf-8")
+
+    def dumps(self, data):
+        return self._dumps(data, 2, super().dumps)
+
+    def dumps_compact(self, data):
+        return self._dumps(data, 0, super().dumps_compact)
+
+SERIALIZER_PROBE = {
+    "schema_version": 1,
+    "words": [{"kanji": "影響", "kana": "えいきょう", "meaning": "影響 \"引號\" \\ /", "count": 2.5, "type": "word"}, {}],
+    "stats": {"difficulty_cn_jp": 1.05, "tiny": 1e-05, "huge": 1e+16, "neg": -0.1, "flag": True, "none": None},
+    "translation_log": ["2026-01-01: 改行\n\tタブ\u001f"], "empty": [],
+}
+
+def make_serializer(name):
+    if name == "orjson" and orjson is not None: return OrjsonSerializer()
+    if name == "msgspec" and msgspec is not None: return MsgspecSerializer()
+    return StdlibSerializer()
+
+SERIALIZER = None
+
+def get_serializer():
+    """
+    依 JSON_BACKEND (auto / orjson / msgspec / stdlib) 選擇後端。
+    快速後端必須先通過與 stdlib 逐位元組比對的自我檢查，否則退回 stdlib。
+    """
+    global SERIALIZER
+    if SERIALIZER is None:
+        stdlib = StdlibSerializer()
+        names = ["orjson", "msgspec"] if JSON_BACKEND == "auto" else [JSON_BACKEND]
+        SERIALIZER = stdlib
+        for name in names:
+            candidate = make_serializer(name)
+            if candidate.name == "stdlib": continue
+            if candidate.dumps(SERIALIZER_PROBE) == stdlib.dumps(SERIALIZER_PROBE) and candidate.dumps_compact(SERIALIZER_PROBE) == stdlib.dumps_compact(SERIALIZER_PROBE):
+                SERIALIZER = candidate
+                break
+            print(f"⚠️ {name} 輸出與 stdlib 不一致，改用 stdlib")
+    return SERIALIZER
+
 # ================= 檔案存取工具 =================
 
+LOADED_DIGESTS = {} # 檔名 -> 目前磁碟上內容的 sha1，內容沒變就不重寫
+
+def content_digest(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+LEGACY_REMOVALS = set() # 已轉換成 JSONL、等提交後刪除的舊檔
+
+# --- JSONL 狀態檔：一行一筆，新資料接在最後，每天的 git diff 只會動到變更的那幾行 ---
+
+def dump_jsonl_document(filename, data):
+    dumps = get_serializer().dumps_compact
+    if filename == VOCAB_FILE:
+        # 第一行是 words 以外的頂層欄位 (schema_version 等)，之後每行一個單字
+        lines = [dumps({k: v for k, v in data.items() if k != "words"})]
+        lines.extend(dumps(w) for w in data.get("words", []))
+    else:
+        # 每個頂層欄位一行；會持續增長的清單逐筆一行並固定放在檔尾
+        lines = [dumps({"key": k, "value": v}) for k, v in data.items() if k not in JSONL_APPEND_KEYS and k not in JOURNALED_KEYS]
+        for key in JSONL_APPEND_KEYS:
+            lines.extend(dumps({"key": key, "item": item}) for item in data.get(key, []))
+    return "\n".join(lines) + "\n"
+
+def parse_jsonl_document(filename, text):
+    loads = get_serializer().loads
+    lines = [line for line in text.splitlines() if line.strip()]
+    if filename == VOCAB_FILE:
+        data = loads(lines[0]) if lines else {}
+        data["words"] = [loads(line) for line in lines[1:]]
+        return data
+    data = {key: [] for key in JSONL_APPEND_KEYS}
+    for line in lines:
+        entry = loads(line)
+        if "item" in entry: data.setdefault(entry["key"], []).append(entry["item"])
+        else: data[entry["key"]] = entry["value"]
+    # 清單欄位維持在 dict 的最後，和檔案中的順序一致
+    for key in JSONL_APPEND_KEYS: data[key] = data.pop(key)
+    return data
+
 def load_json(filename, default_content):
-    if os.path.exists(filename):
+    source = filename
+    if filename.endswith(".jsonl") and not os.path.exists(filename) and os.path.exists(LEGACY_STATE_FILES.get(filename, "")):
+        source = LEGACY_STATE_FILES[filename]
+    if os.path.exists(source):
         try:
-            with open(filename, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                # 確保舊有 vocab 格式相容
+            with open(source, "r", encoding="utf-8") as f:
+                raw = f.read()
+                if source != filename:
+                    # 舊格式：不記錄 digest，下次存檔一定會寫出 JSONL
+                    data = get_serializer().loads(raw)
+                    LEGACY_REMOVALS.add(source)
+                elif filename.endswith(".jsonl"):
+                    LOADED_DIGESTS[filename] = content_digest(raw)
+                    data = parse_jsonl_document(filename, raw)
+                else:
+                    LOADED_DIGESTS[filename] = content_digest(raw)
+                    data = get_serializer().loads(raw)
+                # 欄位補齊交給 migrate_document()，這裡只轉換單字的記憶體表示
                 if filename == VOCAB_FILE and "words" in data:
-                    for w in data["words"]:
-                        if "type" not in w: w["type"] = "word"
-                        if "count" not in w: w["count"] = 1
-                
-                if isinstance(data, dict) and isinstance(default_content, dict):
-                    for k, v in default_content.items():
-                        if k not in data: data[k] = v
+                    data["words"] = [WordRecord(w) for w in data["words"]]
                 return data
         except: return default_content
     return default_content
 
+def archive_translation_log(user_data):
+    """
+    把超過保留上限的舊紀錄從 user_data 移出，回傳要追加到歸檔檔案的各行 (舊紀錄的重點已累積在 learner_profile)。
+    這裡不寫檔：歸檔行跟著 save_state() 的提交標記一起生效。
+    """
+    overflow = user_data.get("translation_log", [])[:-TRANSLATION_LOG_LIMIT]
+    if not overflow: return []
+    lines = []
+    for entry in overflow:
+        date_str, _, text = entry.partition(": ")
+        lines.append(get_serializer().dumps_compact({"date": date_str, "text": text}))
+    profile = user_data["learner_profile"]
+    profile["archived_entries"] += len(overflow)
+    user_data["translation_log"] = user_data["translation_log"][-TRANSLATION_LOG_LIMIT:]
+    return lines
+
+def staged_append(path, lines):
+    # 提交標記裡的追加區段：要追加的各行 + 提交前的檔案大小
+    if not lines: return None
+    return {"lines": lines, "base_size": os.path.getsize(path) if os.path.exists(path) else 0}
+
+def append_staged_lines(path, staged):
+    # 以提交前的檔案大小為基準：重做提交 (roll forward) 時先截掉上次寫到一半或已寫入的部分，不會重複追加
+    lines, base_size = staged["lines"], staged["base_size"]
+    with open(path, "a+", encoding="utf-8") as f:
+        if f.tell() > base_size: f.truncate(base_size)
+        f.write("".join(line + "\n" for line in lines))
+        f.flush()
+        os.fsync(f.fileno())
+
+def serialize_json(filename, data):
+    if filename.endswith(".jsonl"): return dump_jsonl_document(filename, data)
+    return get_serializer().dumps(data)
+
+def fsync_dir(directory):
+    # 讓 rename 本身也落地；部分平台 (Windows) 不支援對目錄 fsync
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
+    except OSError: pass
+
+def write_synced(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+
+def atomic_write_text(path, text):
+    # 先寫同目錄的暫存檔並 fsync，再 os.replace；中途當機只會留下完整的舊檔
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    os.close(fd)
+    try:
+        write_synced(tmp_path, text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+    fsync_dir(directory)
+
 def save_json(filename, data):
-    if filename == USER_DATA_FILE and "translation_log" in data:
-        if len(data["translation_log"]) > 100:
-            data["translation_log"] = data["translation_log"][-100:]
-            
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    # 內容與磁碟上相同就不寫 (避免每次執行都產生一樣的 commit)；回傳是否有寫入
+    text = serialize_json(filename, data)
+    digest = content_digest(text)
+    if digest == LOADED_DIGESTS.get(filename): return False
+    atomic_write_text(filename, text)
+    LOADED_DIGESTS[filename] = digest
+    return True
+
+def save_state(documents, journal_entries=(), assessment_lines=()):
+    """
+    多檔一致提交：vocab.json、user_data.json、這一批 stats 事件與評分紀錄要嘛全部生效、要嘛全部不生效。
+    1. 有變更的文件先寫成 <檔名>.pending 並 fsync
+    2. 原子寫入 STATE_COMMIT_FILE (各 pending 檔的雜湊 + 日誌批次 + 要追加的歸檔/評分行) —— 這一步就是提交點
+    3. 追加日誌、翻譯歸檔與評分紀錄，把 pending 檔 rename 成正式檔、刪除標記
+    提交點之前當機 → 維持舊狀態；之後當機 → 下次啟動由 recover_state() 補完。
+    回傳實際寫入的檔名。
+    """
+    archive_lines = archive_translation_log(documents[USER_DATA_FILE]) if USER_DATA_FILE in documents else []
+    files = {}
+    for filename, data in documents.items():
+        text = serialize_json(filename, data)
+        digest = content_digest(text)
+        if digest == LOADED_DIGESTS.get(filename): continue
+        write_synced(filename + ".pending", text)
+        files[filename] = digest
+    if not files and not journal_entries and not assessment_lines: return []
+    removals = sorted(LEGACY_REMOVALS)
+    archive = staged_append(TRANSLATION_ARCHIVE_FILE, archive_lines)
+    assessments = staged_append(ASSESSMENTS_FILE, list(assessment_lines))
+    atomic_write_text(STATE_COMMIT_FILE, get_serializer().dumps_compact({"files": files, "journal": list(journal_entries), "remove": removals,
+                                                                         "archive": archive, "assessments": assessments}))
+    finish_state_commit(files, journal_entries, removals, archive, assessments)
+    return list(files)
+
+def finish_state_commit(files, journal_entries, removals=(), archive=None, assessments=None):
+    STATS_JOURNAL.append_missing(journal_entries)
+    if archive: append_staged_lines(TRANSLATION_ARCHIVE_FILE, archive)
+    if assessments: append_staged_lines(ASSESSMENTS_FILE, assessments)
+    for filename, digest in files.items():
+        if os.path.exists(filename + ".pending"): os.replace(filename + ".pending", filename)
+        LOADED_DIGESTS[filename] = digest
+    for legacy in removals: # JSONL 已經就位，舊格式檔案功成身退
+        converted = [k for k, v in LEGACY_STATE_FILES.items() if v == legacy]
+        if os.path.exists(legacy) and converted and os.path.exists(converted[0]): os.remove(legacy)
+        LEGACY_REMOVALS.discard(legacy)
+    fsync_dir(os.path.abspath("."))
+    os.remove(STATE_COMMIT_FILE)
+
+def recover_state():
+    # 上次執行在提交點之後中斷：依標記把剩下的步驟做完 (roll forward)；沒有標記的 pending 檔代表未提交，直接丟棄
+    if os.path.exists(STATE_COMMIT_FILE):
+        try:
+            with open(STATE_COMMIT_FILE, "r", encoding="utf-8") as f:
+                marker = json.load(f)
+        except ValueError:
+            marker = None
+        if marker:
+            files = {}
+            for filename, digest in marker.get("files", {}).items():
+                pending_path = filename + ".pending"
+                if not os.path.exists(pending_path): continue # 已經 rename 完成
+                with open(pending_path, "r", encoding="utf-8") as f:
+                    if content_digest(f.read()) == digest: files[filename] = digest
+            finish_state_commit(files, marker.get("journal", []), marker.get("remove", []), marker.get("archive"), marker.get("assessments"))
+            log_to_buffer("⚙️ Sys", f"Recovered interrupted state commit: {sorted(files) or 'journal only'}")
+        else:
+            os.remove(STATE_COMMIT_FILE)
+    for filename in [VOCAB_FILE, USER_DATA_FILE]:
+        if os.path.exists(filename + ".pending"): os.remove(filename + ".pending")
 
 def log_to_buffer(role, message):
-    timestamp = datetime.now(TW_TZ).strftime('%H:%M:%S')
+    timestamp = now_tw().strftime('%H:%M:%S')
     LOG_BUFFER.append(f"[{timestamp}] {role}: {message}")
 
 def send_telegram(message):
@@ -79,18 +558,452 @@ def send_telegram(message):
     clean_msg = message.replace("**", "").replace("##", "").replace("__", "")
     clean_msg = re.sub(r'<br\s*/?>', '\n', clean_msg)
     
-    try:
-        # 🔥 修復：移除 Markdown 語法，恢復正常 URL
-        requests.post(f"https://api.telegram.org/bot{TG_BOT_TOKEN}/sendMessage", json={"chat_id": TG_CHAT_ID, "text": clean_msg
-        })
-    except Exception as e: print(f"TG 發送失敗: {e}")
+    for part in split_telegram_message(clean_msg):
+        try:
+            # 🔥 修復：移除 Markdown 語法，恢復正常 URL
+            with TRACER.span("send", chars=len(part)):
+                resp = requests.post(f"{TG_API_BASE}/bot{TG_BOT_TOKEN}/sendMessage", json={"chat_id": TG_CHAT_ID, "text": part
+                })
+            if not resp.ok or not resp.json().get("ok"):
+                print(f"TG 發送失敗: HTTP {resp.status_code} {resp.text[:200]}")
+                log_to_buffer("⚠️ Err", f"sendMessage failed: HTTP {resp.status_code}")
+        except Exception as e: print(f"TG 發送失敗: {e}")
+
+def split_telegram_message(text, limit=TG_MESSAGE_LIMIT):
+    # 超過上限的訊息盡量在換行處切開 (整段沒有換行時才硬切)
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0: cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text: parts.append(text)
+    return parts
+
+def get_model():
+    # 所有 AI 呼叫統一由此取得模型 (離線測試時會被替換成假模型)
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel(MODEL_NAME)
 
-def normalize_text(text):
+# NFKC 之後仍會殘留的波浪號/刪節號變體，統一成半形 (文法項目 〜ている / ~ている 視為同一項)
+_SYMBOL_FOLD_TABLE = str.maketrans({"〜": "~", "〰": "~", "∼": "~", "⁓": "~", "‥": ".."})
+# 片假名 -> 平假名 (ァ..ヶ -> ぁ..ゖ)，長音 ー 保留
+_KANA_FOLD_TABLE = str.maketrans({chr(c): chr(c - 0x60) for c in range(0x30A1, 0x30F7)})
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_text(text, fold_kana=True):
+    """
+    詞條比對用的正規化鍵：NFKC (全形英數/半形片假名 -> 標準寬度) + 符號統一 + 小寫，
+    fold_kana=True 時再把片假名折成平假名。所有單字索引、比對與去重都走這裡。
+    """
     if not text: return ""
-    return text.strip().replace("　", " ").lower()
+    text = unicodedata.normalize("NFKC", text).translate(_SYMBOL_FOLD_TABLE)
+    if fold_kana: text = text.translate(_KANA_FOLD_TABLE)
+    return text.strip().lower()
+
+# ================= 執行追蹤 (Tracing Spans) =================
+# 每個 span 記錄名稱、父 span、起訖時間 (相對於本次執行開始) 與屬性；背景執行緒透過 bind() 接上呼叫端的父 span。
+
+class Tracer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.spans = []
+            self.next_id = 1
+            self.origin = time.perf_counter()
+            self.started_at = now_tw().isoformat(timespec="seconds")
+        self.local.stack = []
+
+    def _stack(self):
+        if not hasattr(self.local, "stack"): self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        with TRACER.span("fetch") as attrs: ... —— attrs 可在區塊內補上屬性 (例如 token 數)。
+        """
+        stack = self._stack()
+        with self.lock:
+            record = {"id": self.next_id, "parent": stack[-1]["id"] if stack else None, "name": name,
+                      "start_ms": round((time.perf_counter() - self.origin) * 1000, 3), "ms": None, "attrs": attrs}
+            self.next_id += 1
+            self.spans.append(record)
+        stack.append(record)
+        started = time.perf_counter()
+        try:
+            yield record["attrs"]
+        except BaseException as e:
+            record["error"] = f"{type(e).__name__}: {e}"[:200]
+            raise
+        finally:
+            record["ms"] = round((time.perf_counter() - started) * 1000, 3)
+            if record in stack: stack.remove(record)
+
+    def each(self, name, items, attrs=None):
+        """
+        迴圈版：每個元素的處理過程各是一個 span (不用為了 with 重新縮排迴圈本體)。
+        迴圈本體拋出例外或 break 時產生器會停在 yield，所以 span 不能靠 with 收尾：
+        每次回到產生器 (或產生器被關閉) 時先在 finally 裡把上一個 span 結束並移出堆疊。
+        """
+        for item in items:
+            span = self.span(name, **(attrs(item) if attrs else {}))
+            span.__enter__()
+            try:
+                yield item
+            finally:
+                span.__exit__(None, None, None)
+
+    def bind(self, func):
+        # 交給其他執行緒時帶著目前的 span 堆疊，子 span 才會掛在正確的父 span 底下
+        parents = list(self._stack())
+        def bound(*args, **kwargs):
+            self.local.stack = list(parents)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.local.stack = []
+        return bound
+
+    def summary(self):
+        # 依名稱彙總已結束的 span：次數、總耗時、最長一次，由慢到快
+        rows = {}
+        with self.lock:
+            for record in self.spans:
+                if record["ms"] is None: continue
+                row = rows.setdefault(record["name"], {"name": record["name"], "count": 0, "total_ms": 0.0, "max_ms": 0.0})
+                row["count"] += 1
+                row["total_ms"] = round(row["total_ms"] + record["ms"], 3)
+                row["max_ms"] = max(row["max_ms"], record["ms"])
+        return sorted(rows.values(), key=lambda r: -r["total_ms"])
+
+    def report(self):
+        with self.lock: spans = [dict(record) for record in self.spans]
+        ai_spans = [r for r in spans if r["name"].startswith("ai.")]
+        tokens = {}
+        for record in ai_spans:
+            for key in ["prompt_tokens", "output_tokens", "total_tokens"]:
+                if isinstance(record["attrs"].get(key), int): tokens[key] = tokens.get(key, 0) + record["attrs"][key]
+        root = next((r for r in spans if r["parent"] is None and r["name"] == "run"), None)
+        return {
+            "started_at": self.started_at,
+            "wall_ms": root["ms"] if root else None,
+            "ok": not (root or {}).get("error"),
+            "phases": self.summary(),
+            "ai": {"calls": len(ai_spans), "errors": sum(1 for r in ai_spans if r.get("error")), **tokens},
+            "spans": spans,
+        }
+
+TRACER = Tracer()
+
+def format_slowest_spans(summary, limit=SPAN_SUMMARY_TOP):
+    rows = [r for r in summary if r["name"] != "run"][:limit]
+    if not rows: return "尚無資料"
+    def fmt(ms): return f"{ms / 1000:.2f}s" if ms >= 1000 else f"{ms:.0f}ms"
+    return "、".join(f"{r['name']} {fmt(r['total_ms'])}" + (f" ×{r['count']}" if r["count"] > 1 else "") for r in rows)
+
+def save_run_report():
+    try:
+        atomic_write_text(RUN_REPORT_FILE, json.dumps(TRACER.report(), ensure_ascii=False, indent=2, default=str))
+    except Exception as e:
+        print(f"⚠️ Failed to write run report: {e}")
+
+def ai_generate(model, prompt, kind):
+    # 所有 AI 呼叫都經過這裡，span 上記錄 prompt 長度與 token 用量
+    with TRACER.span(f"ai.{kind}", prompt_chars=len(prompt)) as attrs:
+        response = model.generate_content(prompt, safety_settings=SAFETY_SETTINGS)
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            attrs["prompt_tokens"] = getattr(usage, "prompt_token_count", None)
+            attrs["output_tokens"] = getattr(usage, "candidates_token_count", None)
+            attrs["total_tokens"] = getattr(usage, "total_token_count", None)
+        return response
+
+# ================= 背景任務 =================
+
+BACKGROUND_TASKS = []
+
+def run_in_background(func, *args):
+    # 背景執行耗時的 AI 生成；主程式存檔前會統一 join，確保結果寫回檔案
+    t = threading.Thread(target=TRACER.bind(func), args=args, daemon=True)
+    t.start()
+    BACKGROUND_TASKS.append(t)
+    return t
+
+def wait_background_tasks():
+    while BACKGROUND_TASKS:
+        BACKGROUND_TASKS.pop(0).join()
+
+# ================= 資料結構版本與遷移 (Schema Migrations) =================
+
+def new_user_data():
+    # 全新使用者的完整資料結構 (已是最新版本，不需要遷移)
+    stats = new_user_stats()
+    return {
+        "schema_version": len(USER_DATA_MIGRATIONS),
+        "stats": stats,
+        "pending_answers": "",
+        "ability_model": new_ability_model(stats),
+        "assessment_buckets": {},
+        "sprint_forecast": new_sprint_forecast(),
+        "learner_profile": new_learner_profile(),
+        "translation_log": []
+    }
+
+def new_user_stats():
+    return {
+        "last_active": "2000-01-01", 
+        "streak_days": 0,
+        "execution_count": 0,
+        "last_quiz_date": "2000-01-01",
+        "last_quiz_questions_count": 0,
+        "daily_answers_count": 0,
+        "bonus_answers_count": 0,
+        "yesterday_main_score": 0,
+        "yesterday_bonus_score": 0,
+        "last_update_id": 0,
+        "current_difficulty": START_DIFFICULTY, 
+        "difficulty_cn_jp": START_DIFFICULTY,
+        "difficulty_jp_cn": START_DIFFICULTY,
+        "sprint_start_date": str(now_tw().date()),
+        "next_quiz_instruction": "" 
+    }
+
+def migrate_vocab_v1(vocab_data):
+    # v0.0.28 以前的單字可能缺 type / count
+    vocab_data.setdefault("words", [])
+    for w in vocab_data["words"]:
+        if "type" not in w: w["type"] = "word"
+        if "count" not in w: w["count"] = 1
+
+def migrate_user_data_v1(user_data):
+    # 補齊舊版缺少的頂層欄位與 stats 欄位；stats 的補值走事件日誌，重播時才會一致
+    for key, value in [("pending_answers", ""), ("translation_log", [])]:
+        if key not in user_data: user_data[key] = value
+    if not isinstance(user_data.get("stats"), dict): user_data["stats"] = {}
+    stats = user_data["stats"]
+    # 雙軌難度出現之前只有 current_difficulty，兩軌都從它開始
+    current = float(stats.get("current_difficulty", START_DIFFICULTY))
+    for key in ["current_difficulty", "difficulty_cn_jp", "difficulty_jp_cn"]:
+        value = float(stats.get(key, current))
+        if stats.get(key) != value or not isinstance(stats.get(key), float): stat_set(stats, key, value)
+    for key, value in new_user_stats().items():
+        if key not in stats: stat_set(stats, key, value)
+
+def migrate_user_data_v2(user_data):
+    # 能力模型、評分桶、衝刺預測、學習者輪廓在這裡一次建好，之後的程式碼直接使用，不再每次檢查是否存在
+    stats = user_data["stats"]
+    today = now_tw().date()
+    if not isinstance(user_data.get("ability_model"), dict):
+        # 以目前的雙軌難度反推能力值，切換前後出題難度不會跳動
+        user_data["ability_model"] = new_ability_model(stats)
+    if not isinstance(user_data.get("assessment_buckets"), dict):
+        user_data["assessment_buckets"] = rebuild_assessment_buckets(str(today))
+    if not isinstance(user_data.get("sprint_forecast"), dict):
+        start_date = datetime.strptime(stats["sprint_start_date"], "%Y-%m-%d").date()
+        user_data["sprint_forecast"] = bootstrap_sprint_forecast(start_date, today)
+    if not isinstance(user_data.get("learner_profile"), dict):
+        user_data["learner_profile"] = new_learner_profile()
+    for key, default in new_learner_profile().items():
+        user_data["learner_profile"].setdefault(key, default)
+
+# 依序排列，第 i 個函式把版本 i 升到 i + 1；新增遷移只能往後加
+VOCAB_MIGRATIONS = [migrate_vocab_v1]
+USER_DATA_MIGRATIONS = [migrate_user_data_v1, migrate_user_data_v2]
+
+def migrate_document(data, migrations, name):
+    # 只執行尚未套用過的遷移，版本號寫回文件後隨下次存檔落地；已是最新版時不做任何事
+    version = data.get("schema_version", 0)
+    if version > len(migrations):
+        raise ValueError(f"{name} schema_version {version} is newer than this script ({len(migrations)})")
+    for step in range(version, len(migrations)):
+        migrations[step](data)
+        log_to_buffer("⚙️ Sys", f"Migrated {name} to schema v{step + 1}")
+    data["schema_version"] = len(migrations)
+    return data
+
+def load_vocab_data():
+    return migrate_document(load_json(VOCAB_FILE, {"words": [], "schema_version": len(VOCAB_MIGRATIONS)}), VOCAB_MIGRATIONS, VOCAB_FILE)
+
+# ================= 統計事件日誌 (Event-sourced Stats) =================
+
+def apply_stats_event(stats, event):
+    # 即時更新與重播共用同一套規則，保證重建出的數值完全一致
+    key = event["key"]
+    if event["op"] == "set":
+        stats[key] = event["value"]
+    elif event["op"] == "add":
+        value = stats.get(key, 0) + event["value"]
+        if event.get("lo") is not None: value = max(event["lo"], value)
+        if event.get("hi") is not None: value = min(event["hi"], value)
+        stats[key] = value
+    return stats
+
+class StatsJournal:
+    """
+    stats 的所有變更都以事件 (set / add) 記錄，每次執行的事件合成一行批次附加到 JSONL：
+    - 一行就是一個原子單位，寫到一半中斷的殘行在重播時直接略過
+    - 每 STATS_SNAPSHOT_EVERY 批寫一次完整快照，載入時只需重播最後一個快照之後的部分
+    - stats_as_of() 可以重建任何一天結束時的狀態
+    """
+    def __init__(self, path):
+        self.path = path
+        self.pending = []
+        self.seq = 0
+        self.since_snapshot = 0
+        self.bootstrap = None # 還沒有日誌時的初始 stats，下次提交時寫成第一個快照
+        self.lock = threading.Lock()
+
+    def record(self, event):
+        with self.lock: self.pending.append(event)
+
+    def _read_lines(self):
+        if not os.path.exists(self.path): return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            return f.readlines()
+
+    def load(self):
+        """
+        從最後一個快照加上之後的批次重建 stats；沒有日誌時回傳 None。
+        """
+        self.pending = []
+        self.bootstrap = None
+        lines = self._read_lines()
+        start = None
+        for i in range(len(lines) - 1, -1, -1): # 從尾端找最後一個快照，前面的行不必解析
+            if lines[i].startswith('{"snapshot"'):
+                start = i
+                break
+        if start is None: return None
+        stats = None
+        self.since_snapshot = 0
+        for line in lines[start:]:
+            try: entry = json.loads(line)
+            except ValueError: continue # 中斷時留下的殘行
+            self.seq = entry.get("seq", self.seq)
+            if "snapshot" in entry:
+                stats = dict(entry["snapshot"])
+                self.since_snapshot = 0
+            else:
+                for event in entry["events"]: apply_stats_event(stats, event)
+                self.since_snapshot += 1
+        return stats
+
+    def stats_as_of(self, day_str):
+        # 重建指定日期 (含當天) 結束時的 stats；日期早於日誌開頭時回傳 None
+        stats = None
+        for line in self._read_lines():
+            try: entry = json.loads(line)
+            except ValueError: continue
+            if entry.get("day", "") > day_str: break
+            if "snapshot" in entry: stats = dict(entry["snapshot"])
+            elif stats is not None:
+                for event in entry["events"]: apply_stats_event(stats, event)
+        return stats
+
+    def daily_values(self, key):
+        # 重播整份日誌，回傳 {日期: 當天結束時 stats[key] 的值}
+        stats, values = None, {}
+        for line in self._read_lines():
+            try: entry = json.loads(line)
+            except ValueError: continue
+            if "snapshot" in entry: stats = dict(entry["snapshot"])
+            elif stats is not None:
+                for event in entry["events"]: apply_stats_event(stats, event)
+            if stats is not None and key in stats: values[entry.get("day", "")] = stats[key]
+        return values
+
+    def _append(self, entry):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(get_serializer().dumps_compact(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start_from(self, stats):
+        # 第一次使用日誌：以載入時的 stats 當作初始快照，但不在這裡寫檔 (跟著下一次提交一起寫入)
+        self.bootstrap = dict(stats)
+
+    def prepare_commit(self, stats, day_str):
+        """
+        取出這次執行的差量 (O(delta)) 組成待寫入的日誌行；累積夠多批次後附上快照。
+        實際寫入由 save_state() 在提交點之後呼叫 append_missing() 完成。
+        """
+        with self.lock:
+            events, self.pending = self.pending, []
+        entries = []
+        if self.bootstrap is not None:
+            self.seq += 1
+            entries.append({"snapshot": self.bootstrap, "seq": self.seq, "day": day_str})
+            self.since_snapshot = 0
+            self.bootstrap = None
+        if events:
+            self.seq += 1
+            entries.append({"seq": self.seq, "day": day_str, "ts": now_tw().isoformat(timespec="seconds"), "events": events})
+            self.since_snapshot += 1
+        if self.since_snapshot >= STATS_SNAPSHOT_EVERY:
+            self.seq += 1
+            entries.append({"snapshot": dict(stats), "seq": self.seq, "day": day_str})
+            self.since_snapshot = 0
+        return entries
+
+    def _last_seq_on_disk(self):
+        for line in reversed(self._read_lines()):
+            try: return json.loads(line).get("seq", 0)
+            except ValueError: continue
+        return 0
+
+    def append_missing(self, entries):
+        # 復原時可能重跑，已經在日誌裡的批次不重複追加
+        last_seq = self._last_seq_on_disk() if entries else 0
+        for entry in entries:
+            if entry["seq"] > last_seq: self._append(entry)
+
+STATS_JOURNAL = StatsJournal(STATS_JOURNAL_FILE)
+
+def stat_set(stats, key, value):
+    event = {"op": "set", "key": key, "value": value}
+    apply_stats_event(stats, event)
+    STATS_JOURNAL.record(event)
+
+def stat_add(stats, key, delta, lo=None, hi=None):
+    event = {"op": "add", "key": key, "value": delta}
+    if lo is not None: event["lo"] = lo
+    if hi is not None: event["hi"] = hi
+    apply_stats_event(stats, event)
+    STATS_JOURNAL.record(event)
+
+def load_user_data():
+    """
+    載入 user_data.json，stats 以事件日誌重建的結果為準 (user_data.jsonl 不再存 stats)，最後套用尚未執行的遷移。
+    第一次使用日誌時，以目前檔案裡的 stats 當作初始快照，於下一次 save_state() 提交時寫入。
+    """
+    user_data = load_json(USER_DATA_FILE, None)
+    if not isinstance(user_data, dict): user_data = new_user_data()
+    PENDING_ASSESSMENTS.clear() # 重新載入時，尚未提交的評分紀錄一併作廢
+    journaled = STATS_JOURNAL.load()
+    if journaled is None:
+        if not isinstance(user_data.get("stats"), dict): user_data["stats"] = {}
+        STATS_JOURNAL.start_from(user_data["stats"])
+    else:
+        user_data["stats"] = journaled
+    return migrate_document(user_data, USER_DATA_MIGRATIONS, USER_DATA_FILE)
 
 # ================= Log 寫入功能 =================
 
+LOG_SEPARATOR = "=== 📜 HISTORY LOGS START (oldest first) ===\n"
+LEGACY_LOG_SEPARATOR = "=== 📜 HISTORY LOGS START ===\n" # 舊版由新到舊排序
+
+def chronological_log_blocks(logs):
+    # 舊版把每次執行的紀錄插在最前面；轉換時把執行區塊反轉成由舊到新
+    blocks = re.split(r"(?=\n### 🗓️ )", logs)
+    head = blocks[0] if blocks and not blocks[0].startswith("\n### 🗓️ ") else ""
+    body = [blk for blk in blocks if blk.startswith("\n### 🗓️ ")]
+    return head + "".join(reversed(body))
+
 def write_log_file(user_data):
     stats = user_data["stats"]
     current_difficulty = float(stats.get("current_difficulty", 2.0))
@@ -100,13 +1013,14 @@ def write_log_file(user_data):
     diff_jp_cn = float(stats.get("difficulty_jp_cn", current_difficulty))
     
     header = f"""# 📊 N2 衝刺計畫 - 學習狀態儀表板
-Last Updated: {datetime.now(TW_TZ).strftime('%Y-%m-%d %H:%M:%S')}
+Last Updated: {now_tw().strftime('%Y-%m-%d %H:%M:%S')}
 
 ## 📈 目前能力值 (雙軌制)
 - **中翻日等級 (輸出)**: Lv {diff_cn_jp:.2f}
 - **日翻中等級 (輸入)**: Lv {diff_jp_cn:.2f}
 - **衝刺進度**: Day {days_passed} / {SPRINT_DURATION_DAYS}
 - **狀態評語**: {sprint_msg}
+- **N2 預測**: {format_sprint_forecast(user_data["sprint_forecast"]["cached"])}
 - **連續登入**: {stats.get('streak_days', 0)} 天
 
 ## ⚔️ 訓練數據
@@ -114,39 +1028,137 @@ Last Updated: {datetime.now(TW_TZ).strftime('%Y-%m-%d %H:%M:%S')}
 - **累積答題**: {stats.get('daily_answers_count', 0) + stats.get('bonus_answers_count', 0)} (今日計數)
 - **上次更新 ID**: {stats.get('last_update_id', 0)}
 
+## 🎯 作答表現 (滾動統計)
+- {format_assessment_aggregates(assessment_aggregates(user_data))}
+
+## ⏱️ 本次執行耗時 (最慢階段)
+- {format_slowest_spans(TRACER.summary())}
+
 ---
-> 以下為對話紀錄 (由新到舊排序)
+> 以下為對話紀錄 (由舊到新排序，最新一次執行在檔案最後)
 
 """
     old_logs = ""
-    separator = "=== 📜 HISTORY LOGS START ===\n"
     
     if os.path.exists(LOG_FILE):
         try:
             with open(LOG_FILE, "r", encoding="utf-8") as f:
                 content = f.read()
-                if separator in content:
-                    old_logs = content.split(separator)[1]
+                if LOG_SEPARATOR in content:
+                    old_logs = content.split(LOG_SEPARATOR, 1)[1]
+                elif LEGACY_LOG_SEPARATOR in content:
+                    old_logs = chronological_log_blocks(content.split(LEGACY_LOG_SEPARATOR, 1)[1])
                 else:
                     old_logs = content
         except: pass
 
     new_log_entry = ""
     if LOG_BUFFER:
-        new_log_entry = f"\n### 🗓️ {datetime.now(TW_TZ).strftime('%Y-%m-%d Execution')}\n"
+        new_log_entry = f"\n### 🗓️ {now_tw().strftime('%Y-%m-%d Execution')}\n"
         new_log_entry += "\n".join(LOG_BUFFER) + "\n"
         new_log_entry += "\n----------------------------------------\n"
 
-    full_content = header + separator + new_log_entry + old_logs
+    # 新紀錄接在最後：除了開頭的儀表板，舊內容一行都不會變
+    full_content = header + LOG_SEPARATOR + old_logs + new_log_entry
 
     try:
-        with open(LOG_FILE, "w", encoding="utf-8") as f:
-            f.write(full_content)
+        atomic_write_text(LOG_FILE, full_content)
         print("✅ Log file updated successfully.")
     except Exception as e:
         print(f"⚠️ Failed to write log file: {e}")
 
-# ================= 輔助功能 =================
+# ================= 衝刺預測 (Sprint Forecast) =================
+# 每天取一個「中翻日」難度樣本 (x = 衝刺第幾天, y = 難度)，以指數遺忘的加權最小平方法擬合直線。
+# 只保存幾個累加和，新的一天加入一點是 O(1)；偏離趨勢太遠的點 (例如 [LV] 手動調整) 以 Huber 權重降權。
+
+FORECAST_SUMS = ("w", "ww", "x", "y", "xx", "xy", "yy")
+
+def new_sprint_forecast():
+    return {"sums": {k: 0.0 for k in FORECAST_SUMS}, "n": 0, "last_x": None, "day": "", "cached": None}
+
+def _forecast_fit(sums):
+    # 由累加和算出斜率、截距與斜率標準誤；資料不足時回傳 None
+    W = sums["w"]
+    if W <= 0 or sums["ww"] <= 0: return None
+    n_eff = W * W / sums["ww"]
+    if n_eff <= 2: return None
+    mx, my = sums["x"] / W, sums["y"] / W
+    sxx = sums["xx"] - W * mx * mx
+    if sxx <= 1e-9: return None
+    sxy = sums["xy"] - W * mx * my
+    syy = sums["yy"] - W * my * my
+    slope = sxy / sxx
+    sse = max(0.0, syy - slope * sxy)
+    s2 = sse / W * n_eff / (n_eff - 2)
+    return {"slope": slope, "intercept": my - slope * mx, "sigma": math.sqrt(s2), "slope_se": math.sqrt(s2 / sxx * W / n_eff)}
+
+def forecast_observe(forecast, x, y):
+    # 加入一天的樣本：先依天數差遺忘舊資料，再以 Huber 權重加入新點
+    sums = forecast["sums"]
+    if forecast["last_x"] is not None:
+        decay = 0.5 ** (max(0, x - forecast["last_x"]) / FORECAST_HALF_LIFE_DAYS)
+        for k in FORECAST_SUMS: sums[k] *= decay * decay if k == "ww" else decay
+    weight = 1.0
+    fit = _forecast_fit(sums)
+    if fit and fit["sigma"] > 0:
+        residual = abs(y - (fit["intercept"] + fit["slope"] * x))
+        limit = FORECAST_HUBER_K * fit["sigma"]
+        if residual > limit: weight = limit / residual
+    sums["w"] += weight
+    sums["ww"] += weight * weight
+    sums["x"] += weight * x
+    sums["y"] += weight * y
+    sums["xx"] += weight * x * x
+    sums["xy"] += weight * x * y
+    sums["yy"] += weight * y * y
+    forecast["last_x"] = x
+    forecast["n"] += 1
+
+def _forecast_eta(gap, slope):
+    return math.ceil(gap / slope) if slope > 1e-6 else None
+
+def forecast_eta(forecast, x, current, today):
+    """
+    預測距離 TARGET_DIFFICULTY 還要幾天：中心值用擬合斜率，
+    區間用斜率 ± FORECAST_Z 個標準誤；斜率下界不是正數時區間上限為 None (看不到終點)。
+    """
+    fit = _forecast_fit(forecast["sums"])
+    if forecast["n"] < FORECAST_MIN_DAYS or fit is None: return None
+    level = max(current, fit["intercept"] + fit["slope"] * x)
+    gap = max(0.0, TARGET_DIFFICULTY - level)
+    eta = _forecast_eta(gap, fit["slope"])
+    return {
+        "slope": round(fit["slope"], 4), "slope_se": round(fit["slope_se"], 4), "level": round(level, 3),
+        "eta_days": eta,
+        "eta_low": _forecast_eta(gap, fit["slope"] + FORECAST_Z * fit["slope_se"]),
+        "eta_high": _forecast_eta(gap, fit["slope"] - FORECAST_Z * fit["slope_se"]),
+        "eta_date": str(today + timedelta(days=eta)) if eta is not None else None,
+    }
+
+def bootstrap_sprint_forecast(start_date, today):
+    # 第一次使用時以 stats 日誌重播出的每日難度補齊歷史
+    forecast = new_sprint_forecast()
+    for day_str, value in sorted(STATS_JOURNAL.daily_values("difficulty_cn_jp").items()):
+        try: day = datetime.strptime(day_str, "%Y-%m-%d").date()
+        except ValueError: continue
+        if start_date <= day < today: forecast_observe(forecast, (day - start_date).days, float(value))
+    return forecast
+
+def get_sprint_forecast(user_data, days_passed, current_difficulty, today):
+    # 每天只取樣、計算一次，同一天內直接回傳快取
+    today_str = str(today)
+    forecast = user_data["sprint_forecast"]
+    if forecast["day"] != today_str:
+        forecast_observe(forecast, days_passed, current_difficulty)
+        forecast["cached"] = forecast_eta(forecast, days_passed, current_difficulty, today)
+        forecast["day"] = today_str
+    return forecast["cached"]
+
+def format_sprint_forecast(eta):
+    if not eta: return f"資料累積中 (需 {FORECAST_MIN_DAYS} 天)"
+    if eta["eta_days"] is None: return f"目前趨勢 {eta['slope']:+.3f} Lv/天，照這個速度到不了 N2"
+    high = "∞" if eta["eta_high"] is None else eta["eta_high"]
+    return f"約 {eta['eta_days']} 天後 ({eta['eta_date']}) 達到 N2，90% 區間 {eta['eta_low']}~{high} 天 (趨勢 {eta['slope']:+.3f} Lv/天)"
 
 def get_sprint_status(user_data):
     stats = user_data["stats"]
@@ -157,41 +1169,605 @@ def get_sprint_status(user_data):
         return 0, 0, "infinity"
 
     if "sprint_start_date" not in stats:
-        stats["sprint_start_date"] = str(datetime.now(TW_TZ).date())
+        stat_set(stats, "sprint_start_date", str(now_tw().date()))
         return 0, 0, "start"
 
     start_date = datetime.strptime(stats["sprint_start_date"], "%Y-%m-%d").date()
-    today = datetime.now(TW_TZ).date()
+    today = now_tw().date()
     days_passed = (today - start_date).days
     
     if days_passed <= 0: days_passed = 1
 
-    progress_ratio = min(1.0, days_passed / SPRINT_DURATION_DAYS)
-    
-    # 簡單計算落後與否
     days_total = SPRINT_DURATION_DAYS
     expected_diff_now = START_DIFFICULTY + (days_passed / days_total) * (TARGET_DIFFICULTY - START_DIFFICULTY)
-    
-    diff_val = current_difficulty - expected_diff_now
-    daily_growth = (TARGET_DIFFICULTY - START_DIFFICULTY) / days_total
-    days_gap = int(diff_val / daily_growth)
+
+    eta = get_sprint_forecast(user_data, days_passed, current_difficulty, today)
+    if eta and eta["eta_days"] is not None:
+        # 預測完成日與計畫完成日的差 (正數 = 超前)
+        days_gap = (days_total - days_passed) - eta["eta_days"]
+    elif eta:
+        days_gap = -(days_total - days_passed) # 趨勢不升反降，視為嚴重落後
+    else:
+        # 資料還不夠時沿用直線計畫比較
+        daily_growth = (TARGET_DIFFICULTY - START_DIFFICULTY) / days_total
+        days_gap = int((current_difficulty - expected_diff_now) / daily_growth)
 
     # 恢復 v0.0.14 生動的語氣
+    forecast_note = f" (預測：{format_sprint_forecast(eta)})" if eta else ""
     status_msg = ""
     if days_gap >= 5:
-        status_msg = f"🔥 超前進度：你比預期快了 {days_gap} 天！保持這種神速，N2 根本是囊中之物！"
+        status_msg = f"🔥 超前進度：你比預期快了 {days_gap} 天！保持這種神速，N2 根本是囊中之物！{forecast_note}"
     elif days_gap <= -5:
-        status_msg = f"⚠️ 落後警報：你已經落後計畫 {abs(days_gap)} 天了！距離 N2 越來越遠囉？皮繃緊一點！"
+        status_msg = f"⚠️ 落後警報：你已經落後計畫 {abs(days_gap)} 天了！距離 N2 越來越遠囉？皮繃緊一點！{forecast_note}"
     else:
-        status_msg = f"✅ 進度正常：穩步邁向 N2 中，請繼續保持這份節奏。"
+        status_msg = f"✅ 進度正常：穩步邁向 N2 中，請繼續保持這份節奏。{forecast_note}"
 
     return days_passed, expected_diff_now, status_msg
 
+# ================= 單字權重 (Lazy Time Decay) =================
+
+def word_weight(word, today=None):
+    """
+    讀取時才計算的衰減權重。count 是 count_ts 那天的權重，
+    高出基準值的部分依半衰期指數衰減，不需要每次執行掃過整個單字庫。
+    """
+    value = float(word.get("count", WEIGHT_BASELINE))
+    if value <= WEIGHT_BASELINE: return value
+    # WordRecord 的日期已經是日序，不必逐筆解析字串
+    day = word.weight_day() if isinstance(word, WordRecord) else date_ordinal(word.get("count_ts") or word.get("added_date"))
+    if day is None: return value
+    days = (today or now_tw().date()).toordinal() - day
+    if days <= 0: return value
+    return WEIGHT_BASELINE + (value - WEIGHT_BASELINE) * 0.5 ** (days / WEIGHT_HALF_LIFE_DAYS)
+
+def adjust_word_weight(word, delta, today_str):
+    # 先把到今天為止的衰減結算進 count，再套用這次的增減
+    today = datetime.strptime(today_str, "%Y-%m-%d").date()
+    word["count"] = round(max(WEIGHT_BASELINE, word_weight(word, today) + delta), 3)
+    word["count_ts"] = today_str
+
+# ================= 能力估計 (Elo / IRT) =================
+# 每一題的分數視為連續結果 y = score / 10，答對機率 P = σ(a·(θ - b))，
+# θ 是使用者能力、b 是出題時的難度。出題難度取「預期得分剛好是 ABILITY_TARGET_SCORE」的位置：
+#     difficulty = θ - logit(p*) / a
+
+ABILITY_DIRECTIONS = {"CN_TO_JP": "difficulty_cn_jp", "JP_TO_CN": "difficulty_jp_cn"}
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + math.exp(-x))
+
+def _target_offset():
+    p = ABILITY_TARGET_SCORE / 10.0
+    return math.log(p / (1.0 - p)) / ABILITY_SLOPE
+
+def ability_to_difficulty(theta):
+    return round(min(8.0, max(1.0, theta - _target_offset())), 3)
+
+def difficulty_to_ability(difficulty):
+    return float(difficulty) + _target_offset()
+
+def new_ability_model(stats):
+    model = {"fitted_day": ""}
+    for q_type, key in ABILITY_DIRECTIONS.items():
+        theta = difficulty_to_ability(stats.get(key, START_DIFFICULTY))
+        model[q_type] = {"theta": theta, "prior": theta, "since": "", "n": 0}
+    return model
+
+def elo_update(state, score, difficulty):
+    # O(1) 線上更新：預期與實際得分的差乘上 K
+    expected = _sigmoid(ABILITY_SLOPE * (state["theta"] - difficulty))
+    state["theta"] += ABILITY_K * (score / 10.0 - expected)
+    state["n"] += 1
+
+def fit_ability(scores, difficulties, ages, prior):
+    """
+    以整段歷史做加權最大概似估計 (牛頓法)：越舊的作答權重越低 (半衰期 ABILITY_HALF_LIFE_DAYS)，
+    並以 prior 為中心加上高斯先驗，資料少時不會亂跳。有 NumPy 時整批向量化計算。
+    """
+    if not scores: return prior
+    theta = prior
+    inv_var = 1.0 / (ABILITY_PRIOR_SD ** 2)
+    if np is not None:
+        y = np.asarray(scores, dtype=float) / 10.0
+        b = np.asarray(difficulties, dtype=float)
+        w = 0.5 ** (np.asarray(ages, dtype=float) / ABILITY_HALF_LIFE_DAYS)
+        for _ in range(ABILITY_FIT_ITERATIONS):
+            p = 1.0 / (1.0 + np.exp(-ABILITY_SLOPE * (theta - b)))
+            grad = ABILITY_SLOPE * float(np.dot(w, y - p)) - (theta - prior) * inv_var
+            hess = -(ABILITY_SLOPE ** 2) * float(np.dot(w, p * (1.0 - p))) - inv_var
+            step = grad / hess
+            theta -= step
+            if abs(step) < 1e-6: break
+        return theta
+    weights = [0.5 ** (age / ABILITY_HALF_LIFE_DAYS) for age in ages]
+    for _ in range(ABILITY_FIT_ITERATIONS):
+        grad, hess = -(theta - prior) * inv_var, -inv_var
+        for score, difficulty, weight in zip(scores, difficulties, weights):
+            p = _sigmoid(ABILITY_SLOPE * (theta - difficulty))
+            grad += ABILITY_SLOPE * weight * (score / 10.0 - p)
+            hess -= (ABILITY_SLOPE ** 2) * weight * p * (1.0 - p)
+        step = grad / hess
+        theta -= step
+        if abs(step) < 1e-6: break
+    return theta
+
+PENDING_ASSESSMENTS = []
+
+def record_assessment(user_data, q_type, score, status, difficulty, today_str, text=""):
+    # 每一題都留下紀錄並更新滾動統計；只有 ATTEMPTED 會進能力模型 (防偷懶)
+    record = {
+        "ts": now_tw().isoformat(timespec="seconds"), "day": today_str, "answer_id": answer_id(text),
+        "type": q_type, "score": score, "status": status, "difficulty": difficulty,
+    }
+    add_assessment_to_buckets(user_data, record)
+    PENDING_ASSESSMENTS.append(record)
+    if status == "ATTEMPTED" and q_type in ABILITY_DIRECTIONS:
+        elo_update(user_data["ability_model"][q_type], score, difficulty)
+
+def iter_assessments():
+    if os.path.exists(ASSESSMENTS_FILE):
+        with open(ASSESSMENTS_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                try: yield json.loads(line)
+                except ValueError: continue # 中斷時留下的殘行
+    yield from PENDING_ASSESSMENTS
+
+def prepare_assessment_commit():
+    # 取出這次執行的評分紀錄組成待追加的行；實際寫入跟著 save_state() 的提交標記一起生效
+    global PENDING_ASSESSMENTS
+    records, PENDING_ASSESSMENTS = PENDING_ASSESSMENTS, []
+    return [get_serializer().dumps_compact(record) for record in records]
+
+def refit_ability_model(user_data, today_str):
+    # 每天一次整批重新擬合，修正線上更新累積的順序偏差
+    model = user_data["ability_model"]
+    if model.get("fitted_day") == today_str: return
+    today = datetime.strptime(today_str, "%Y-%m-%d").date()
+    history = {q_type: ([], [], []) for q_type in ABILITY_DIRECTIONS}
+    for a in iter_assessments():
+        state = model.get(a.get("type"))
+        if state is None or a.get("status") != "ATTEMPTED" or a.get("ts", "") < state["since"]: continue
+        scores, difficulties, ages = history[a["type"]]
+        scores.append(float(a["score"]))
+        difficulties.append(float(a["difficulty"]))
+        ages.append(max(0, (today - datetime.strptime(a["day"], "%Y-%m-%d").date()).days))
+    for q_type, (scores, difficulties, ages) in history.items():
+        state = model[q_type]
+        state["theta"] = fit_ability(scores, difficulties, ages, state["prior"])
+        state["n"] = len(scores)
+    model["fitted_day"] = today_str
+
+def reset_ability(user_data, q_type, difficulty):
+    # [LV] / [RE] 手動調整：以新難度為起點，之前的作答不再拉回舊能力值
+    state = user_data["ability_model"][q_type]
+    state["theta"] = state["prior"] = difficulty_to_ability(difficulty)
+    state["since"] = now_tw().isoformat(timespec="seconds")
+    state["n"] = 0
+
+def sync_difficulty_from_ability(user_data):
+    # 雙軌難度由能力模型決定，改變時才寫入 stats 事件
+    model = user_data["ability_model"]
+    for q_type, key in ABILITY_DIRECTIONS.items():
+        difficulty = ability_to_difficulty(model[q_type]["theta"])
+        if user_data["stats"].get(key) != difficulty: stat_set(user_data["stats"], key, difficulty)
+
+# ================= 作答紀錄滾動統計 (Rolling Aggregates) =================
+# 每天一個桶 {方向: [總分, 題數]} + 跳過數，只保留最近 ASSESSMENT_WINDOW_DAYS 天。
+# 新增一題是 O(1)，查詢最多掃 ASSESSMENT_WINDOW_DAYS 個桶，與歷史長度無關。
+
+def answer_id(text):
+    # 作答內容的 ID：同一句作答 (例如重新批改) 永遠得到同一個 ID。批改結果只帶作答原文、不帶題號，所以不是題目 ID
+    return hashlib.sha1(normalize_text(text or "").encode("utf-8")).hexdigest()[:12]
+
+def _bucket_add(buckets, record):
+    bucket = buckets.setdefault(record["day"], {"skipped": 0, "total": 0})
+    bucket["total"] += 1
+    if record.get("status") != "ATTEMPTED":
+        bucket["skipped"] += 1
+    elif record.get("type") in ABILITY_DIRECTIONS:
+        totals = bucket.setdefault(record["type"], [0.0, 0])
+        totals[0] = round(totals[0] + float(record["score"]), 3)
+        totals[1] += 1
+
+def _prune_buckets(buckets, today_str):
+    cutoff = str(datetime.strptime(today_str, "%Y-%m-%d").date() - timedelta(days=ASSESSMENT_WINDOW_DAYS - 1))
+    for day in [d for d in buckets if d < cutoff]: del buckets[day]
+
+def rebuild_assessment_buckets(today_str):
+    # 從 assessments.jsonl 補建最近的桶 (遷移時使用)
+    buckets = {}
+    for record in iter_assessments(): _bucket_add(buckets, record)
+    _prune_buckets(buckets, today_str)
+    return buckets
+
+def add_assessment_to_buckets(user_data, record):
+    buckets = user_data["assessment_buckets"]
+    is_new_day = record["day"] not in buckets
+    _bucket_add(buckets, record)
+    if is_new_day: _prune_buckets(buckets, record["day"])
+
+def assessment_aggregates(user_data, today_str=None):
+    """
+    最近 7 / 30 天的平均分、跳過率，以及各方向趨勢 (近 7 天平均 - 前 8~30 天平均)。
+    """
+    today_str = today_str or str(now_tw().date())
+    buckets = user_data["assessment_buckets"]
+    today = datetime.strptime(today_str, "%Y-%m-%d").date()
+    week_start = str(today - timedelta(days=6))
+    month_start = str(today - timedelta(days=ASSESSMENT_WINDOW_DAYS - 1))
+
+    def window(start, end=None, q_types=ABILITY_DIRECTIONS):
+        score_sum = count = skipped = total = 0
+        for day, bucket in buckets.items():
+            if day < start or (end is not None and day >= end) or day > today_str: continue
+            skipped += bucket["skipped"]
+            total += bucket["total"]
+            for q_type in q_types:
+                if q_type in bucket:
+                    score_sum += bucket[q_type][0]
+                    count += bucket[q_type][1]
+        return (round(score_sum / count, 2) if count else None), count, (round(skipped / total, 3) if total else None)
+
+    mean_7d, n_7d, skip_7d = window(week_start)
+    mean_30d, n_30d, skip_30d = window(month_start)
+    trend = {}
+    for q_type in ABILITY_DIRECTIONS:
+        recent, _, _ = window(week_start, q_types=[q_type])
+        earlier, _, _ = window(month_start, week_start, q_types=[q_type])
+        trend[q_type] = round(recent - earlier, 2) if recent is not None and earlier is not None else None
+    return {
+        "mean_7d": mean_7d, "n_7d": n_7d, "skip_rate_7d": skip_7d,
+        "mean_30d": mean_30d, "n_30d": n_30d, "skip_rate_30d": skip_30d,
+        "trend": trend,
+    }
+
+def format_assessment_aggregates(agg):
+    def fmt(value, pct=False):
+        if value is None: return "-"
+        return f"{value * 100:.0f}%" if pct else f"{value:.1f}"
+    def fmt_trend(value):
+        return "-" if value is None else f"{value:+.1f}"
+    return (f"近 7 天平均 {fmt(agg['mean_7d'])} 分 ({agg['n_7d']} 句，跳過率 {fmt(agg['skip_rate_7d'], True)})；"
+            f"近 30 天平均 {fmt(agg['mean_30d'])} 分 ({agg['n_30d']} 句，跳過率 {fmt(agg['skip_rate_30d'], True)})；"
+            f"趨勢 中翻日 {fmt_trend(agg['trend'].get('CN_TO_JP'))} / 日翻中 {fmt_trend(agg['trend'].get('JP_TO_CN'))}")
+
+# ================= 技能弱點 (Skill Tags) =================
+# 每個技能只存 {"v": 衰減後的錯誤數, "ts": 上次更新日}，與 word_weight 一樣在讀取時才衰減。
+
+def skill_tags(mistake):
+    # 只接受 SKILL_TAGS 內的標籤 (AI 偶爾回傳字串或未知標籤)
+    tags = mistake.get("skills", [])
+    if isinstance(tags, str): tags = [tags]
+    if not isinstance(tags, list): return []
+    result = []
+    for tag in tags:
+        tag = str(tag).strip().lower()
+        if tag in SKILL_TAGS and tag not in result: result.append(tag)
+    return result
+
+def skill_value(entry, today):
+    days = (today - datetime.strptime(entry["ts"], "%Y-%m-%d").date()).days
+    return entry["v"] * 0.5 ** (max(0, days) / SKILL_HALF_LIFE_DAYS)
+
+def bump_skill(counters, tag, today_str):
+    today = datetime.strptime(today_str, "%Y-%m-%d").date()
+    entry = counters.get(tag)
+    value = skill_value(entry, today) if entry else 0.0
+    counters[tag] = {"v": round(value + 1.0, 3), "ts": today_str}
+
+def rank_weak_skills(counters, today_str):
+    # 依衰減後的錯誤數由高到低排序，在批改時預先算好，出題時直接取用
+    today = datetime.strptime(today_str, "%Y-%m-%d").date()
+    scored = [(skill_value(entry, today), tag) for tag, entry in counters.items() if tag in SKILL_TAGS]
+    return [tag for value, tag in sorted(scored, reverse=True) if value >= 0.5]
+
+def format_skill_focus(ranking, limit=QUIZ_FOCUS_SKILLS):
+    return "、".join(SKILL_TAGS[tag] for tag in ranking[:limit])
+
+# ================= 學習者輪廓 (Learner Profile) =================
+
+def new_learner_profile():
+    return {
+        "mistake_terms": {},   # 反覆出錯的詞/文法
+        "mistake_types": {},   # 錯誤類型分佈 (word / grammar)
+        "strengths": {},       # 在作答中用對的庫存詞
+        "vocab_gaps": {},      # 不在單字庫、第一次出錯才收錄的詞
+        "scores": {},          # 各方向的平均分 {"CN_TO_JP": {"n": 0, "avg": 0.0}}
+        "skills": {},          # 技能錯誤計數 {"particle": {"v": 2.5, "ts": "2026-01-01"}}
+        "weak_skills": [],     # 依衰減計數排好的弱點技能
+        "skipped": 0,
+        "archived_entries": 0,
+        "updated": "",
+    }
+
+def _bump_counter(counter, key, amount=1):
+    # dict 順序即最近出現順序：被計數的項目移到最後，滿了就淘汰最久沒出現的項目 (剛計數的這項一定留下)。
+    # 若改成淘汰次數最少的，新出現的詞 (次數 1) 會立刻被踢掉，輪廓滿了之後就再也不會變。
+    counter[key] = counter.pop(key, 0) + amount
+    while len(counter) > PROFILE_MAX_ITEMS:
+        del counter[next(iter(counter))]
+
+def update_learner_profile(user_data, parsed_data, correct_terms, new_terms, today_str):
+    profile = user_data["learner_profile"]
+
+    for m in (parsed_data or {}).get("mistakes", []) or []:
+        term = m.get("term", "")
+        if not term: continue
+        _bump_counter(profile["mistake_terms"], term)
+        _bump_counter(profile["mistake_types"], m.get("type", "word"))
+        for tag in skill_tags(m):
+            bump_skill(profile["skills"], tag, today_str)
+    for term in new_terms:
+        _bump_counter(profile["vocab_gaps"], term)
+    for term in correct_terms:
+        _bump_counter(profile["strengths"], term)
+        # 用對了就不再算缺口
+        profile["vocab_gaps"].pop(term, None)
+
+    assessments = (parsed_data or {}).get("assessments", [])
+    for item in assessments if isinstance(assessments, list) else []:
+        if item.get("status", "ATTEMPTED") != "ATTEMPTED":
+            profile["skipped"] += 1
+            continue
+        q_type = item.get("type", "")
+        if q_type not in ["CN_TO_JP", "JP_TO_CN"]: continue
+        entry = profile["scores"].setdefault(q_type, {"n": 0, "avg": 0.0})
+        entry["n"] += 1
+        entry["avg"] = round(entry["avg"] + (float(item.get("score", 0.0)) - entry["avg"]) / entry["n"], 3)
+
+    profile["weak_skills"] = rank_weak_skills(profile["skills"], today_str)
+    # 近期表現直接取滾動統計，prompt 不必再從原始紀錄重算
+    profile["rolling"] = assessment_aggregates(user_data, today_str)
+    profile["updated"] = today_str
+    return profile
+
+def render_learner_profile(profile, recent_logs=None, relevant_logs=None):
+    """
+    把輪廓壓成固定大小的文字 (每類最多 PROFILE_PROMPT_ITEMS 項 + 少量最新原文)。
+    """
+    def top(counter):
+        items = sorted(counter.items(), key=lambda kv: kv[1], reverse=True)[:PROFILE_PROMPT_ITEMS]
+        return "、".join(f"{k}({v})" for k, v in items) if items else "(無)"
+
+    lines = []
+    if profile:
+        score_parts = []
+        for q_type, label in [("CN_TO_JP", "中翻日"), ("JP_TO_CN", "日翻中")]:
+            entry = profile.get("scores", {}).get(q_type)
+            if entry: score_parts.append(f"{label} {entry['avg']:.1f} 分 (共 {entry['n']} 句)")
+        lines.append(f"📌 反覆出錯：{top(profile.get('mistake_terms', {}))}")
+        lines.append(f"📌 錯誤類型：{top(profile.get('mistake_types', {}))}")
+        if profile.get("weak_skills"): lines.append(f"🧩 弱點技能：{format_skill_focus(profile['weak_skills'], PROFILE_PROMPT_ITEMS)}")
+        lines.append(f"💪 已掌握：{top(profile.get('strengths', {}))}")
+        lines.append(f"🕳️ 詞彙缺口：{top(profile.get('vocab_gaps', {}))}")
+        lines.append(f"📈 平均分：{'、'.join(score_parts) if score_parts else '(尚無)'}；放棄作答 {profile.get('skipped', 0)} 句")
+        if profile.get("rolling"): lines.append(f"📆 {format_assessment_aggregates(profile['rolling'])}")
+    recent_set = set((recent_logs or [])[-PROFILE_RECENT_LOGS:])
+    relevant_logs = [l for l in (relevant_logs or []) if l not in recent_set]
+    if relevant_logs:
+        lines.append("🔎 與本次內容相關的過往作答：")
+        lines.extend(relevant_logs)
+    if recent_logs:
+        lines.append("🕘 最近作答：")
+        lines.extend(recent_logs[-PROFILE_RECENT_LOGS:])
+    return "\n".join(lines) if lines else "(尚無歷史紀錄)"
+
+# ================= 歷史作答向量索引 (Retrieval) =================
+
+class HistoryIndex:
+    """
+    本機字元 n-gram 雜湊向量索引 (純 CPU、無外部模型)。
+    收錄完整翻譯歷史 (含歸檔) 與過往錯誤，批改時只取與本次作答最相似的 top-k 筆進 prompt。
+    歸檔部分存成 HISTORY_INDEX_FILE (只記每筆在歸檔中的位元組位置，文字命中時才讀)，
+    每次執行只補上新追加的歸檔行；translation_log 與錯誤詞在記憶體中疊加，不存檔。
+    """
+    MAGIC = b"DJHIDX01"
+    HEADER = struct.Struct("<8sIQII") # magic, 設定雜湊, 已收錄的歸檔大小, 歸檔筆數, posting 數
+    POSTING = struct.Struct("<II")    # 特徵, 筆數
+
+    def __init__(self, dim=INDEX_DIM):
+        self.dim = dim
+        self.archive_offsets = array("Q") # 歸檔筆號 -> 在歸檔檔案中的位元組位置
+        self.archive_size = 0             # 已收錄到歸檔的哪個位元組 (只算完整的行)
+        self.entries = []                 # 疊加的筆 {"date", "text", "kind"}，筆號接在歸檔之後
+        self.postings = {}                # idx -> (array 筆號, array 權重)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def config_tag(cls, dim):
+        # 維度或 n-gram 設定改變時舊索引檔自動作廢
+        return zlib.crc32(repr((dim, INDEX_NGRAMS)).encode("utf-8"))
+
+    def __len__(self):
+        return len(self.archive_offsets) + len(self.entries)
+
+    def vectorize(self, text):
+        text = normalize_text(text)
+        counts = {}
+        for n in INDEX_NGRAMS:
+            for i in range(len(text) - n + 1):
+                gram = text[i:i + n]
+                if gram.isspace(): continue
+                idx = zlib.crc32(gram.encode("utf-8")) % self.dim
+                counts[idx] = counts.get(idx, 0) + 1
+        return counts
+
+    def _post(self, entry_id, counts):
+        weights = {idx: 1.0 + math.log(tf) for idx, tf in counts.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        for idx, w in weights.items():
+            posting = self.postings.get(idx)
+            if posting is None:
+                posting = self.postings[idx] = (array("I"), array("f"))
+            posting[0].append(entry_id)
+            posting[1].append(w / norm)
+
+    def add(self, text, date_str, kind="attempt"):
+        if not text or not text.strip(): return
+        counts = self.vectorize(text)
+        if not counts: return
+        with self.lock:
+            entry_id = len(self)
+            self.entries.append({"date": date_str, "text": text, "kind": kind})
+            self._post(entry_id, counts)
+
+    def catch_up_archive(self, path=TRANSLATION_ARCHIVE_FILE):
+        """
+        把 archive_size 之後新追加的完整歸檔行加進索引，回傳新增了幾行。
+        必須在疊加任何 translation_log / 錯誤詞之前呼叫 (歸檔筆號要排在最前面)。
+        """
+        if self.entries: raise RuntimeError("catch_up_archive must run before overlay entries are added")
+        if not os.path.exists(path): return 0
+        added = 0
+        with open(path, "rb") as f:
+            f.seek(self.archive_size)
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                # 寫到一半的尾行 (提交中斷) 先不收，等 recover_state 補完後下次再收
+                if not line.endswith(b"\n"): break
+                self.archive_size = f.tell()
+                try: item = json.loads(line)
+                except ValueError: continue
+                counts = self.vectorize(item.get("text", ""))
+                if not counts: continue
+                self._post(len(self.archive_offsets), counts)
+                self.archive_offsets.append(offset)
+                added += 1
+        return added
+
+    def _archive_entry(self, f, entry_id):
+        f.seek(self.archive_offsets[entry_id])
+        item = json.loads(f.readline())
+        return {"date": item.get("date", ""), "text": item.get("text", ""), "kind": "attempt"}
+
+    def search(self, query, k=RETRIEVAL_TOP_K):
+        counts = self.vectorize(query)
+        total = len(self)
+        if not counts or not total: return []
+        scores = {}
+        max_df = max(1, int(total * INDEX_MAX_DF_RATIO))
+        for idx, tf in counts.items():
+            posting = self.postings.get(idx)
+            # 幾乎每筆都有的 n-gram (助詞、語尾) 幾乎沒有鑑別力，略過以省下大部分時間
+            if not posting or (len(posting[0]) > max_df and total > 1000): continue
+            ids, weights = posting
+            q_w = (1.0 + math.log(tf)) * math.log(1.0 + total / len(ids))
+            get = scores.get
+            for entry_id, w in zip(ids, weights):
+                scores[entry_id] = get(entry_id, 0.0) + q_w * w
+        best = heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+        n_archive = len(self.archive_offsets)
+        results = []
+        archive = open(TRANSLATION_ARCHIVE_FILE, "rb") if any(i < n_archive for i, _ in best) else None
+        try:
+            for i, sc in best:
+                entry = self._archive_entry(archive, i) if i < n_archive else self.entries[i - n_archive]
+                results.append(dict(entry, score=round(sc, 4)))
+        finally:
+            if archive: archive.close()
+        return results
+
+    def save(self, path):
+        # 只存歸檔部分；暫存檔寫完再 os.replace，中途失敗不會留下壞掉的索引檔
+        if self.entries: raise RuntimeError("save must run before overlay entries are added")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.config_tag(self.dim), self.archive_size,
+                                     len(self.archive_offsets), len(self.postings)))
+            f.write(self.archive_offsets.tobytes())
+            for idx, (ids, weights) in self.postings.items():
+                f.write(self.POSTING.pack(idx, len(ids)))
+                f.write(ids.tobytes())
+                f.write(weights.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, archive_path=TRANSLATION_ARCHIVE_FILE, dim=INDEX_DIM):
+        """
+        讀回索引檔；檔案不存在、設定不同，或歸檔比當時短/內容對不上 (被改寫過) 時回傳 None，由呼叫端重建。
+        """
+        if not os.path.exists(path) or not os.path.exists(archive_path): return None
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < cls.HEADER.size: return None
+        magic, tag, archive_size, n_entries, n_postings = cls.HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC or tag != cls.config_tag(dim): return None
+        if os.path.getsize(archive_path) < archive_size: return None
+        if archive_size:
+            with open(archive_path, "rb") as f:
+                f.seek(archive_size - 1)
+                if f.read(1) != b"\n": return None
+        index = cls(dim)
+        index.archive_size = archive_size
+        pos = cls.HEADER.size
+        index.archive_offsets.frombytes(data[pos:pos + 8 * n_entries])
+        pos += 8 * n_entries
+        for _ in range(n_postings):
+            idx, count = cls.POSTING.unpack_from(data, pos)
+            pos += cls.POSTING.size
+            ids, weights = array("I"), array("f")
+            ids.frombytes(data[pos:pos + 4 * count]); pos += 4 * count
+            weights.frombytes(data[pos:pos + 4 * count]); pos += 4 * count
+            index.postings[idx] = (ids, weights)
+        return index
+
+HISTORY_INDEX = None
+
+def reset_history_index():
+    # 每次執行從索引檔重新載入 (與 GitHub Actions 一次執行一個行程相同)
+    global HISTORY_INDEX
+    HISTORY_INDEX = None
+
+def get_history_index(user_data=None, exclude_recent=0):
+    """
+    第一次需要檢索時 (批改或 [LV]) 才建立：歸檔部分從 HISTORY_INDEX_FILE 載入並只補上新追加的歸檔行，
+    再疊加 translation_log (不含本次執行剛收到、之後才收錄的 exclude_recent 筆) 與錯誤詞。
+    """
+    global HISTORY_INDEX
+    if HISTORY_INDEX is None:
+        with TRACER.span("history_index") as attrs:
+            try: index = HistoryIndex.load(HISTORY_INDEX_FILE)
+            except (OSError, ValueError, struct.error) as e:
+                print(f"⚠️ 檢索索引讀取失敗，重建: {e}")
+                index = None
+            attrs["loaded"] = index is not None
+            if index is None: index = HistoryIndex()
+            attrs["new_archive_lines"] = index.catch_up_archive()
+            if attrs["new_archive_lines"] or not attrs["loaded"]:
+                try: index.save(HISTORY_INDEX_FILE)
+                except OSError as e: print(f"⚠️ 檢索索引存檔失敗: {e}")
+            log = (user_data or {}).get("translation_log", [])
+            for entry in log[:len(log) - exclude_recent]:
+                date_str, _, text = entry.partition(": ")
+                index.add(text, date_str)
+            for term in (user_data or {}).get("learner_profile", {}).get("mistake_terms", {}):
+                index.add(term, "", "mistake")
+            attrs["entries"] = len(index)
+        HISTORY_INDEX = index
+    return HISTORY_INDEX
+
+def retrieve_relevant_history(query, k=RETRIEVAL_TOP_K):
+    if HISTORY_INDEX is None or not query: return []
+    return [f"{hit['date']}: {hit['text'][:100]}" if hit["kind"] == "attempt" else f"❌ 曾錯：{hit['text']}"
+            for hit in HISTORY_INDEX.search(query, k)]
+
 # ================= AI 核心功能 =================
 
-def assess_user_level(history_logs, specific_request=None):
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel(MODEL_NAME)
+def _finite_float(text):
+    value = float(text)
+    if not math.isfinite(value): raise ValueError(f"non-finite number: {text}")
+    return value
+
+def _reject_constant(name):
+    raise ValueError(f"non-finite number: {name}")
+
+def loads_model_json(text):
+    # AI 回傳的 JSON 一律經過這裡：NaN / Infinity / 1e999 這類非有限數值直接視為格式錯誤，不會流進狀態檔
+    return json.loads(text, parse_float=_finite_float, parse_constant=_reject_constant)
+
+def assess_user_level(history_logs, specific_request=None, learner_profile=None):
+    model = get_model()
     
     print("🧠 AI 正在進行全盤能力評估...")
     log_to_buffer("🧠 AI", "執行能力評估 ([LV])")
@@ -209,7 +1785,10 @@ def assess_user_level(history_logs, specific_request=None):
             val = float(match.group(1))
             return val, f"收到指令，難度設定為 Lv{val}。"
 
-    history_text = "\n".join(history_logs[-50:])
+    # 以反覆出錯的項目為查詢，撈出最能佐證弱點的過往作答
+    weak_query = " ".join((learner_profile or {}).get("mistake_terms", {}).keys())
+    relevant = retrieve_relevant_history(weak_query, RETRIEVAL_TOP_K * 2)
+    history_text = render_learner_profile(learner_profile, history_logs, relevant)
     
     # 使用變數替換避免 Markdown 截斷
     json_marker = "```"
@@ -218,7 +1797,7 @@ def assess_user_level(history_logs, specific_request=None):
     prompt = f"""
     你是日文 N2 斯巴達教練。使用者要求重新評估她的日文等級。
     
-    【使用者的歷史翻譯紀錄】
+    【使用者的學習輪廓 (長期累積) 與最近紀錄】
     {history_text}
     
     請根據這些紀錄，客觀且嚴格地判斷她的日文程度。
@@ -242,9 +1821,9 @@ def assess_user_level(history_logs, specific_request=None):
     """
     
     try:
-        response = model.generate_content(prompt, safety_settings=SAFETY_SETTINGS)
+        response = ai_generate(model, prompt, "assess")
         clean_text = response.text.replace("```json", "").replace("```", "").strip()
-        result = json.loads(clean_text)
+        result = loads_model_json(clean_text)
         return float(result["new_difficulty"]), result["reason"]
     except Exception as e:
         print(f"評估失敗: {e}")
@@ -254,8 +1833,7 @@ def handle_custom_request(user_text, current_stats):
     """
     [RE] 功能：處理使用者的客製化請求 (調整難度或指定出題方向)
     """
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel(MODEL_NAME)
+    model = get_model()
     
     print("🧠 AI 正在處理客製化請求...")
     log_to_buffer("🧠 AI", f"處理請求: {user_text}")
@@ -300,20 +1878,20 @@ def handle_custom_request(user_text, current_stats):
     """
 
     try:
-        response = model.generate_content(prompt, safety_settings=SAFETY_SETTINGS)
+        response = ai_generate(model, prompt, "request")
         return response.text if response.text else "⚠️ AI 回應失敗"
     except Exception as e:
         return f"⚠️ AI 處理錯誤: {e}"
 
-def ai_correction(user_text, translation_history, progress_status):
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel(MODEL_NAME)
+def ai_correction(user_text, translation_history, progress_status, learner_profile=None):
+    model = get_model()
     
     print(f"🤖 AI 正在批改 (進度 {progress_status})...")
-    history_str = "\n".join(translation_history[-10:]) if translation_history else "(尚無歷史紀錄)"
+    history_str = render_learner_profile(learner_profile, translation_history, retrieve_relevant_history(user_text))
 
     # 使用變數替換避免 Markdown 截斷
     json_marker = "```"
+    skill_tag_list = ", ".join(f"{tag} ({label})" for tag, label in SKILL_TAGS.items())
     
     # 🔥 斯巴達教練 Prompt - v0.0.25 (保留語感加分與錯誤懲罰分離) + v0.0.27 (創意鎖定)
     prompt = f"""
@@ -376,7 +1954,7 @@ def ai_correction(user_text, translation_history, progress_status):
        {json_marker}json
        {{
          "mistakes": [
-            {{ "term": "誤用詞", "type": "word", "meaning": "詞意" }}
+            {{ "term": "誤用詞", "type": "word", "meaning": "詞意", "skills": ["particle"] }}
          ],
          "assessments": [
             {{
@@ -395,6 +1973,7 @@ def ai_correction(user_text, translation_history, progress_status):
        }}
        {json_marker}
        - **status**: 若輸入為空白、"不知道"、"..." 等明顯未作答，標記為 "SKIPPED"。否則為 "ATTEMPTED"。
+       - **skills**: 每個 mistake 標註 1~2 個技能標籤，只能從以下英文代碼中選：{skill_tag_list}。
     
     【格式嚴格要求】
     1. **語言**：解說與評語請全程使用「繁體中文」(Traditional Chinese)。
@@ -405,58 +1984,430 @@ def ai_correction(user_text, translation_history, progress_status):
     """
     
     try:
-        response = model.generate_content(prompt, safety_settings=SAFETY_SETTINGS)
+        response = ai_generate(model, prompt, "correction")
         return response.text if response.text else "⚠️ AI 批改失敗"
     except Exception as e:
         return f"⚠️ AI 批改錯誤: {e}"
 
+def parse_correction_result(raw_result):
+    # 拆出批改評語與結尾的 JSON 區塊；沒有 JSON 代表批改失敗
+    json_match = re.search(r"```json\s*(\{.*?\})\s*```", raw_result, re.DOTALL)
+    if not json_match: return raw_result, None
+    try:
+        parsed_data = loads_model_json(json_match.group(1))
+    except Exception:
+        return raw_result, None
+    return raw_result.replace(json_match.group(0), "").strip(), parsed_data
+
+def segment_submission(texts):
+    # 與答題計數相同的規則：每一行 (長度 > 1) 視為一句回答
+    sentences = []
+    for text in texts:
+        sentences.extend(l.strip() for l in text.split('\n') if len(l.strip()) > 1)
+    return sentences
+
+def grade_one_batch(batch, history_context, progress_str, learner_profile=None):
+    raw_result = ai_correction("\n".join(batch), history_context, progress_str, learner_profile)
+    feedback, parsed_data = parse_correction_result(raw_result)
+    if parsed_data is None:
+        raise ValueError(raw_result[:100])
+    return feedback, parsed_data
+
+def merge_correction_results(results):
+    """
+    依句子順序合併各批的批改結果：mistakes 以正規化後的詞去重 (保留第一次出現)，
+    assessments 依原句順序串接，確保合併結果與執行緒完成順序無關。
+    """
+    merged = {"mistakes": [], "assessments": []}
+    seen_terms = set()
+    for _, parsed_data in results:
+        for m in parsed_data.get("mistakes", []) or []:
+            key = normalize_text(m.get("term", ""))
+            if key and key not in seen_terms:
+                seen_terms.add(key)
+                merged["mistakes"].append(m)
+        assessments = parsed_data.get("assessments", [])
+        if isinstance(assessments, list):
+            merged["assessments"].extend(assessments)
+    return merged
+
+def grade_sentences_parallel(sentences, history_context, progress_str, learner_profile=None, batch_size=GRADING_BATCH_SIZE):
+    """
+    分批批改並重試失敗的批次；回傳 (評語, 合併後的 JSON, 重試後仍失敗的句子)。
+    短篇作業以 batch_size = 句數呼叫 (整份一次批改)，同樣享有重試與重批佇列。全部失敗時 JSON 為 None。
+    """
+    batches = [sentences[i:i + batch_size] for i in range(0, len(sentences), batch_size)]
+    results = [None] * len(batches)
+    todo = list(range(len(batches)))
+
+    # Map：有上限的平行批改；失敗的批次單獨重試
+    for attempt in range(1 + GRADING_MAX_RETRIES):
+        if not todo: break
+        with ThreadPoolExecutor(max_workers=GRADING_CONCURRENCY) as pool:
+            futures = {idx: pool.submit(TRACER.bind(grade_one_batch), batches[idx], history_context, progress_str, learner_profile) for idx in todo}
+        failed = []
+        for idx, future in futures.items():
+            try:
+                results[idx] = future.result()
+            except Exception as e:
+                log_to_buffer("⚠️ Err", f"Batch {idx + 1} grading failed (attempt {attempt + 1}): {e}")
+                failed.append(idx)
+        todo = failed
+
+    # Reduce：依句子順序組合評語與 JSON
+    feedback_blocks = []
+    for idx, result in enumerate(results):
+        first = idx * batch_size + 1
+        label = f"🔹 第 {first}-{first + len(batches[idx]) - 1} 句" if len(batches[idx]) > 1 else f"🔹 第 {first} 句"
+        body = result[0] if result else "⚠️ 這批批改失敗，下次執行會單獨重新批改。"
+        feedback_blocks.append(f"{label}\n{body}" if len(batches) > 1 else body)
+
+    graded = [r for r in results if r]
+    failed_sentences = [sentence for idx in todo for sentence in batches[idx]]
+    return "\n\n".join(feedback_blocks), merge_correction_results(graded) if graded else None, failed_sentences
+
+# ================= 離線 JLPT 字典 (mmap + 二分搜尋) =================
+
+class JlptDictionary:
+    """
+    排序後的二進位字典，以 mmap 開啟、二分搜尋查詢，不需要整份載入記憶體。
+    格式：MAGIC | uint32 筆數 | uint32 保留 | uint32 偏移表 × 筆數 | 記錄 (key\\tkanji\\tkana\\tmeaning\\tlevel\\n)
+    每個詞以漢字與讀音 (正規化後) 各建一筆索引。
+    """
+    MAGIC = b"JLPTDIC1"
+    HEADER = struct.Struct("<8sII")
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, _ = self.HEADER.unpack_from(self.mm, 0)
+        if magic != self.MAGIC: raise ValueError(f"bad dictionary file: {path}")
+        self.table = self.HEADER.size
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def _offset(self, i):
+        return struct.unpack_from("<I", self.mm, self.table + 4 * i)[0]
+
+    def _key_at(self, i):
+        start = self._offset(i)
+        return self.mm[start:self.mm.find(b"\t", start)]
+
+    def _record_at(self, i):
+        start = self._offset(i)
+        fields = self.mm[start:self.mm.find(b"\n", start)].decode("utf-8").split("\t")
+        return {"kanji": fields[1], "kana": fields[2], "meaning": fields[3], "jlpt": fields[4]}
+
+    def lookup_all(self, term):
+        key = normalize_text(term).encode("utf-8")
+        if not key: return []
+        lo, hi = 0, self.count
+        while lo < hi: # 最左邊的相符位置
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key: lo = mid + 1
+            else: hi = mid
+        results = []
+        while lo < self.count and self._key_at(lo) == key:
+            results.append(self._record_at(lo))
+            lo += 1
+        return results
+
+    def lookup(self, term):
+        results = self.lookup_all(term)
+        # 同音詞時優先回傳漢字完全相符的那一筆
+        exact = [r for r in results if normalize_text(r["kanji"]) == normalize_text(term)]
+        return (exact or results or [None])[0]
+
+def build_jlpt_dictionary(source_path, out_path):
+    records = []
+    with open(source_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"): continue
+            fields = (line.rstrip("\n").split("\t") + ["", "", "", ""])[:4]
+            kanji, kana, meaning, level = [x.replace("\t", " ").strip() for x in fields]
+            if not kanji: continue
+            body = f"{kanji}\t{kana}\t{meaning}\t{level}\n"
+            for key in {normalize_text(kanji), normalize_text(kana)}:
+                if key: records.append((key.encode("utf-8"), body.encode("utf-8")))
+    # 來源重複列出同一筆時只收一次，查詢不會回傳重複結果
+    records = sorted(set(records), key=lambda r: r[0])
+
+    header_size = JlptDictionary.HEADER.size + 4 * len(records)
+    offsets, blobs, pos = [], [], header_size
+    for key, body in records:
+        blob = key + b"\t" + body
+        offsets.append(pos)
+        blobs.append(blob)
+        pos += len(blob)
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(JlptDictionary.HEADER.pack(JlptDictionary.MAGIC, len(records), 0))
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        for blob in blobs: f.write(blob)
+    os.replace(tmp_path, out_path)
+    return len(records)
+
+JLPT_DICTIONARY = None
+
+def get_jlpt_dictionary():
+    # 二進位檔不存在或比來源舊時自動重建；沒有字典時回傳 None，呼叫端照舊運作
+    global JLPT_DICTIONARY
+    if JLPT_DICTIONARY is None:
+        try:
+            if os.path.exists(JLPT_DICT_SOURCE) and (not os.path.exists(JLPT_DICT_FILE) or os.path.getmtime(JLPT_DICT_FILE) < os.path.getmtime(JLPT_DICT_SOURCE)):
+                build_jlpt_dictionary(JLPT_DICT_SOURCE, JLPT_DICT_FILE)
+            if os.path.exists(JLPT_DICT_FILE):
+                JLPT_DICTIONARY = JlptDictionary(JLPT_DICT_FILE)
+        except Exception as e:
+            print(f"⚠️ JLPT 字典載入失敗: {e}")
+    return JLPT_DICTIONARY
+
+def enrich_word_from_dictionary(word):
+    """
+    用離線字典補上缺少的讀音、意思與 JLPT 等級 (不呼叫 AI)。回傳是否有補到資料。
+    """
+    dictionary = get_jlpt_dictionary()
+    if dictionary is None: return False
+    entry = dictionary.lookup(word.get("kanji", ""))
+    if not entry: return False
+    changed = False
+    if not word.get("kana") and entry["kana"]:
+        word["kana"] = entry["kana"]; changed = True
+    if entry["meaning"] and not word.get("meaning"):
+        word["meaning"] = entry["meaning"]; changed = True
+    if not word.get("jlpt") and entry["jlpt"]:
+        word["jlpt"] = entry["jlpt"]; changed = True
+    return changed
+
+# ================= 大量單字匯入 (Bulk Import) =================
+
+def build_vocab_key_index(words):
+    # 正規化詞 -> 單字項目；取代逐筆線性比對 (重複的詞以第一筆為準)
+    index = {}
+    for w in words: index.setdefault(normalize_text(w["kanji"]), w)
+    return index
+
+def iter_json_array(stream, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    逐項解析 JSON 陣列 (不需要一次 json.loads 整份內容)。
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof, started = "", 0, False, False
+    while True:
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,﻿":
+                pos += 1
+            if pos < len(buf) or eof: break
+            chunk = stream.read(chunk_size)
+            buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+        if pos >= len(buf): return
+
+        if not started:
+            if buf[pos] != "[": raise ValueError("not a JSON array")
+            started = True
+            pos += 1
+            continue
+        if buf[pos] == "]": return
+
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof: raise
+            chunk = stream.read(chunk_size)
+            buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+            continue
+        yield item
+        pos = end
+
+def _strip_html(value):
+    return re.sub(r"<[^>]+>", "", value or "").replace("&nbsp;", " ").strip()
+
+def _row_to_item(fields, header=None):
+    fields = [_strip_html(f) for f in fields]
+    if header:
+        return {k: v for k, v in zip(header, fields) if k}
+    # 無標題列：2 欄 = 詞/意思 (Anki 正反面)，3 欄以上 = 詞/讀音/意思/類型
+    if len(fields) == 2:
+        return {"kanji": fields[0], "meaning": fields[1]}
+    keys = ["kanji", "kana", "meaning", "type"]
+    return dict(zip(keys, fields))
+
+def iter_delimited_rows(stream, delimiter):
+    header = None
+    lines = (line for line in stream if not line.startswith("#")) # Anki 匯出的 #separator 等標頭
+    for row_no, fields in enumerate(csv.reader(lines, delimiter=delimiter)):
+        if not fields: continue
+        if row_no == 0 and "kanji" in [f.strip().lower() for f in fields]:
+            header = [f.strip().lower() for f in fields]
+            continue
+        yield _row_to_item(fields, header)
+
+def iter_anki_package(raw_bytes):
+    # .apkg = zip 內含 SQLite；欄位以 \x1f 分隔 (僅支援未壓縮的 collection.anki2 / anki21)
+    with zipfile.ZipFile(io.BytesIO(raw_bytes)) as zf:
+        name = next((n for n in ["collection.anki21", "collection.anki2"] if n in zf.namelist()), None)
+        if not name: raise ValueError("unsupported Anki package")
+        with tempfile.NamedTemporaryFile(suffix=".anki2", delete=False) as tmp:
+            tmp.write(zf.read(name))
+    try:
+        conn = sqlite3.connect(tmp.name)
+        try:
+            for (flds,) in conn.execute("SELECT flds FROM notes"):
+                yield _row_to_item(flds.split("\x1f"))
+        finally:
+            conn.close()
+    finally:
+        os.remove(tmp.name)
+
+def import_vocab_items(vocab_data, items, today_str, key_index=None):
+    """
+    以雜湊表去重並分批寫入單字庫，回傳 (新增, 略過, 合併)。
+    合併：既有項目缺讀音或意思時，用匯入資料補上。
+    """
+    if key_index is None: key_index = build_vocab_key_index(vocab_data["words"])
+    added = skipped = merged = 0
+    batch = []
+    for word in items:
+        if not isinstance(word, dict) or not word.get("kanji"):
+            skipped += 1
+            continue
+        kanji = str(word["kanji"]).strip()
+        key = normalize_text(kanji)
+        existing = key_index.get(key)
+        if existing is not None:
+            filled = False
+            for field in ["kana", "meaning"]:
+                if not existing.get(field) and word.get(field):
+                    existing[field] = word[field]
+                    filled = True
+            if filled: merged += 1
+            else: skipped += 1
+            continue
+        new_word = WordRecord({
+            "kanji": kanji,
+            "kana": word.get("kana", ""),
+            "meaning": word.get("meaning", ""),
+            "type": word.get("type") or "word",
+            "count": 1, "added_date": today_str
+        })
+        enrich_word_from_dictionary(new_word)
+        key_index[key] = new_word
+        batch.append(new_word)
+        added += 1
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            vocab_data["words"].extend(batch)
+            batch = []
+    vocab_data["words"].extend(batch)
+    return added, skipped, merged
+
+def format_import_report(source, added, skipped, merged, elapsed):
+    return f"📂 匯入完成 ({source})：新增 {added}、略過 {skipped}、合併 {merged} (耗時 {elapsed:.1f}s)"
+
+def download_telegram_document(document):
+    file_info = requests.get(f"{TG_API_BASE}/bot{TG_BOT_TOKEN}/getFile", params={"file_id": document["file_id"]}).json()
+    file_path = file_info["result"]["file_path"]
+    response = requests.get(f"{TG_API_BASE}/file/bot{TG_BOT_TOKEN}/{file_path}")
+    response.raise_for_status()
+    return response.content
+
+def import_vocab_document(vocab_data, document, today_str, key_index=None):
+    file_name = document.get("file_name", "upload")
+    ext = os.path.splitext(file_name)[1].lower()
+    started = time.time()
+    raw = download_telegram_document(document)
+
+    if ext == ".apkg":
+        items = iter_anki_package(raw)
+    else:
+        stream = io.StringIO(raw.decode("utf-8-sig"))
+        if ext == ".json":
+            items = iter_json_array(stream)
+        elif ext == ".csv":
+            items = iter_delimited_rows(stream, ",")
+        elif ext in [".tsv", ".txt"]:
+            items = iter_delimited_rows(stream, "\t")
+        else:
+            return f"⚠️ 不支援的檔案格式：{file_name} (支援 .json / .csv / .tsv / .txt / .apkg)"
+
+    added, skipped, merged = import_vocab_items(vocab_data, items, today_str, key_index)
+    return format_import_report(file_name, added, skipped, merged, time.time() - started)
+
 # ================= 邏輯核心 =================
 
+def apply_mistakes(vocab_data, mistakes, today_str):
+    """
+    批改回傳的 mistakes 併入單字庫：已收錄的詞權重 +2，沒收錄的以權重 5 新增。
+    回傳 (答錯的正規化詞, 新收錄的詞, 要回報給使用者的訊息)。
+    """
+    mistaken_terms, new_terms, mistake_log_list = [], [], []
+    key_index = build_vocab_key_index(vocab_data["words"]) if mistakes else {}
+    for m in mistakes:
+        term = m.get("term", "")
+        m_type = m.get("type", "word")
+        meaning = m.get("meaning", "")
+        if not term: continue
+
+        w = key_index.get(normalize_text(term))
+        if w is not None:
+            adjust_word_weight(w, 2, today_str) # 答錯懲罰
+            w["type"] = m_type
+            mistaken_terms.append(normalize_text(term))
+            mistake_log_list.append(f"⚠️ 弱點標記 (權重+2): {term}")
+        else:
+            new_word = WordRecord({
+                "kanji": term, "kana": "", "meaning": meaning,
+                "type": m_type, "count": 5, "count_ts": today_str, "added_date": today_str
+            })
+            # AI 給的中文意思優先；字典只補讀音、等級與缺少的意思
+            enrich_word_from_dictionary(new_word)
+            if not new_word["meaning"]: new_word["meaning"] = "AI 修正"
+            vocab_data["words"].append(new_word)
+            key_index[normalize_text(term)] = new_word
+            mistaken_terms.append(normalize_text(term))
+            new_terms.append(term)
+            mistake_log_list.append(f"🆕 弱點收錄 (權重=5): {term}")
+    # 把這次答錯的詞和單字庫裡讀音/字形相近的詞連起來
+    if mistaken_terms:
+        confusables = get_confusable_index(vocab_data["words"])
+        mistaken_set = set(mistaken_terms)
+        for w in vocab_data["words"]:
+            if normalize_text(w["kanji"]) not in mistaken_set: continue
+            neighbours = confusables.neighbours(w)
+            if neighbours:
+                mistake_log_list.append(f"🔗 易混淆：{w['kanji']} ⇄ {'、'.join(n['kanji'] for n in neighbours)}")
+    return mistaken_terms, new_terms, mistake_log_list
+
+def reward_correct_usage(vocab_data, combined_text, mistaken_terms, today_str):
+    # 作答中用到、且這次沒有答錯的庫存詞權重 -2 (答對獎勵)
+    correct_terms = []
+    text_for_search = normalize_text(combined_text)
+    for w in vocab_data["words"]:
+        if normalize_text(w["kanji"]) in text_for_search:
+            if normalize_text(w["kanji"]) not in mistaken_terms:
+                correct_terms.append(w["kanji"])
+                if word_weight(w) > WEIGHT_BASELINE:
+                    adjust_word_weight(w, -2, today_str)
+    return correct_terms
+
 def process_data():
     print("📥 開始處理資料...")
     log_to_buffer("⚙️ Sys", "Checking for updates...")
     
-    # 預設的完整使用者資料結構
-    default_user_data = {
-        "stats": {
-            "last_active": "2000-01-01", 
-            "streak_days": 0,
-            "execution_count": 0,
-            "last_quiz_date": "2000-01-01",
-            "last_quiz_questions_count": 0,
-            "daily_answers_count": 0,
-            "bonus_answers_count": 0,
-            "yesterday_main_score": 0,
-            "yesterday_bonus_score": 0,
-            "last_update_id": 0,
-            "current_difficulty": START_DIFFICULTY, 
-            "difficulty_cn_jp": START_DIFFICULTY,
-            "difficulty_jp_cn": START_DIFFICULTY,
-            "sprint_start_date": str(datetime.now(TW_TZ).date()),
-            "next_quiz_instruction": "" 
-        },
-        "pending_answers": "",
-        "translation_log": []
-    }
-    
-    vocab_data = load_json(VOCAB_FILE, {"words": []})
-    user_data = load_json(USER_DATA_FILE, default_user_data)
-    
-    stats = user_data["stats"]
-    stats["current_difficulty"] = float(stats.get("current_difficulty", START_DIFFICULTY))
-    stats["difficulty_cn_jp"] = float(stats.get("difficulty_cn_jp", stats["current_difficulty"]))
-    stats["difficulty_jp_cn"] = float(stats.get("difficulty_jp_cn", stats["current_difficulty"]))
-    if "next_quiz_instruction" not in stats: stats["next_quiz_instruction"] = ""
+    recover_state()
+    reset_history_index()
+    vocab_data = load_vocab_data()
+    user_data = load_user_data()
 
-    for key in ["daily_answers_count", "bonus_answers_count", "yesterday_main_score", 
-                "yesterday_bonus_score", "execution_count", "streak_days", "last_update_id"]:
-        if key not in stats: stats[key] = 0
-
-    url = f"https://api.telegram.org/bot{TG_BOT_TOKEN}/getUpdates"
+    url = f"{TG_API_BASE}/bot{TG_BOT_TOKEN}/getUpdates"
     
     try:
         # 🔥 修復：移除 Markdown 語法，恢復正常 URL
-        response = requests.get(url).json()
+        with TRACER.span("fetch") as attrs:
+            response = requests.get(url).json()
+            attrs["updates"] = len(response.get("result", []))
         if "result" not in response: 
             log_to_buffer("⚙️ Sys", "No 'result' in TG response.")
             return vocab_data, user_data
@@ -465,16 +2416,18 @@ def process_data():
         updates_log = []
         correction_msgs = []
         
-        today_str = str(datetime.now(TW_TZ).date())
+        today_str = str(now_tw().date())
         today_answers_detected = 0
         pending_correction_texts = []
+        new_attempts = []
+        vocab_key_index = None # 正規化詞 -> 單字；第一次需要時才建立，整批更新共用並隨新增同步
         
         last_processed_id = user_data["stats"]["last_update_id"]
         is_fresh_start = (last_processed_id == 0)
         max_id_in_this_run = last_processed_id
         
         found_count = 0
-        for item in response["result"]:
+        for item in TRACER.each("parse_update", response["result"], lambda item: {"update_id": item["update_id"]}):
             current_update_id = item["update_id"]
             if current_update_id <= last_processed_id: continue
             if current_update_id > max_id_in_this_run: max_id_in_this_run = current_update_id
@@ -484,6 +2437,21 @@ def process_data():
                 continue
 
             if str(message_obj["chat"]["id"]) != str(TG_CHAT_ID): continue
+
+            # Case A': 上傳檔案匯入 (JSON / CSV / Anki 匯出)
+            document = message_obj.get("document")
+            if document:
+                found_count += 1
+                log_to_buffer("👤 User", f"📎 {document.get('file_name', '')} (ID: {current_update_id})")
+                if is_fresh_start: continue
+                if vocab_key_index is None: vocab_key_index = build_vocab_key_index(vocab_data["words"])
+                try:
+                    updates_log.append(import_vocab_document(vocab_data, document, today_str, vocab_key_index))
+                    is_updated = True
+                except Exception as e:
+                    log_to_buffer("⚠️ Err", f"Document import failed: {e}")
+                    updates_log.append(f"⚠️ 檔案匯入失敗：{document.get('file_name', '')}")
+                continue
             
             text = message_obj.get("text", "").strip()
             if not text: continue
@@ -499,11 +2467,13 @@ def process_data():
             if text.upper().startswith("[LV]"):
                 if is_fresh_start: continue
                 specific_req = text[4:].strip()
-                new_diff, reason = assess_user_level(user_data["translation_log"], specific_req)
+                get_history_index(user_data, len(new_attempts)) # 評估時以檢索撈出佐證弱點的過往作答
+                new_diff, reason = assess_user_level(user_data["translation_log"], specific_req, user_data["learner_profile"])
                 if new_diff is not None:
-                    user_data["stats"]["current_difficulty"] = new_diff
-                    user_data["stats"]["difficulty_cn_jp"] = new_diff
-                    user_data["stats"]["difficulty_jp_cn"] = new_diff
+                    for key in ["current_difficulty", "difficulty_cn_jp", "difficulty_jp_cn"]:
+                        stat_set(user_data["stats"], key, new_diff)
+                    for q_type, key in ABILITY_DIRECTIONS.items():
+                        reset_ability(user_data, q_type, user_data["stats"][key])
                     updates_log.append(f"🧠 AI 評級完成：調整至 Lv{new_diff}。\n💬 理由：{reason}")
                     is_updated = True
                 continue
@@ -522,7 +2492,7 @@ def process_data():
                     json_match = re.search(r"```json\s*(\{.*?\})\s*```", raw_response, re.DOTALL)
                     if json_match:
                         json_str = json_match.group(1)
-                        action_data = json.loads(json_str)
+                        action_data = loads_model_json(json_str)
                         final_reply = raw_response.replace(json_match.group(0), "").strip()
                         
                         if "actions" in action_data:
@@ -530,14 +2500,16 @@ def process_data():
                             # 1. 調整難度
                             adj_val = float(actions.get("adjust_difficulty", 0.0))
                             if adj_val != 0.0:
-                                user_data["stats"]["difficulty_cn_jp"] = max(1.0, user_data["stats"]["difficulty_cn_jp"] + adj_val)
-                                user_data["stats"]["difficulty_jp_cn"] = max(1.0, user_data["stats"]["difficulty_jp_cn"] + adj_val)
+                                stat_add(user_data["stats"], "difficulty_cn_jp", adj_val, lo=1.0)
+                                stat_add(user_data["stats"], "difficulty_jp_cn", adj_val, lo=1.0)
+                                for q_type, key in ABILITY_DIRECTIONS.items():
+                                    reset_ability(user_data, q_type, user_data["stats"][key])
                                 log_to_buffer("⚙️ Adjust", f"Difficulty adjusted by {adj_val}")
                             
                             # 2. 設定下次出題指令
                             quiz_instr = actions.get("quiz_instruction", "")
                             if quiz_instr:
-                                user_data["stats"]["next_quiz_instruction"] = quiz_instr
+                                stat_set(user_data["stats"], "next_quiz_instruction", quiz_instr)
                                 log_to_buffer("⚙️ Instruct", f"Next quiz instruction set: {quiz_instr}")
                                 is_updated = True
                 except Exception as e:
@@ -547,27 +2519,16 @@ def process_data():
                 is_updated = True
                 continue
 
-            # Case A: JSON 匯入
+            # Case A: JSON 匯入 (逐項解析 + 雜湊去重)
             if text.startswith("["):
                 try:
-                    imported = json.loads(text)
-                    if isinstance(imported, list):
-                        added = 0
-                        for word in imported:
-                            if "kanji" not in word: continue
-                            kanji = word.get("kanji")
-                            if not any(normalize_text(w["kanji"]) == normalize_text(kanji) for w in vocab_data["words"]):
-                                vocab_data["words"].append({
-                                    "kanji": kanji, 
-                                    "kana": word.get("kana", ""),
-                                    "meaning": word.get("meaning", ""),
-                                    "type": word.get("type", "word"),
-                                    "count": 1, "added_date": today_str
-                                })
-                                added += 1
-                                is_updated = True
-                        updates_log.append(f"📂 匯入 {added} 個新項目")
-                except: pass
+                    started = time.time()
+                    if vocab_key_index is None: vocab_key_index = build_vocab_key_index(vocab_data["words"])
+                    added, skipped, merged = import_vocab_items(vocab_data, iter_json_array(io.StringIO(text)), today_str, vocab_key_index)
+                    updates_log.append(format_import_report("JSON", added, skipped, merged, time.time() - started))
+                    if added or merged: is_updated = True
+                except Exception as e:
+                    log_to_buffer("⚠️ Err", f"JSON import failed: {e}")
                 continue
 
             # Case B: 存單字/文法
@@ -576,22 +2537,25 @@ def process_data():
                 if is_fresh_start: continue
                 term, kana_or_info, meaning = match.groups()
                 if not term.lower().startswith("part") and len(text) < 50: 
-                    found = False
-                    for word in vocab_data["words"]:
-                        if normalize_text(word["kanji"]) == normalize_text(term):
-                            word["count"] += 1 
-                            updates_log.append(f"🔄 強化記憶：{term}")
-                            found = True
-                            is_updated = True
-                            break
-                    if not found:
-                        item_type = "grammar" if ("~" in term or "..." in term) else "word"
-                        vocab_data["words"].append({
+                    if vocab_key_index is None: vocab_key_index = build_vocab_key_index(vocab_data["words"])
+                    word = vocab_key_index.get(normalize_text(term))
+                    if word is not None:
+                        adjust_word_weight(word, 1, today_str)
+                        updates_log.append(f"🔄 強化記憶：{term}")
+                        is_updated = True
+                    else:
+                        norm_term = normalize_text(term)
+                        item_type = "grammar" if ("~" in norm_term or "..." in norm_term) else "word"
+                        new_word = WordRecord({
                             "kanji": term, "kana": kana_or_info, "meaning": meaning, 
                             "type": item_type,
                             "count": 1, "added_date": today_str
                         })
-                        updates_log.append(f"✅ 收錄 ({item_type})：{term}")
+                        enrich_word_from_dictionary(new_word)
+                        vocab_data["words"].append(new_word)
+                        vocab_key_index[norm_term] = new_word
+                        level_tag = f" [{new_word['jlpt']}]" if new_word.get("jlpt") else ""
+                        updates_log.append(f"✅ 收錄 ({item_type})：{term}{level_tag}")
                         is_updated = True
                     continue
 
@@ -602,6 +2566,8 @@ def process_data():
                 lines_count = max(1, lines_count)
                 today_answers_detected += lines_count
                 
+                # 先檢索再收錄，避免本次作答檢索到自己
+                new_attempts.append(text)
                 pending_correction_texts.append(text)
                 user_data["translation_log"].append(f"{today_str}: {text[:100]}")
                 is_updated = True
@@ -617,16 +2583,17 @@ def process_data():
             main_quota = 10 
             remaining_quota = max(0, main_quota - current_main)
             fill_main = min(today_answers_detected, remaining_quota)
-            user_data["stats"]["daily_answers_count"] += fill_main
+            stat_add(user_data["stats"], "daily_answers_count", fill_main)
             spill_to_bonus = today_answers_detected - fill_main
             if spill_to_bonus > 0:
-                user_data["stats"]["bonus_answers_count"] += spill_to_bonus
+                stat_add(user_data["stats"], "bonus_answers_count", spill_to_bonus)
             is_updated = True
 
         # === 批改處理 ===
-        if not is_fresh_start and pending_correction_texts:
-            combined_text = "\n\n".join(pending_correction_texts)
-            history_context = user_data["translation_log"][:-len(pending_correction_texts)]
+        regrade_texts = user_data.get("pending_regrade", [])
+        if not is_fresh_start and (pending_correction_texts or regrade_texts):
+            history_context = user_data["translation_log"][:len(user_data["translation_log"]) - len(pending_correction_texts)]
+            history_index = get_history_index(user_data, len(new_attempts))
             
             main_count = user_data["stats"]["daily_answers_count"]
             bonus_count = user_data["stats"]["bonus_answers_count"]
@@ -636,10 +2603,16 @@ def process_data():
             else:
                 progress_str = f"狀態：每日必修進行中 ({main_count}/10 題)"
 
-            raw_result = ai_correction(combined_text, history_context, progress_str)
-            
-            final_msg_text = raw_result
+            # 句數不多時整份一次批改，長篇作業才分批平行；兩者都會重試，重試後仍失敗的句子留待下次重批
+            sentences = (segment_submission(pending_correction_texts) + regrade_texts) or [t.strip() for t in pending_correction_texts]
+            batch_size = GRADING_BATCH_SIZE if len(sentences) > GRADING_SPLIT_THRESHOLD else len(sentences)
+            with TRACER.span("grading", sentences=len(sentences)):
+                final_msg_text, parsed_data, failed_sentences = grade_sentences_parallel(sentences, history_context, progress_str, user_data["learner_profile"], batch_size)
+            user_data["pending_regrade"] = failed_sentences
+
             mistaken_terms = []
+            new_terms = []
+            correct_terms = []
             
             # 當日/當次平均分數計算
             total_score_sum = 0.0
@@ -647,39 +2620,12 @@ def process_data():
 
             # 解析錯誤與評估 JSON
             try:
-                json_match = re.search(r"```json\s*(\{.*?\})\s*```", raw_result, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(1)
-                    parsed_data = json.loads(json_str)
-                    
-                    final_msg_text = raw_result.replace(json_match.group(0), "").strip()
-                    log_to_buffer("⚙️ AI Feed", f"JSON: {json_str}")
+                if parsed_data is not None:
+                    log_to_buffer("⚙️ AI Feed", f"JSON: {json.dumps(parsed_data, ensure_ascii=False)}")
                     
                     # 1. 處理錯誤 (Mistakes)
                     if "mistakes" in parsed_data:
-                        mistake_log_list = []
-                        for m in parsed_data["mistakes"]:
-                            term = m.get("term", "")
-                            m_type = m.get("type", "word")
-                            meaning = m.get("meaning", "AI 修正")
-                            
-                            if term:
-                                mistakes_found_in_vocab = False
-                                for w in vocab_data["words"]:
-                                    if normalize_text(w["kanji"]) == normalize_text(term):
-                                        w["count"] = w.get("count", 1) + 2 # 答錯懲罰
-                                        w["type"] = m_type 
-                                        mistaken_terms.append(normalize_text(term))
-                                        mistakes_found_in_vocab = True
-                                        mistake_log_list.append(f"⚠️ 弱點標記 (權重+2): {term}")
-                                        break
-                                if not mistakes_found_in_vocab:
-                                    vocab_data["words"].append({
-                                        "kanji": term, "kana": "", "meaning": meaning,
-                                        "type": m_type, "count": 5, "added_date": today_str
-                                    })
-                                    mistaken_terms.append(normalize_text(term))
-                                    mistake_log_list.append(f"🆕 弱點收錄 (權重=5): {term}")
+                        mistaken_terms, new_terms, mistake_log_list = apply_mistakes(vocab_data, parsed_data["mistakes"], today_str)
                         if mistake_log_list:
                              updates_log.extend(mistake_log_list)
                              is_updated = True
@@ -690,34 +2636,36 @@ def process_data():
                             status = item.get("status", "ATTEMPTED")
                             score = float(item.get("score", 0.0))
                             q_type = item.get("type", "")
-                            target_key = "difficulty_cn_jp" if q_type == "CN_TO_JP" else "difficulty_jp_cn"
+                            target_key = ABILITY_DIRECTIONS.get(q_type, "difficulty_jp_cn")
                             
+                            # 難度由能力模型線上更新 (出題當下的難度即題目難度)
+                            record_assessment(user_data, q_type, score, status, float(user_data["stats"].get(target_key, START_DIFFICULTY)), today_str, item.get("input", ""))
+
                             # 🚨 防偷懶核心：只有 ATTEMPTED 才會調整難度與計算總分
                             if status == "ATTEMPTED":
                                 total_score_sum += score
                                 total_score_count += 1
-                                
-                                if q_type in ["CN_TO_JP", "JP_TO_CN"]:
-                                    # 難度即時調整邏輯
-                                    if score >= 9.0: # 神級 (+0.1)
-                                        user_data["stats"][target_key] = min(8.0, user_data["stats"][target_key] + 0.1)
-                                    elif score >= 7.0: # 合格 (+0.05)
-                                        user_data["stats"][target_key] = min(8.0, user_data["stats"][target_key] + 0.05)
-                                    elif score < 6.0: # 不及格 (-0.1)
-                                        user_data["stats"][target_key] = max(1.0, user_data["stats"][target_key] - 0.1)
+                        refit_ability_model(user_data, today_str)
+                        sync_difficulty_from_ability(user_data)
 
             except Exception as e:
                 log_to_buffer("⚠️ Err", f"JSON parsing failed: {e}")
 
-            # 3. 權重回調機制 (獎勵答對)
-            text_for_search = normalize_text(combined_text)
-            for w in vocab_data["words"]:
-                if normalize_text(w["kanji"]) in text_for_search:
-                    if normalize_text(w["kanji"]) not in mistaken_terms:
-                        if w.get("count", 1) > 1:
-                            w["count"] = max(1, w["count"] - 2) # 答對獎勵
+            # 3. 權重回調機制 (獎勵答對)：只算這次批改成功的句子；失敗的句子等重批成功時才獎勵，每句只算一次
+            failed_set = set(failed_sentences)
+            graded_text = "\n".join(sentence for sentence in sentences if sentence not in failed_set)
+            correct_terms = reward_correct_usage(vocab_data, graded_text, mistaken_terms, today_str) if graded_text else []
 
-            # 4. 生成總評分字串
+            # 收錄本次作答與新錯誤到檢索索引
+            for text in new_attempts:
+                history_index.add(text, today_str)
+            for term in new_terms:
+                history_index.add(term, today_str, "mistake")
+
+            # 4. 更新學習者輪廓 (之後的 prompt 只帶這份精簡摘要)
+            update_learner_profile(user_data, parsed_data, correct_terms, new_terms, today_str)
+
+            # 5. 生成總評分字串
             score_summary = ""
             if total_score_count > 0:
                 avg_score = total_score_sum / total_score_count
@@ -728,34 +2676,34 @@ def process_data():
                 elif avg_score >= 6.0: rank = "B"
                 score_summary = f"\n\n📊 **本次平均戰力：{avg_score:.1f} / 10.0 (Rank {rank})**"
 
-            title_text = f"📝 **作業批改 (共 {len(pending_correction_texts)} 則)：**"
+            title_text = f"📝 **作業批改 (共 {len(pending_correction_texts) + len(regrade_texts)} 則)：**"
             correction_msgs.append(f"{title_text}\n{final_msg_text}{score_summary}")
 
         if max_id_in_this_run > user_data["stats"]["last_update_id"]:
-            user_data["stats"]["last_update_id"] = max_id_in_this_run
+            stat_set(user_data["stats"], "last_update_id", max_id_in_this_run)
             is_updated = True
 
         if user_data["stats"]["last_active"] != today_str:
             if today_answers_detected > 0 or is_updated:
-                 yesterday = str((datetime.now(TW_TZ) - timedelta(days=1)).date())
+                 yesterday = str((now_tw() - timedelta(days=1)).date())
                  if user_data["stats"]["last_active"] == yesterday:
-                     user_data["stats"]["streak_days"] += 1
+                     stat_add(user_data["stats"], "streak_days", 1)
                  else:
-                     user_data["stats"]["streak_days"] = 1
-                 user_data["stats"]["last_active"] = today_str
+                     stat_set(user_data["stats"], "streak_days", 1)
+                 stat_set(user_data["stats"], "last_active", today_str)
                  is_updated = True
 
         if updates_log: send_telegram("\n".join(set(updates_log)))
         for msg in correction_msgs:
             send_telegram(msg)
-            time.sleep(1)
+            time.sleep(TG_SEND_INTERVAL)
 
         return vocab_data, user_data
 
     except Exception as e:
         print(f"Error: {e}")
         log_to_buffer("⚠️ Critical", f"Process data error: {e}")
-        return load_json(VOCAB_FILE, {}), load_json(USER_DATA_FILE, default_user_data)
+        return load_vocab_data(), load_user_data()
 
 # ================= 每日特訓生成 =================
 
@@ -775,131 +2723,183 @@ def get_difficulty_description(level_float):
     next_desc = descriptions.get(level_int + 1, f"Lv{level_int+1} (未知)")
     return base_desc, next_desc
 
-def run_daily_quiz(vocab, user):
-    if not vocab.get("words"):
-        send_telegram("📭 單字庫空的！請傳送單字或匯入 JSON。")
-        return user
-    
-    # 處理上次詳解
-    pending_answers = user.get("pending_answers", "")
-    if pending_answers:
-        send_telegram(f"🗝️ **前次測驗詳解**\n\n{pending_answers}")
-        time.sleep(3)
-        user["pending_answers"] = ""
-    
-    today_str = str(datetime.now(TW_TZ).date())
-    is_new_day = (user["stats"]["last_quiz_date"] != today_str)
-
-    # === 選詞邏輯：弱點優先 ===
+# ================= 易混淆詞索引 (BK-tree) =================
+
+def edit_distance(a, b):
+    # Levenshtein 距離 (單字都很短，純 Python 兩列 DP 就夠快)
+    if a == b: return 0
+    if len(a) < len(b): a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+class BKTree:
+    """
+    以編輯距離為度量的 BK-tree。查詢時利用三角不等式剪枝，
+    只走訪距離落在 [d - r, d + r] 的子樹，不必和整個單字庫逐一比對。
+    """
+    def __init__(self):
+        self.root = None # [key, {distance: child_node}, payloads]
+
+    def add(self, key, payload):
+        if not key: return
+        if self.root is None:
+            self.root = [key, {}, [payload]]
+            return
+        node = self.root
+        while True:
+            d = edit_distance(key, node[0])
+            if d == 0:
+                node[2].append(payload)
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = [key, {}, [payload]]
+                return
+            node = child
+
+    def search(self, key, max_dist):
+        results = []
+        if self.root is None or not key: return results
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = edit_distance(key, node[0])
+            if d <= max_dist: results.extend((d, p) for p in node[2])
+            for child_d, child in node[1].items():
+                if d - max_dist <= child_d <= d + max_dist: stack.append(child)
+        return results
+
+def confusable_radius(key):
+    # 太短的詞距離 1 幾乎什麼都相近 (例如單一漢字)，只做完全同音/同形比對
+    return 1 if len(key) >= 3 else 0
+
+OKURIGANA_RE = re.compile(r"[\u3041-\u309f]+")
+
+def glyph_key(text):
+    # 字形比對只看漢字部分：去掉送り仮名，行く/炊く、する/来る 不會只因為共用語尾而被當成相近
+    key = normalize_text(text)
+    stem = OKURIGANA_RE.sub("", key)
+    return stem or key
+
+class ConfusableIndex:
+    """
+    讀音與字形各一棵 BK-tree：
+    - 讀音相近：きかい / きがい (機会 / 危害)、同音異字
+    - 字形相近：影響 / 影響力、上がる / 上げる (去掉送り仮名後比對)
+    """
+    def __init__(self, words):
+        self.kana_tree = BKTree()
+        self.kanji_tree = BKTree()
+        for w in words:
+            self.kanji_tree.add(glyph_key(w["kanji"]), w)
+            kana = normalize_text(w.get("kana", ""))
+            if kana and not re.search(r"[a-z0-9]", kana): # kana 欄位有時放的是等級或說明
+                self.kana_tree.add(kana, w)
+
+    def neighbours(self, word, limit=3):
+        own = normalize_text(word["kanji"])
+        found = {}
+        kanji_key = glyph_key(word["kanji"])
+        for d, w in self.kanji_tree.search(kanji_key, confusable_radius(kanji_key)):
+            found.setdefault(normalize_text(w["kanji"]), (d, w))
+        kana_key = normalize_text(word.get("kana", ""))
+        if kana_key:
+            for d, w in self.kana_tree.search(kana_key, confusable_radius(kana_key)):
+                key = normalize_text(w["kanji"])
+                if key not in found or d < found[key][0]: found[key] = (d, w)
+        found.pop(own, None)
+        ranked = sorted(found.values(), key=lambda x: (x[0], -word_weight(x[1])))
+        return [w for _, w in ranked[:limit]]
+
+CONFUSABLE_INDEX = (None, None)
+
+def get_confusable_index(words):
+    # 依 (同一份清單, 筆數) 快取：單字只會附加在尾端，同一輪中筆數沒變就不重建 (不必每次雜湊整個單字庫)
+    global CONFUSABLE_INDEX
+    version = (words, len(words))
+    cached = CONFUSABLE_INDEX[0]
+    if cached is None or cached[0] is not words or cached[1] != version[1]:
+        CONFUSABLE_INDEX = (version, ConfusableIndex(words))
+    return CONFUSABLE_INDEX[1]
+
+def format_quiz_word_list(quiz_words, confusables=None):
+    """
+    出題用單字列表。易混淆的詞併成一行 (以 ⇄ 連接)，提示 AI 在同一題或相鄰題目中對照練習。
+    """
+    lines, seen = [], set()
+    for w in quiz_words:
+        key = normalize_text(w["kanji"])
+        if key in seen: continue
+        seen.add(key)
+        group = [w]
+        if confusables is not None:
+            for n in confusables.neighbours(w):
+                n_key = normalize_text(n["kanji"])
+                if n_key in seen or not any(normalize_text(q["kanji"]) == n_key for q in quiz_words): continue
+                seen.add(n_key)
+                group.append(n)
+        line = " ⇄ ".join(f"{g['kanji']} ({g['meaning']})" for g in group)
+        lines.append(f"{line} ⚠️易混淆" if len(group) > 1 else line)
+    return "\n".join(lines)
+
+def rank_quiz_words(vocab, confusables=None):
+    """
+    選詞中確定性的部分：依衰減權重排序，取前 3 個弱點詞，再拉進它們的易混淆鄰居 (每個弱點最多 1 個)。
+    回傳 (排序後的單字, 權重表, 弱點詞, 易混淆鄰居)；預生成快取也用弱點詞 + 鄰居判斷題目是否過期。
+    """
+    # 權重以讀取當下的衰減值為準
     all_words = vocab["words"]
-    sorted_words = sorted(all_words, key=lambda x: x.get("count", 1), reverse=True)
-    
+    today = now_tw().date()
+    weight_of = {id(w): word_weight(w, today) for w in all_words}
+    sorted_words = sorted(all_words, key=lambda x: weight_of[id(x)], reverse=True)
+    selected_weaks = sorted_words[:3]
+
+    clustered = []
+    if confusables is not None:
+        taken = {normalize_text(w["kanji"]) for w in selected_weaks}
+        for weak in selected_weaks:
+            for n in confusables.neighbours(weak, limit=1):
+                if normalize_text(n["kanji"]) not in taken:
+                    taken.add(normalize_text(n["kanji"]))
+                    clustered.append(n)
+    return sorted_words, weight_of, selected_weaks, clustered
+
+def select_quiz_words(vocab, confusables=None, ranked=None):
+    # === 選詞邏輯：弱點優先 ===
+    sorted_words, weight_of, selected_weaks, clustered = ranked or rank_quiz_words(vocab, confusables)
     weak_candidates = sorted_words[:10]
     normal_candidates = sorted_words[10:] if len(sorted_words) > 10 else []
-    
-    selected_weaks = weak_candidates[:3] if len(weak_candidates) >= 3 else weak_candidates
-    needed_normal = 10 - len(selected_weaks)
+    needed_normal = 10 - len(selected_weaks) - len(clustered)
     
     selected_normals = []
     if normal_candidates:
-        weights = [w.get("count", 1) for w in normal_candidates]
+        weights = [weight_of[id(w)] for w in normal_candidates]
         selected_normals = random.choices(normal_candidates, weights=weights, k=needed_normal)
     elif len(selected_weaks) < 10:
-         selected_normals = random.choices(weak_candidates, k=10-len(selected_weaks))
+         selected_normals = random.choices(weak_candidates, k=needed_normal)
 
-    quiz_words = selected_weaks + selected_normals
+    quiz_words = selected_weaks + clustered + selected_normals
     random.shuffle(quiz_words) 
+    return quiz_words, selected_weaks
 
-    # 🔥 v0.0.28 修正：單字列表回滾為簡潔格式 (日文 + 中文)，避免 AI 混淆
-    word_list_str = "\n".join([f"{w['kanji']} ({w['meaning']})" for w in quiz_words])
-
-    must_test_str = ", ".join([w['kanji'] for w in selected_weaks])
-
-    # 讀取雙軌難度
-    diff_cn_jp = float(user["stats"].get("difficulty_cn_jp", 1.0))
-    diff_jp_cn = float(user["stats"].get("difficulty_jp_cn", 1.0))
-    
-    days_passed, expected_diff, sprint_msg = get_sprint_status(user)
-    is_infinite_mode = (sprint_msg == "infinity")
-
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel(MODEL_NAME)
+def build_daily_quiz_prompt(word_list_str, must_test_str, diff_cn_jp, diff_jp_cn, custom_block, opening_block, skill_focus_str=""):
+    desc_cn_jp, _ = get_difficulty_description(diff_cn_jp)
+    desc_jp_cn, _ = get_difficulty_description(diff_jp_cn)
+    skill_block = f"3. **弱點技能加強**：{skill_focus_str} (近期最常出錯，請至少 3 題的句子需要用到這些技能)" if skill_focus_str else ""
 
-    # ================= Scenario A: 新的一天 (每日必修) =================
-    if is_new_day:
-        user["stats"]["yesterday_main_score"] = user["stats"]["daily_answers_count"]
-        user["stats"]["yesterday_bonus_score"] = user["stats"]["bonus_answers_count"]
-        user["stats"]["daily_answers_count"] = 0
-        user["stats"]["bonus_answers_count"] = 0
-        user["stats"]["execution_count"] += 1
-        exec_count = user["stats"]["execution_count"]
-        streak_days = user["stats"]["streak_days"]
-        main_score = user["stats"]["yesterday_main_score"]
-        bonus_score = user["stats"]["yesterday_bonus_score"]
-        
-        emotion_prompt = ""
-        difficulty_adjustment_msg = "" 
-
-        answer_rate = main_score / 10
-        if user["stats"]["last_quiz_date"] == "2000-01-01":
-             emotion_prompt = f"""
-             這是你第一次與使用者見面 (Day 1)。
-             **請注意：請全程使用繁體中文 (Traditional Chinese)。**
-             請用充滿活力、專業且期待的語氣打招呼。
-             自我介紹你是「N2 斯巴達 AI 教練」，並說明未來的訓練模式：
-             「每天中午我會出題，隔天中午我會檢討昨天的作業並出新題目。」
-             請給予使用者滿滿的信心！
-             """
-        else:
-            if answer_rate >= 0.8:
-                difficulty_adjustment_msg = "🔥 你的表現相當穩定，教練我看在眼裡！"
-                if bonus_score > 0:
-                    emotion_prompt = f"昨日表現：必修 {main_score}/10，Bonus {bonus_score}。狀態：神一般的自律！請用極度崇拜語氣誇獎！並提到「{difficulty_adjustment_msg}」。"
-                else:
-                    emotion_prompt = f"昨日表現：必修 {main_score}/10。狀態：優秀。給予高度肯定。並提到「{difficulty_adjustment_msg}」。"
-            elif answer_rate >= 0.4:
-                if not is_infinite_mode and diff_cn_jp < expected_diff:
-                    emotion_prompt = f"昨日表現：普通。雖然沒降級，但我們落後進度了！請稍微嚴肅一點提醒她加快腳步：『現在不是休息的時候，已經落後計畫了！』"
-                else:
-                    emotion_prompt = f"昨日表現：必修 {main_score}/10。狀態：尚可。繼續保持。"
-            else:
-                sprint_warn = f"特別注意：請引用「衝刺狀態數據 ({sprint_msg})」來警告她 (例如：我們已經落後 X 天了，這時候睡覺對得起你的 N2 報名費嗎？)。" if not is_infinite_mode else "請提醒她：無限之路不進則退，不要鬆懈了！"
-                emotion_prompt = f"""
-                昨日表現：必修 {main_score}/10。狀態：偷懶！
-                請開啟【幽默情勒模式 😈】。
-                {sprint_warn}
-                **請全程使用繁體中文。**
-                """
-        
-        print(f"🤖 生成每日必修 - CN->JP Lv{diff_cn_jp:.1f}, JP->CN Lv{diff_jp_cn:.1f}...")
-        
-        desc_cn_jp, _ = get_difficulty_description(diff_cn_jp)
-        desc_jp_cn, _ = get_difficulty_description(diff_jp_cn)
-        
-        sprint_info = "無限挑戰模式" if is_infinite_mode else f"衝刺 Day {days_passed}/{SPRINT_DURATION_DAYS} ({sprint_msg})"
-
-        # 讀取並重置使用者客製化指令
-        custom_instr_text = user["stats"].get("next_quiz_instruction", "")
-        custom_block = f"【⚠️ 特別出題指令 (來自使用者請求)】\n{custom_instr_text}\n請務必在出題時融入上述要求。" if custom_instr_text else ""
-        if custom_instr_text:
-             user["stats"]["next_quiz_instruction"] = "" # 用完即丟
-
-        # 使用變數替換避免 Markdown 截斷
-        json_marker = "```"
-
-        prompt = f"""
+    return f"""
         你是日文 N2 衝刺班教練。
-        {sprint_info}
         
         **🎯 今日雙軌難度目標：**
         - **中翻日 (7題)**: Lv {diff_cn_jp:.1f} ({desc_cn_jp})
         - **日翻中 (3題)**: Lv {diff_jp_cn:.1f} ({desc_jp_cn})
         
-        【情緒與開場】
-        {emotion_prompt}
-        請在開場白中明確提到：「這是我們的第 {exec_count} 次特訓 (Day {streak_days})！」。
-        並根據目前的進度狀態 (落後、超前或無限挑戰)展現出對應的教練態度。
-        **請不要每次都說一樣的話。請根據今天的日期、天氣（假設）、或是隨機的斯巴達哲學，變化你的開場白。讓使用者覺得你是活生生的教練，而不是錄音機。**
+        {opening_block}
         
         【今日單字庫 (含弱點 🔥)】
         {word_list_str}
@@ -916,6 +2916,7 @@ def run_daily_quiz(vocab, user):
            - **難度等級：Lv {diff_jp_cn:.1f}** (可以比中翻日更難，使用更進階的閱讀測驗句型)
            - **必須包含 1 個弱點詞/文法** (從上述弱點列表中選一個不同的)。
            - 另外 2 題隨機。
+        {skill_block}
            
         **注意：若是標記 (文法) 的項目，請務必設計出能展現該文法接續與用法的句子。**
 
@@ -939,47 +2940,202 @@ def run_daily_quiz(vocab, user):
            - 分隔線: `|||SEPARATOR|||`
            - Part 2: 解答卷 (含參考答案與解析)。
         """
-        
-        try:
-            response = model.generate_content(prompt, safety_settings=SAFETY_SETTINGS)
-            if response.text and "|||SEPARATOR|||" in response.text:
-                parts = response.text.split("|||SEPARATOR|||")
-                send_telegram(parts[0].strip())
-                user["pending_answers"] = parts[1].strip()
-                user["stats"]["last_quiz_date"] = today_str
-                user["stats"]["last_quiz_questions_count"] = 10
-        except Exception as e:
-            print(f"Error: {e}")
-            send_telegram("⚠️ 測驗生成失敗")
 
-    # ================= Scenario B: Bonus 無限挑戰 =================
-    else:
-        bonus_count = user["stats"]["bonus_answers_count"]
-        avg_diff = (diff_cn_jp + diff_jp_cn) / 2
-        bonus_difficulty = avg_diff + (bonus_count // 3) * 0.5 + 0.5 
-        
-        print(f"🤖 生成 Bonus - Lv{bonus_difficulty:.1f}...")
-        
+# ================= 明日測驗預生成 (Speculative Pre-generation) =================
+
+def difficulty_bucket(level):
+    return round(math.floor(float(level) / QUIZ_CACHE_BUCKET + 1e-9) * QUIZ_CACHE_BUCKET, 2)
+
+def focus_words_hash(ranked):
+    # 弱點詞 + 易混淆鄰居的集合 (不計順序)；隔天批改新收錄的錯誤詞 (權重 5) 擠進前幾名時雜湊就會改變
+    _, _, selected_weaks, clustered = ranked
+    terms = sorted(normalize_text(w["kanji"]) for w in selected_weaks + clustered)
+    return hashlib.sha1("\n".join(terms).encode("utf-8")).hexdigest()[:8]
+
+def quiz_cache_key(user, target_date, ranked):
+    """
+    預生成測驗的有效性鍵：出題日期 + 雙軌難度分桶 + 客製化指令 + 弱點/複習詞。
+    隔天的批改若讓弱點清單換人 (新的錯誤詞、答對後降權)，題目卷就失效、當天重新生成；
+    其餘單字只是隨機抽樣的一般題，不影響有效性。
+    """
+    stats = user["stats"]
+    instr_hash = hashlib.sha1(stats.get("next_quiz_instruction", "").encode("utf-8")).hexdigest()[:8]
+    return "|".join([
+        str(target_date),
+        f"{difficulty_bucket(stats.get('difficulty_cn_jp', 1.0)):.2f}",
+        f"{difficulty_bucket(stats.get('difficulty_jp_cn', 1.0)):.2f}",
+        instr_hash,
+        focus_words_hash(ranked),
+    ])
+
+def quiz_opening_key(exec_count, streak_days, mood, main_score, bonus_score, sprint_msg):
+    # 開場白引用的數字 (第幾次特訓、連續天數、昨日成績) 與語氣；衝刺預測的數字每天都變，只取狀態類別 (開頭的 emoji)
+    return f"{exec_count}|{streak_days}|{mood}|{main_score}|{bonus_score}|{sprint_msg[:1]}"
+
+def project_tomorrow_opening(user, sprint_status):
+    """
+    推測明天開場時的狀態：特訓次數 +1、今天有出現則連續天數 +1，昨日成績假設與最近一天相同。
+    回傳 (opening_key, opening_block)；明天實際狀態不同時只重新生成開場白，題目卷照用。
+    """
+    stats = user["stats"]
+    days_passed, _, sprint_msg = sprint_status
+    today_str = str(now_tw().date())
+    exec_count = stats.get("execution_count", 0) + 1
+    streak_days = stats.get("streak_days", 0) + 1 if stats.get("last_active") == today_str else 1
+    main_score, bonus_score = stats.get("yesterday_main_score", 0), stats.get("yesterday_bonus_score", 0)
+    is_infinite_mode = (sprint_msg == "infinity")
+    expected_diff = START_DIFFICULTY + ((days_passed + 1) / SPRINT_DURATION_DAYS) * (TARGET_DIFFICULTY - START_DIFFICULTY)
+    mood, emotion_prompt = build_emotion_prompt(main_score, bonus_score, float(stats.get("difficulty_cn_jp", 1.0)), expected_diff, sprint_msg, is_infinite_mode)
+    sprint_info = "無限挑戰模式" if is_infinite_mode else f"衝刺 Day {days_passed + 1}/{SPRINT_DURATION_DAYS} ({sprint_msg})"
+    return quiz_opening_key(exec_count, streak_days, mood, main_score, bonus_score, sprint_msg), build_opening_block(sprint_info, emotion_prompt, exec_count, streak_days)
+
+def pregenerate_next_quiz(vocab, user, cache_key, ranked, opening_key, opening_block):
+    # 以「今天批改後已定案」的雙軌難度與弱點清單，預先生成明天的開場白與題目卷
+    diff_cn_jp = float(user["stats"].get("difficulty_cn_jp", 1.0))
+    diff_jp_cn = float(user["stats"].get("difficulty_jp_cn", 1.0))
+    confusables = get_confusable_index(vocab["words"])
+    quiz_words, selected_weaks = select_quiz_words(vocab, confusables, ranked)
+    word_list_str = format_quiz_word_list(quiz_words, confusables)
+    must_test_str = ", ".join([w['kanji'] for w in selected_weaks])
+
+    custom_instr_text = user["stats"].get("next_quiz_instruction", "")
+    custom_block = f"【⚠️ 特別出題指令 (來自使用者請求)】\n{custom_instr_text}\n請務必在出題時融入上述要求。" if custom_instr_text else ""
+    opening_block += "\n        開場白結束後請單獨一行輸出 `|||OPENING|||`，再接單字預習與題目。"
+
+    skill_focus_str = format_skill_focus(user["learner_profile"]["weak_skills"])
+    prompt = build_daily_quiz_prompt(word_list_str, must_test_str, diff_cn_jp, diff_jp_cn, custom_block, opening_block, skill_focus_str)
+
+    model = get_model()
+    try:
+        response = ai_generate(model, prompt, "quiz_pregen")
+        if response.text and "|||SEPARATOR|||" in response.text:
+            parts = response.text.split("|||SEPARATOR|||")
+            opening, _, questions = parts[0].rpartition("|||OPENING|||")
+            user["quiz_cache"] = {
+                "key": cache_key,
+                "target_date": cache_key.split("|", 1)[0],
+                "opening_key": opening_key if opening.strip() else "",
+                "opening": opening.strip(),
+                "questions": questions.strip(),
+                "answers": parts[1].strip(),
+            }
+            log_to_buffer("⚙️ Cache", f"Next quiz pre-generated (key={cache_key})")
+    except Exception as e:
+        print(f"預生成失敗: {e}")
+
+def schedule_next_quiz_pregeneration(vocab, user, sprint_status, ranked):
+    if not vocab.get("words"): return
+    cache_key = quiz_cache_key(user, (now_tw() + timedelta(days=1)).date(), ranked)
+    cached = user.get("quiz_cache")
+    if cached and cached.get("key") == cache_key:
+        return # 快取仍有效，不需重算
+    opening_key, opening_block = project_tomorrow_opening(user, sprint_status)
+    run_in_background(pregenerate_next_quiz, vocab, user, cache_key, ranked, opening_key, opening_block)
+
+def take_cached_quiz(user, ranked):
+    cached = user.get("quiz_cache")
+    if not cached: return None
+    user["quiz_cache"] = None
+    today = now_tw().date()
+    if cached.get("target_date") != str(today) or cached.get("key") != quiz_cache_key(user, today, ranked):
+        log_to_buffer("⚙️ Cache", "Pre-generated quiz invalidated, regenerating.")
+        return None
+    return cached
+
+def build_emotion_prompt(main_score, bonus_score, diff_cn_jp, expected_diff, sprint_msg, is_infinite_mode, is_first_day=False):
+    # 依昨日成績決定開場語氣；回傳 (語氣分類, 給 AI 的情緒指示)
+    if is_first_day:
+        return "first", f"""
+             這是你第一次與使用者見面 (Day 1)。
+             **請注意：請全程使用繁體中文 (Traditional Chinese)。**
+             請用充滿活力、專業且期待的語氣打招呼。
+             自我介紹你是「N2 斯巴達 AI 教練」，並說明未來的訓練模式：
+             「每天中午我會出題，隔天中午我會檢討昨天的作業並出新題目。」
+             請給予使用者滿滿的信心！
+             """
+    answer_rate = main_score / 10
+    if answer_rate >= 0.8:
+        difficulty_adjustment_msg = "🔥 你的表現相當穩定，教練我看在眼裡！"
+        if bonus_score > 0:
+            return "great_bonus", f"昨日表現：必修 {main_score}/10，Bonus {bonus_score}。狀態：神一般的自律！請用極度崇拜語氣誇獎！並提到「{difficulty_adjustment_msg}」。"
+        return "great", f"昨日表現：必修 {main_score}/10。狀態：優秀。給予高度肯定。並提到「{difficulty_adjustment_msg}」。"
+    if answer_rate >= 0.4:
+        if not is_infinite_mode and diff_cn_jp < expected_diff:
+            return "behind", f"昨日表現：普通。雖然沒降級，但我們落後進度了！請稍微嚴肅一點提醒她加快腳步：『現在不是休息的時候，已經落後計畫了！』可引用衝刺狀態數據：{sprint_msg}"
+        return "ok", f"昨日表現：必修 {main_score}/10。狀態：尚可。繼續保持。"
+    sprint_warn = f"特別注意：請引用「衝刺狀態數據 ({sprint_msg})」來警告她 (例如：我們已經落後 X 天了，這時候睡覺對得起你的 N2 報名費嗎？)。" if not is_infinite_mode else "請提醒她：無限之路不進則退，不要鬆懈了！"
+    return "lazy", f"""
+                昨日表現：必修 {main_score}/10。狀態：偷懶！
+                請開啟【幽默情勒模式 😈】。
+                {sprint_warn}
+                **請全程使用繁體中文。**
+                """
+
+def build_opening_block(sprint_info, emotion_prompt, exec_count, streak_days):
+    return f"""{sprint_info}
+
+        【情緒與開場】
+        {emotion_prompt}
+        請在開場白中明確提到：「這是我們的第 {exec_count} 次特訓 (Day {streak_days})！」。
+        並根據目前的進度狀態 (落後、超前或無限挑戰)展現出對應的教練態度。
+        **請不要每次都說一樣的話。請根據今天的日期、天氣（假設）、或是隨機的斯巴達哲學，變化你的開場白。讓使用者覺得你是活生生的教練，而不是錄音機。**"""
+
+def generate_quiz_opening(model, emotion_prompt, exec_count, streak_days, sprint_info):
+    # 預生成的開場白與當天狀態不符時才呼叫 (只生成簡短開場白，題目卷照用快取)
+    prompt = f"""
+    你是日文 N2 衝刺班教練。
+    {sprint_info}
+    
+    【情緒與開場】
+    {emotion_prompt}
+    請在開場白中明確提到：「這是我們的第 {exec_count} 次特訓 (Day {streak_days})！」。
+    並根據目前的進度狀態 (落後、超前或無限挑戰)展現出對應的教練態度。
+    **請不要每次都說一樣的話。請根據今天的日期、天氣（假設）、或是隨機的斯巴達哲學，變化你的開場白。**
+    
+    【輸出格式】
+    只輸出 3~5 行開場白 (繁體中文)，不要出題。**嚴禁** 使用 Markdown 標題與 HTML 標籤。
+    """
+    try:
+        response = ai_generate(model, prompt, "opening")
+        if response.text: return response.text.strip()
+    except Exception as e:
+        print(f"開場白生成失敗: {e}")
+    return f"⚔️ 這是我們的第 {exec_count} 次特訓 (Day {streak_days})！\n{sprint_info}"
+
+# ================= Bonus 預取池 (Prefetch Pool) =================
+
+def bonus_pool_key(difficulty):
+    return f"{difficulty:.1f}"
+
+def build_bonus_prompt(difficulties, word_list_str):
+    # 一次呼叫生成多組 Bonus，每組對應下一個難度階 (bonus_count // 3 的遞增)
+    level_blocks = []
+    for idx, bonus_difficulty in enumerate(difficulties, start=1):
         base_level = int(bonus_difficulty)
         next_level = base_level + 1
         decimal_part = bonus_difficulty - base_level
         base_desc, next_desc = get_difficulty_description(bonus_difficulty)
+        level_blocks.append(f"""
+        **🎯 第 {idx} 組 Bonus 難度等級：{bonus_difficulty:.1f}**
+        - Lv{base_level}: {base_desc} (佔 {(1-decimal_part)*100:.0f}%)
+        - Lv{next_level}: {next_desc} (佔 {decimal_part*100:.0f}%)
+        - 標題請寫：⚔️ **Bonus 無限挑戰 (Lv{bonus_difficulty:.1f})** ⚔️""")
+    levels_str = "\n".join(level_blocks)
 
-        prompt = f"""
+    return f"""
         你是日文 N2 斯巴達教練。使用者今天已經完成每日作業，但她**主動**再次回來執行程式 (挑戰 Bonus)。
         
         請用一種**「充滿誘惑力與挑戰性」**的語氣開場。
         **⚠️ 創意要求**：請不要每次都說一樣的話。請根據今天的日期、天氣（假設）、或是隨機的斯巴達哲學，變化你的開場白。讓使用者覺得你是活生生的教練，而不是錄音機。
         這是一種對強者的認可，同時帶有挑釁意味：「像一位魔鬼教練看到學員主動留下來加練時那種『露齒一笑』的感覺。😏」
         
-        **🎯 Bonus 難度等級：{bonus_difficulty:.1f}**
-        - Lv{base_level}: {base_desc} (佔 {(1-decimal_part)*100:.0f}%)
-        - Lv{next_level}: {next_desc} (佔 {decimal_part*100:.0f}%)
+        請一次製作 **{len(difficulties)} 組** 彼此獨立的 Bonus 挑戰，難度逐組提升：
+        {levels_str}
         
         【今日單字庫 (含弱點 🔥)】
         {word_list_str}
         
-        提供 **3 題** 翻譯挑戰 (2中翻日，1日翻中)。
+        每一組提供 **3 題** 翻譯挑戰 (2中翻日，1日翻中)，各組題目不可重複，開場白也要各自不同。
         **請盡量優先使用單字庫中標記為 🔥 的弱點項目來出題，折磨使用者！**
 
         【🚫 品質紅線】
@@ -992,36 +3148,214 @@ def run_daily_quiz(vocab, user):
         2. **排版**：
            - **嚴禁** 使用 Markdown 標題 (如 # 或 ##)。
            - 請使用 Emoji (如 🔥, 🚀, 💡, 🌟) 來區隔段落。
-           - 標題請寫：⚔️ **Bonus 無限挑戰 (Lv{bonus_difficulty:.1f})** ⚔️
            - **嚴禁** 使用 HTML 標籤 (如 <br>)，請直接換行。
         
-        3. **結構**：
+        3. **結構 (每一組)**：
            - Part 1: Bonus 題目卷 (含開場、3題)。**不要**給答案。
            - 分隔線: `|||SEPARATOR|||`
            - Part 2: 解答卷 (含參考答案與解析)。
+        4. **組與組之間**請用分隔線 `|||SET|||` 隔開，依難度由低到高排列。
         """
 
+def generate_bonus_sets(model, start_difficulty, word_list_str):
+    difficulties = [start_difficulty + i * BONUS_DIFFICULTY_STEP for i in range(BONUS_PREFETCH_SETS)]
+    prompt = build_bonus_prompt(difficulties, word_list_str)
+    response = ai_generate(model, prompt, "bonus")
+    if not response.text: return []
+
+    bonus_sets = []
+    for difficulty, chunk in zip(difficulties, response.text.split("|||SET|||")):
+        if "|||SEPARATOR|||" not in chunk: break
+        parts = chunk.split("|||SEPARATOR|||")
+        bonus_sets.append({
+            "difficulty": round(difficulty, 2),
+            "questions": parts[0].strip(),
+            "answers": parts[1].strip(),
+        })
+    return bonus_sets
+
+def store_bonus_sets(user, bonus_sets):
+    # 每個難度階只備一組，避免重複補貨浪費額度
+    pool = user.setdefault("bonus_pool", {})
+    for bonus_set in bonus_sets:
+        queue = pool.setdefault(bonus_pool_key(bonus_set["difficulty"]), [])
+        if not queue: queue.append(bonus_set)
+
+def take_bonus_set(user, difficulty):
+    pool = user.get("bonus_pool", {})
+    queue = pool.get(bonus_pool_key(difficulty))
+    if not queue: return None
+    bonus_set = queue.pop(0)
+    if not queue: del pool[bonus_pool_key(difficulty)]
+    return bonus_set
+
+def prune_bonus_pool(user, current_difficulty):
+    # 比目前 Bonus 難度還低、或遠超過預取範圍的組別 (難度在批改後漂移造成) 已經用不到了
+    pool = user.get("bonus_pool", {})
+    upper = current_difficulty + BONUS_PREFETCH_SETS * BONUS_DIFFICULTY_STEP
+    for key in [k for k in pool if float(k) < round(current_difficulty, 1) or float(k) > round(upper, 1)]:
+        del pool[key]
+
+def refill_bonus_pool(user, start_difficulty, word_list_str):
+    model = get_model()
+    try:
+        bonus_sets = generate_bonus_sets(model, start_difficulty, word_list_str)
+        store_bonus_sets(user, bonus_sets)
+        log_to_buffer("⚙️ Cache", f"Bonus pool refilled from Lv{start_difficulty:.1f} ({len(bonus_sets)} sets)")
+    except Exception as e:
+        print(f"Bonus 預取失敗: {e}")
+
+def run_daily_quiz(vocab, user):
+    if not vocab.get("words"):
+        send_telegram("📭 單字庫空的！請傳送單字或匯入 JSON。")
+        return user
+    
+    # 處理上次詳解
+    pending_answers = user.get("pending_answers", "")
+    if pending_answers:
+        send_telegram(f"🗝️ **前次測驗詳解**\n\n{pending_answers}")
+        time.sleep(TG_SEND_INTERVAL * 3)
+        user["pending_answers"] = ""
+    
+    today_str = str(now_tw().date())
+    is_new_day = (user["stats"]["last_quiz_date"] != today_str)
+
+    confusables = get_confusable_index(vocab["words"])
+    ranked = rank_quiz_words(vocab, confusables)
+    quiz_words, selected_weaks = select_quiz_words(vocab, confusables, ranked)
+
+    # 🔥 v0.0.28 修正：單字列表回滾為簡潔格式 (日文 + 中文)，避免 AI 混淆
+    # 易混淆詞併成同一行，其餘維持一行一詞
+    word_list_str = format_quiz_word_list(quiz_words, confusables)
+
+    must_test_str = ", ".join([w['kanji'] for w in selected_weaks])
+    # 弱點技能由批改時預先排好，這裡直接取前幾名
+    skill_focus_str = format_skill_focus(user["learner_profile"]["weak_skills"])
+
+    # 讀取雙軌難度
+    diff_cn_jp = float(user["stats"].get("difficulty_cn_jp", 1.0))
+    diff_jp_cn = float(user["stats"].get("difficulty_jp_cn", 1.0))
+    
+    sprint_status = get_sprint_status(user)
+    days_passed, expected_diff, sprint_msg = sprint_status
+    is_infinite_mode = (sprint_msg == "infinity")
+
+    model = get_model()
+
+    # ================= Scenario A: 新的一天 (每日必修) =================
+    if is_new_day:
+        stat_set(user["stats"], "yesterday_main_score", user["stats"]["daily_answers_count"])
+        stat_set(user["stats"], "yesterday_bonus_score", user["stats"]["bonus_answers_count"])
+        stat_set(user["stats"], "daily_answers_count", 0)
+        stat_set(user["stats"], "bonus_answers_count", 0)
+        stat_add(user["stats"], "execution_count", 1)
+        user["bonus_pool"] = {} # 新的一天單字庫與難度都變了，清空 Bonus 預取池
+        exec_count = user["stats"]["execution_count"]
+        streak_days = user["stats"]["streak_days"]
+        main_score = user["stats"]["yesterday_main_score"]
+        bonus_score = user["stats"]["yesterday_bonus_score"]
+        
+        is_first_day = (user["stats"]["last_quiz_date"] == "2000-01-01")
+        mood, emotion_prompt = build_emotion_prompt(main_score, bonus_score, diff_cn_jp, expected_diff, sprint_msg, is_infinite_mode, is_first_day)
+        sprint_info = "無限挑戰模式" if is_infinite_mode else f"衝刺 Day {days_passed}/{SPRINT_DURATION_DAYS} ({sprint_msg})"
+
+        # 🚀 預生成快取命中：開場白與題目卷都在前一次執行時生成；開場白的推測與今天狀態不符時才重新生成開場白
+        cached_quiz = take_cached_quiz(user, ranked)
+        if cached_quiz:
+            print("⚡ 使用預生成的每日必修...")
+            opening = cached_quiz.get("opening", "")
+            if not opening or cached_quiz.get("opening_key") != quiz_opening_key(exec_count, streak_days, mood, main_score, bonus_score, sprint_msg):
+                opening = generate_quiz_opening(model, emotion_prompt, exec_count, streak_days, sprint_info)
+            send_telegram(f"{opening}\n\n{cached_quiz['questions']}")
+            user["pending_answers"] = cached_quiz["answers"]
+            stat_set(user["stats"], "last_quiz_date", today_str)
+            stat_set(user["stats"], "last_quiz_questions_count", 10)
+            stat_set(user["stats"], "next_quiz_instruction", "") # 已融入預生成題目
+            schedule_next_quiz_pregeneration(vocab, user, sprint_status, ranked)
+            return user
+
+        print(f"🤖 生成每日必修 - CN->JP Lv{diff_cn_jp:.1f}, JP->CN Lv{diff_jp_cn:.1f}...")
+
+        # 讀取並重置使用者客製化指令
+        custom_instr_text = user["stats"].get("next_quiz_instruction", "")
+        custom_block = f"【⚠️ 特別出題指令 (來自使用者請求)】\n{custom_instr_text}\n請務必在出題時融入上述要求。" if custom_instr_text else ""
+        if custom_instr_text:
+             stat_set(user["stats"], "next_quiz_instruction", "") # 用完即丟
+
+        opening_block = build_opening_block(sprint_info, emotion_prompt, exec_count, streak_days)
+
+        prompt = build_daily_quiz_prompt(word_list_str, must_test_str, diff_cn_jp, diff_jp_cn, custom_block, opening_block, skill_focus_str)
+        
         try:
-            response = model.generate_content(prompt, safety_settings=SAFETY_SETTINGS)
+            response = ai_generate(model, prompt, "quiz")
             if response.text and "|||SEPARATOR|||" in response.text:
                 parts = response.text.split("|||SEPARATOR|||")
                 send_telegram(parts[0].strip())
-                user["pending_answers"] = parts[1].strip() 
+                user["pending_answers"] = parts[1].strip()
+                stat_set(user["stats"], "last_quiz_date", today_str)
+                stat_set(user["stats"], "last_quiz_questions_count", 10)
         except Exception as e:
             print(f"Error: {e}")
-            send_telegram("⚠️ Bonus 生成失敗")
+            send_telegram("⚠️ 測驗生成失敗")
+
+    # ================= Scenario B: Bonus 無限挑戰 =================
+    else:
+        bonus_count = user["stats"]["bonus_answers_count"]
+        avg_diff = (diff_cn_jp + diff_jp_cn) / 2
+        bonus_difficulty = avg_diff + (bonus_count // 3) * BONUS_DIFFICULTY_STEP + 0.5 
+        
+        prune_bonus_pool(user, bonus_difficulty)
+        pooled_set = take_bonus_set(user, bonus_difficulty)
+        if pooled_set:
+            print(f"⚡ 使用預取 Bonus - Lv{bonus_difficulty:.1f}...")
+            send_telegram(pooled_set["questions"])
+            user["pending_answers"] = pooled_set["answers"]
+        else:
+            print(f"🤖 生成 Bonus - Lv{bonus_difficulty:.1f} (預取 {BONUS_PREFETCH_SETS} 組)...")
+            try:
+                bonus_sets = generate_bonus_sets(model, bonus_difficulty, word_list_str)
+                if bonus_sets:
+                    first_set = bonus_sets.pop(0)
+                    send_telegram(first_set["questions"])
+                    user["pending_answers"] = first_set["answers"]
+                    store_bonus_sets(user, bonus_sets)
+                else:
+                    send_telegram("⚠️ Bonus 生成失敗")
+            except Exception as e:
+                print(f"Error: {e}")
+                send_telegram("⚠️ Bonus 生成失敗")
 
+        # 答完這組 (3 題) 後下一次 Bonus 會升一階；只有那一階缺貨時才背景補貨 (一次補 BONUS_PREFETCH_SETS 組)
+        next_difficulty = bonus_difficulty + BONUS_DIFFICULTY_STEP
+        if not user.get("bonus_pool", {}).get(bonus_pool_key(next_difficulty)):
+            run_in_background(refill_bonus_pool, user, next_difficulty, word_list_str)
+
+    # 今天的批改已定案難度，趁機預生成明天的每日必修
+    schedule_next_quiz_pregeneration(vocab, user, sprint_status, ranked)
     return user
 
+def main():
+    TRACER.reset()
+    try:
+        with TRACER.span("run"):
+            with TRACER.span("process_data"): v_data, u_data = process_data()
+            with TRACER.span("run_daily_quiz"): u_data_updated = run_daily_quiz(v_data, u_data)
+            with TRACER.span("wait_background"): wait_background_tasks()
+
+            # stats 事件、評分紀錄、vocab.json 與 user_data.json 一起提交；內容沒變的檔案不會重寫
+            user = u_data_updated or u_data
+            journal_entries = STATS_JOURNAL.prepare_commit(user["stats"], str(now_tw().date()))
+            with TRACER.span("save_state") as attrs:
+                written = save_state({VOCAB_FILE: v_data, USER_DATA_FILE: user}, journal_entries, prepare_assessment_commit())
+                attrs["files"] = written
+            if written:
+                with TRACER.span("log_render"): write_log_file(user)
+            else:
+                print("💤 狀態沒有變化，略過寫檔。")
+    finally:
+        # 不論成功或失敗都留下本次執行的報告 (失敗時 run span 會帶著 error)
+        save_run_report()
+        print(f"⏱️ 最慢階段：{format_slowest_spans(TRACER.summary())}")
+
 if __name__ == "__main__":
-    v_data, u_data = process_data()
-    u_data_updated = run_daily_quiz(v_data, u_data)
-    
-    # 寫入更新後的 JSON 資料
-    save_json(VOCAB_FILE, v_data)
-    if u_data_updated:
-        save_json(USER_DATA_FILE, u_data_updated)
-        write_log_file(u_data_updated)
-    else:
-        save_json(USER_DATA_FILE, u_data)
-        write_log_file(u_data)
\ No newline at end of file
+    main()
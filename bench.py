@@ -0,0 +1,441 @@
+"""
+效能基準 (Benchmarks)
+
+用法：
+    python bench.py index --entries 100000 --new-lines 20 --queries 200
+    python bench.py import --items 50000
+    python bench.py normalize
+    python bench.py memory --entries 1000000
+    python bench.py serialize --sizes 1000,100000,1000000
+    python bench.py suite --vocab-sizes 1000,100000,1000000 --batch-sizes 1,100,10000 --out bench_results.json
+    python bench.py suite --baseline bench_baseline.json            # 與基準比較
+    python bench.py suite --save-baseline bench_baseline.json       # 存成新的基準
+
+bench_baseline.json 是隨版本庫提交的參考基準 (預設參數，config 內記錄 Python 版本)。
+計時與機器有關：在不同機器上比較前，先在改動前的版本用 --save-baseline 重新產生。
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from fake_services import load_bot_module
+
+KANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+KANJI = "日本語学生先生会社時間仕事電話天気映画音楽旅行料理勉強問題説明経験影響提供深刻我慢努力挑戦"
+PARTICLES = ["は", "が", "を", "に", "で", "と", "も", "から", "まで"]
+
+# ================= 合成資料 =================
+
+def synth_word(rng):
+    return "".join(rng.choice(KANJI) for _ in range(rng.randint(1, 3)))
+
+def synth_sentence(rng):
+    parts = []
+    for _ in range(rng.randint(2, 5)):
+        parts.append(synth_word(rng) + rng.choice(PARTICLES))
+    parts.append("".join(rng.choice(KANA) for _ in range(rng.randint(2, 4))) + "ます。")
+    return "".join(parts)
+
+# ================= 統計 =================
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered: return 0.0
+    idx = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+def summarize_ms(samples):
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
+
+# ================= 基準項目 =================
+
+def bench_index(bot, entries, new_lines, queries, seed):
+    rng = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix="dj_bench_index_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+
+    def append_archive(count):
+        with open(bot.TRANSLATION_ARCHIVE_FILE, "a", encoding="utf-8") as f:
+            for i in range(count):
+                f.write(json.dumps({"date": f"2026-01-{i % 28 + 1:02d}", "text": synth_sentence(rng)}, ensure_ascii=False) + "\n")
+
+    def open_index():
+        bot.reset_history_index()
+        return bot.get_history_index({})
+
+    try:
+        append_archive(entries)
+        _, build_s = timed(open_index)   # 第一次 (沒有索引檔)：整份歸檔建立並存檔
+        _, load_s = timed(open_index)    # 歸檔沒變：只讀回索引檔
+        append_archive(new_lines)
+        index, incremental_s = timed(open_index) # 一般執行：讀回索引檔 + 只補新歸檔的幾行
+
+        samples = []
+        for _ in range(queries):
+            query = synth_sentence(rng)
+            started = time.perf_counter()
+            index.search(query, bot.RETRIEVAL_TOP_K)
+            samples.append(time.perf_counter() - started)
+        result = {"entries": entries, "new_lines": new_lines, "index_bytes": os.path.getsize(bot.HISTORY_INDEX_FILE),
+                  "build_s": round(build_s, 3), "load_s": round(load_s, 3), "incremental_s": round(incremental_s, 3)}
+    finally:
+        bot.reset_history_index()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return dict(result, **summarize_ms(samples))
+
+def synth_import_payload(rng, count, dup_ratio=0.1):
+    words = []
+    for i in range(count):
+        if words and rng.random() < dup_ratio:
+            words.append(dict(rng.choice(words)))
+            continue
+        words.append({"kanji": f"{synth_word(rng)}{i}", "kana": "".join(rng.choice(KANA) for _ in range(4)), "meaning": f"意思{i}"})
+    return words
+
+def bench_import(bot, count, existing, seed):
+    rng = random.Random(seed)
+    vocab = {"words": synth_import_payload(rng, existing, 0.0)}
+    payload = synth_import_payload(rng, count)
+    results = {"items": count, "existing": existing}
+
+    text = json.dumps(payload, ensure_ascii=False)
+    started = time.perf_counter()
+    added, skipped, merged = bot.import_vocab_items(json.loads(json.dumps(vocab)), bot.iter_json_array(io.StringIO(text)), "2026-01-01")
+    results["json_s"] = round(time.perf_counter() - started, 3)
+    results["json_counts"] = {"added": added, "skipped": skipped, "merged": merged}
+
+    csv_text = "kanji,kana,meaning\n" + "\n".join(f"{w['kanji']},{w['kana']},{w['meaning']}" for w in payload)
+    started = time.perf_counter()
+    bot.import_vocab_items(json.loads(json.dumps(vocab)), bot.iter_delimited_rows(io.StringIO(csv_text), ","), "2026-01-01")
+    results["csv_s"] = round(time.perf_counter() - started, 3)
+    return results
+
+def legacy_normalize(text):
+    # v0.0.28 以前的 normalize_text，作為對照組
+    if not text: return ""
+    return text.strip().replace("　", " ").lower()
+
+def bench_normalize(bot, count, repeats, seed):
+    rng = random.Random(seed)
+    variants = [lambda w: w, lambda w: "　" + w + " ", lambda w: w.replace("~", "〜"), lambda w: w.upper()]
+    terms = [rng.choice(variants)(synth_word(rng) + rng.choice(["", "~ている", "カタカナ", "ＡＢＣ"])) for _ in range(count)]
+    results = {"terms": count, "repeats": repeats}
+
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for t in terms: legacy_normalize(t)
+    results["legacy_ns_per_call"] = round((time.perf_counter() - started) / (count * repeats) * 1e9, 1)
+
+    bot.normalize_text.cache_clear()
+    started = time.perf_counter()
+    for t in terms: bot.normalize_text(t)
+    results["cold_ns_per_call"] = round((time.perf_counter() - started) / count * 1e9, 1)
+
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for t in terms: bot.normalize_text(t)
+    results["warm_ns_per_call"] = round((time.perf_counter() - started) / (count * repeats) * 1e9, 1)
+    results["cache"] = bot.normalize_text.cache_info()._asdict()
+    return results
+
+def synth_vocab_json(rng, count):
+    words = []
+    for i in range(count):
+        words.append({
+            "kanji": f"{synth_word(rng)}{i}", "kana": "".join(rng.choice(KANA) for _ in range(4)),
+            "meaning": f"意思{i}", "count": rng.randint(1, 9),
+            "added_date": f"2026-{i % 12 + 1:02d}-{i % 28 + 1:02d}", "type": rng.choice(["word", "grammar"]),
+        })
+    return json.dumps({"words": words}, ensure_ascii=False)
+
+def traced_bytes(build):
+    # 回傳 build() 結果本身常駐的記憶體 (tracemalloc 量測，不含暫存)
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+def bench_memory(bot, entries, seed):
+    rng = random.Random(seed)
+    text = synth_vocab_json(rng, entries)
+    results = {"entries": entries}
+
+    dicts, dict_bytes = traced_bytes(lambda: json.loads(text)["words"])
+    results["dict_bytes_per_word"] = round(dict_bytes / entries, 1)
+
+    records, record_bytes = traced_bytes(lambda: [bot.WordRecord(w) for w in json.loads(text)["words"]])
+    results["record_bytes_per_word"] = round(record_bytes / entries, 1)
+    del records
+
+    results["record_reduction"] = round(dict_bytes / record_bytes, 2)
+
+    # 主程式實際的抽題路徑：在 WordRecord 清單上依衰減權重排序 / 抽樣
+    records = [bot.WordRecord(w) for w in dicts]
+    started = time.perf_counter()
+    bot.select_quiz_words({"words": records})
+    results["record_select_quiz_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return results
+
+def synth_state(rng, words):
+    vocab = json.loads(synth_vocab_json(rng, words))
+    user = {
+        "schema_version": 1,
+        "stats": {"difficulty_cn_jp": 1.35, "difficulty_jp_cn": 1.2, "streak_days": 12, "last_active": "2026-01-01"},
+        "translation_log": [f"2026-01-{i % 28 + 1:02d}: {synth_sentence(rng)}" for i in range(100)],
+    }
+    return vocab, user
+
+def bench_serialize(bot, sizes, seed):
+    rng = random.Random(seed)
+    backends = [bot.StdlibSerializer()]
+    for name in ["orjson", "msgspec"]:
+        candidate = bot.make_serializer(name)
+        if candidate.name == name: backends.append(candidate)
+    results = {"backends": [s.name for s in backends], "sizes": {}}
+    for size in sizes:
+        vocab, user = synth_state(rng, size)
+        vocab["words"] = [bot.WordRecord(w) for w in vocab["words"]]
+        reference = backends[0].dumps(vocab)
+        row = {"bytes": len(reference.encode("utf-8"))}
+        for backend in backends:
+            started = time.perf_counter()
+            text = backend.dumps(vocab)
+            backend.dumps(user)
+            dump_s = time.perf_counter() - started
+            started = time.perf_counter()
+            backend.loads(text)
+            load_s = time.perf_counter() - started
+            row[backend.name] = {"dump_s": round(dump_s, 4), "load_s": round(load_s, 4), "identical": text == reference}
+        results["sizes"][size] = row
+    return results
+
+# ================= 基準套件 (process_data / run_daily_quiz 各階段) =================
+
+def synth_vocab(bot, rng, count):
+    return {"words": [bot.WordRecord(w) for w in json.loads(synth_vocab_json(rng, count))["words"]]}
+
+def synth_update_batch(rng, vocab, count, start_id=1000):
+    """
+    getUpdates 的回應文字：約 80% 是作答 (多行)，其餘是「漢字 假名 意思」的存單字訊息，
+    其中一半是單字庫已有的詞 (走強化記憶)，一半是新詞。
+    """
+    updates, answers, entries = [], [], []
+    for i in range(count):
+        if rng.random() < 0.8:
+            text = "\n".join(synth_sentence(rng) for _ in range(rng.randint(1, 3)))
+            answers.append(text)
+        else:
+            term = rng.choice(vocab["words"])["kanji"] if rng.random() < 0.5 else f"{synth_word(rng)}新{i}"
+            text = f"{term} かな 意思"
+            entries.append(term)
+        updates.append({"update_id": start_id + i, "message": {"chat": {"id": 1}, "date": 1700000000 + i, "text": text}})
+    return json.dumps({"ok": True, "result": updates}, ensure_ascii=False), answers, entries
+
+def synth_grading_reply(rng, vocab, sentences):
+    assessments = [{"input": s[:30], "type": "CN_TO_JP", "score": round(rng.uniform(3, 10), 1), "status": "ATTEMPTED"} for s in sentences]
+    mistakes = []
+    for i in range(max(1, len(sentences) // 10)):
+        term = rng.choice(vocab["words"])["kanji"] if i % 2 == 0 else f"{synth_word(rng)}誤{i}"
+        mistakes.append({"term": term, "type": "word", "meaning": "AI 修正", "skills": ["particle"]})
+    payload = json.dumps({"mistakes": mistakes, "assessments": assessments}, ensure_ascii=False)
+    return "\n".join(f"Q{i}: 8.0分" for i in range(len(sentences))) + f"\n```json\n{payload}\n```"
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+def budgeted(items, vocab_size, budget):
+    # 與單字庫大小相乘的階段 (逐詞掃描) 超過預算時只跑前幾筆，再線性外推回整批
+    n = max(1, min(len(items), budget // max(1, vocab_size)))
+    return items[:n], (len(items) / n if items else 1.0)
+
+def bench_suite_cell(bot, rng, vocab, batch_size, budget):
+    metrics, extrapolated = {}, []
+    today_str = str(bot.now_tw().date())
+    raw, answers, entries = synth_update_batch(rng, vocab, batch_size)
+
+    # parse：getUpdates 回應解析 + 分句 + 批改 JSON 解析
+    def parse():
+        json.loads(raw)
+        sentences = bot.segment_submission(answers)
+        return bot.parse_correction_result(synth_grading_reply(rng, vocab, sentences))[1]
+    parsed, metrics["parse"] = timed(parse)
+
+    # dedupe：存單字訊息比對單字庫 (Case B)，整批共用一次建好的正規化詞索引
+    def dedupe():
+        key_index = bot.build_vocab_key_index(vocab["words"])
+        return [key_index.get(bot.normalize_text(term)) for term in entries]
+    _, metrics["dedupe"] = timed(dedupe)
+
+    # mistake merge：批改的 mistakes 併入單字庫 (含易混淆索引)
+    (mistaken_terms, _, _), metrics["mistake_merge"] = timed(lambda: bot.apply_mistakes(vocab, parsed["mistakes"], today_str))
+
+    # reward pass：逐詞在整批作答裡找，成本與單字數成正比 → 超過預算時改為抽前幾個詞再外推
+    words, scale = budgeted(vocab["words"], len(answers), budget)
+    _, elapsed = timed(lambda: bot.reward_correct_usage({"words": words}, "\n\n".join(answers), mistaken_terms, today_str))
+    metrics["reward_pass"] = elapsed * scale
+    if scale > 1: extrapolated.append("reward_pass")
+
+    # write_log_file：儀表板 + 本次 LOG_BUFFER (每則訊息一行)
+    bot.LOG_BUFFER[:] = [f"[12:00:00] 👤 User: {a[:60]}" for a in answers + entries]
+    _, metrics["write_log_file"] = timed(lambda: bot.write_log_file(bot.new_user_data()))
+    bot.LOG_BUFFER.clear()
+    return metrics, extrapolated
+
+def bench_suite(bot, vocab_sizes, batch_sizes, budget, index_limit, seed):
+    rng = random.Random(seed)
+    metrics, extrapolated, skipped = {}, [], []
+    workdir = tempfile.mkdtemp(prefix="dj_bench_")
+    cwd = os.getcwd()
+    get_confusable_index = bot.get_confusable_index
+    os.chdir(workdir)
+    try:
+        for vocab_size in vocab_sizes:
+            vocab = synth_vocab(bot, rng, vocab_size)
+            prefix = f"vocab={vocab_size}"
+
+            # 易混淆索引的建置成本高於線性；超過 index_limit 時改用空索引，其餘階段照常量測
+            bot.get_confusable_index = get_confusable_index
+            bot.CONFUSABLE_INDEX = (None, None)
+            if vocab_size > index_limit:
+                empty_index = bot.ConfusableIndex([])
+                bot.get_confusable_index = lambda words: empty_index
+                skipped.append(f"{prefix}/confusable_index")
+
+            # run_daily_quiz 選詞：易混淆索引 (冷啟動) + 弱點優先抽樣
+            confusables, elapsed = timed(lambda: bot.get_confusable_index(vocab["words"]))
+            if vocab_size <= index_limit: metrics[f"{prefix}/confusable_index"] = elapsed
+            _, metrics[f"{prefix}/quiz_selection"] = timed(lambda: bot.select_quiz_words(vocab, confusables))
+
+            # save_json：第一次寫入 (序列化 + 原子寫入) 與內容未變時的略過判斷
+            bot.LOADED_DIGESTS.clear()
+            _, metrics[f"{prefix}/save_json"] = timed(lambda: bot.save_json(bot.VOCAB_FILE, vocab))
+            _, metrics[f"{prefix}/save_json_unchanged"] = timed(lambda: bot.save_json(bot.VOCAB_FILE, vocab))
+
+            for batch_size in batch_sizes:
+                cell, cell_extrapolated = bench_suite_cell(bot, rng, vocab, batch_size, budget)
+                for stage, seconds in cell.items():
+                    metrics[f"{prefix}/batch={batch_size}/{stage}"] = seconds
+                extrapolated.extend(f"{prefix}/batch={batch_size}/{stage}" for stage in cell_extrapolated)
+                if os.path.exists(bot.LOG_FILE): os.remove(bot.LOG_FILE)
+            del vocab
+    finally:
+        bot.get_confusable_index = get_confusable_index
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "config": {"vocab_sizes": vocab_sizes, "batch_sizes": batch_sizes, "budget": budget, "index_limit": index_limit,
+                   "seed": seed, "python": sys.version.split()[0]},
+        "metrics": {k: round(v, 6) for k, v in metrics.items()},
+        "extrapolated": extrapolated,
+        "skipped": skipped,
+    }
+
+def compare_to_baseline(metrics, baseline, threshold):
+    """
+    逐項比較 (current / baseline)：超過 threshold 倍記為 regression，低於 1/threshold 記為 improved。
+    太小的量測 (< 1ms) 雜訊太大，只列出不判定。
+    """
+    rows, regressions = {}, []
+    for key, current in metrics.items():
+        before = baseline.get(key)
+        if before is None: continue
+        ratio = current / before if before > 0 else float("inf")
+        status = "ok"
+        if max(current, before) >= 0.001:
+            if ratio > threshold: status = "regression"
+            elif ratio < 1 / threshold: status = "improved"
+        else:
+            status = "noise"
+        rows[key] = {"baseline": before, "current": current, "ratio": round(ratio, 3), "status": status}
+        if status == "regression": regressions.append(key)
+    return {"threshold": threshold, "rows": rows, "regressions": regressions,
+            "missing": sorted(set(baseline) - set(metrics)), "new": sorted(set(metrics) - set(baseline))}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the Daily Japanese bot.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_index = sub.add_parser("index", help="history index cold build / persisted load / incremental update / query latency")
+    p_index.add_argument("--entries", type=int, default=100000)
+    p_index.add_argument("--new-lines", type=int, default=20, help="archive lines appended before the incremental run")
+    p_index.add_argument("--queries", type=int, default=200)
+    p_index.add_argument("--seed", type=int, default=7)
+
+    p_import = sub.add_parser("import", help="bulk vocabulary import throughput")
+    p_import.add_argument("--items", type=int, default=50000)
+    p_import.add_argument("--existing", type=int, default=10000)
+    p_import.add_argument("--seed", type=int, default=7)
+
+    p_norm = sub.add_parser("normalize", help="normalize_text microbenchmark")
+    p_norm.add_argument("--terms", type=int, default=20000)
+    p_norm.add_argument("--repeats", type=int, default=20)
+    p_norm.add_argument("--seed", type=int, default=7)
+
+    p_mem = sub.add_parser("memory", help="in-memory vocab footprint (dict vs WordRecord) and quiz selection time")
+    p_mem.add_argument("--entries", type=int, default=1000000)
+    p_mem.add_argument("--seed", type=int, default=7)
+
+    p_ser = sub.add_parser("serialize", help="state file load / dump per serializer backend")
+    p_ser.add_argument("--sizes", default="1000,100000,1000000", help="comma-separated word counts")
+    p_ser.add_argument("--seed", type=int, default=7)
+
+    p_suite = sub.add_parser("suite", help="per-stage timings of process_data / run_daily_quiz with baseline comparison")
+    p_suite.add_argument("--vocab-sizes", default="1000,10000,100000,1000000", help="comma-separated vocab sizes")
+    p_suite.add_argument("--batch-sizes", default="1,100,10000", help="comma-separated update batch sizes")
+    p_suite.add_argument("--budget", type=int, default=10_000_000, help="max vocab x batch work per stage before extrapolating")
+    p_suite.add_argument("--index-limit", type=int, default=20000, help="largest vocab for which the confusable index is built")
+    p_suite.add_argument("--seed", type=int, default=7)
+    p_suite.add_argument("--out", default="bench_results.json", help="write machine-readable results here")
+    p_suite.add_argument("--baseline", default=None, help="compare against this stored results file")
+    p_suite.add_argument("--save-baseline", default=None, help="also store these results as the new baseline")
+    p_suite.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio counted as a regression")
+    p_suite.add_argument("--fail-on-regression", action="store_true", help="exit 1 when any stage regressed")
+
+    args = parser.parse_args()
+    bot = load_bot_module()
+
+    if args.command == "index":
+        result = bench_index(bot, args.entries, args.new_lines, args.queries, args.seed)
+    elif args.command == "import":
+        result = bench_import(bot, args.items, args.existing, args.seed)
+    elif args.command == "normalize":
+        result = bench_normalize(bot, args.terms, args.repeats, args.seed)
+    elif args.command == "memory":
+        result = bench_memory(bot, args.entries, args.seed)
+    elif args.command == "serialize":
+        result = bench_serialize(bot, [int(x) for x in args.sizes.split(",")], args.seed)
+    elif args.command == "suite":
+        result = bench_suite(bot, [int(x) for x in args.vocab_sizes.split(",")], [int(x) for x in args.batch_sizes.split(",")], args.budget, args.index_limit, args.seed)
+        if args.baseline:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+            result["comparison"] = compare_to_baseline(result["metrics"], baseline["metrics"], args.threshold)
+            result["comparison"]["baseline_config"] = baseline.get("config") # 設定不同時比值沒有意義
+        for path in [args.out, args.save_baseline]:
+            if not path: continue
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.command == "suite" and args.fail_on_regression and result.get("comparison", {}).get("regressions"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+由 JMdict 產生機器人使用的 JLPT 字典來源檔 (TSV)
+
+用法：
+    python build_dictionary.py JMdict_e.xml jlpt_levels.tsv -o jlpt_dict_seed.tsv
+    python build_dictionary.py JMdict_e.xml jlpt_levels.tsv --meanings my_meanings.tsv -o jlpt_dict_seed.tsv
+
+jlpt_levels.tsv 每行為「單字<TAB>等級」(例如 `影響\tN3`)，只有出現在清單中的詞會被輸出。
+JMdict 只提供讀音 (沒有中文釋義)；meaning 欄與單字庫一樣用繁體中文，取自 --meanings
+(格式同種子檔，預設沿用現有的 jlpt_dict_seed.tsv)，查不到的詞留空，機器人只會拿來補讀音與等級。
+JMdict 以 iterparse 串流讀取，不會把整份 XML 載入記憶體。
+"""
+import argparse
+import xml.etree.ElementTree as ET
+
+from fake_services import load_bot_module
+
+def load_level_list(path):
+    levels = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"): continue
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) >= 2: levels[parts[0].strip()] = parts[1].strip().upper()
+    return levels
+
+def load_meanings(path):
+    # 種子檔格式 (kanji<TAB>kana<TAB>meaning<TAB>jlpt)；只取中文釋義
+    meanings = {}
+    if not path: return meanings
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip() or line.startswith("#"): continue
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) >= 3 and parts[2].strip(): meanings.setdefault(parts[0].strip(), parts[2].strip())
+    except FileNotFoundError: pass
+    return meanings
+
+def iter_jmdict_entries(path):
+    # 每個 <entry> 處理完就 clear()，記憶體用量與檔案大小無關
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag != "entry": continue
+        kanji = [k.text for k in elem.findall("k_ele/keb")]
+        kana = [r.text for r in elem.findall("r_ele/reb")]
+        elem.clear()
+        if kana: yield kanji, kana
+
+def build_source(jmdict_path, level_path, out_path, meanings_path=None):
+    bot = load_bot_module()
+    levels = {bot.normalize_text(k): v for k, v in load_level_list(level_path).items()}
+    meanings = {bot.normalize_text(k): v for k, v in load_meanings(meanings_path).items()} # 先讀完，輸出檔可以就是來源檔
+    seen = set()
+    written = 0
+    with open(out_path, "w", encoding="utf-8") as out:
+        out.write("# kanji\tkana\tmeaning\tjlpt (generated from JMdict; meaning 為繁體中文)\n")
+        for kanji_list, kana_list in iter_jmdict_entries(jmdict_path):
+            for headword in (kanji_list or kana_list[:1]):
+                key = bot.normalize_text(headword)
+                level = levels.get(key)
+                # 同一個詞在 JMdict 可能出現在多個 entry，只輸出第一筆
+                if not level or key in seen: continue
+                seen.add(key)
+                out.write(f"{headword}\t{kana_list[0]}\t{meanings.get(key, '')}\t{level}\n")
+                written += 1
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the JLPT dictionary source from JMdict.")
+    parser.add_argument("jmdict")
+    parser.add_argument("levels")
+    parser.add_argument("-o", "--out", default="jlpt_dict_seed.tsv")
+    parser.add_argument("--meanings", default="jlpt_dict_seed.tsv", help="TSV with Traditional Chinese meanings (seed format)")
+    parser.add_argument("--compile", action="store_true", help="also compile the mmap lookup file")
+    args = parser.parse_args()
+
+    written = build_source(args.jmdict, args.levels, args.out, args.meanings)
+    print(f"wrote {written} entries to {args.out}")
+    if args.compile:
+        bot = load_bot_module()
+        print(f"compiled {bot.build_jlpt_dictionary(args.out, bot.JLPT_DICT_FILE)} keys to {bot.JLPT_DICT_FILE}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+狀態檔格式轉換 (整份 JSON <-> JSONL)
+
+用法：
+    python convert_state.py              # vocab.json / user_data.json -> .jsonl
+    python convert_state.py --to json    # 轉回整份 JSON (方便手動檢視或回滾到舊版程式)
+    python convert_state.py --dir path/to/state --keep
+
+機器人本身讀到舊格式時也會自動轉換，這支腳本用於一次性轉換或回滾。
+TG_MSG.log 會一併轉成由舊到新排序。
+"""
+import argparse
+import os
+
+from fake_services import load_bot_module
+
+def convert(bot, to_format, keep):
+    converted = []
+    for jsonl_name, json_name in bot.LEGACY_STATE_FILES.items():
+        source, target = (json_name, jsonl_name) if to_format == "jsonl" else (jsonl_name, json_name)
+        if not os.path.exists(source): continue
+        with open(source, "r", encoding="utf-8") as f:
+            raw = f.read()
+        journal = bot.StatsJournal(bot.STATS_JOURNAL_FILE)
+        if source.endswith(".jsonl"):
+            data = bot.parse_jsonl_document(jsonl_name, raw)
+            if jsonl_name == bot.USER_DATA_FILE: # JSONL 不存 stats，轉回整份 JSON 時由日誌重建
+                data["stats"] = journal.load() or data.get("stats", {})
+            text = bot.get_serializer().dumps(data)
+        else:
+            data = bot.get_serializer().loads(raw)
+            if jsonl_name == bot.USER_DATA_FILE and isinstance(data.get("stats"), dict) and journal.load() is None:
+                # JSONL 不存 stats：還沒有日誌時先把檔案裡的 stats 寫成初始快照
+                journal.start_from(data["stats"])
+                journal.append_missing(journal.prepare_commit(data["stats"], str(bot.now_tw().date())))
+                converted.append(f"{source} stats -> {bot.STATS_JOURNAL_FILE}")
+            text = bot.dump_jsonl_document(jsonl_name, data)
+        bot.atomic_write_text(target, text)
+        if not keep: os.remove(source)
+        converted.append(f"{source} -> {target}")
+
+    if to_format == "jsonl" and os.path.exists(bot.LOG_FILE):
+        with open(bot.LOG_FILE, "r", encoding="utf-8") as f:
+            content = f.read()
+        if bot.LEGACY_LOG_SEPARATOR in content:
+            header, logs = content.split(bot.LEGACY_LOG_SEPARATOR, 1)
+            header = header.replace("(由新到舊排序)", "(由舊到新排序，最新一次執行在檔案最後)")
+            bot.atomic_write_text(bot.LOG_FILE, header + bot.LOG_SEPARATOR + bot.chronological_log_blocks(logs))
+            converted.append(f"{bot.LOG_FILE} -> oldest first")
+    return converted
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert bot state files between JSON and JSONL.")
+    parser.add_argument("--to", choices=["jsonl", "json"], default="jsonl")
+    parser.add_argument("--dir", default=".", help="directory holding the state files")
+    parser.add_argument("--keep", action="store_true", help="keep the source files")
+    args = parser.parse_args()
+
+    bot = load_bot_module()
+    os.chdir(args.dir)
+    for line in convert(bot, args.to, args.keep) or ["nothing to convert"]:
+        print(line)
+
+if __name__ == "__main__":
+    main()
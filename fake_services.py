@@ -0,0 +1,461 @@
+"""
+離線替身：本機 Telegram Bot API 伺服器 + 行程內 Gemini 假模型
+
+不需要 GEMINI_API_KEY / TG_BOT_TOKEN / 網路，就能把 process_data → run_daily_quiz
+整條流程跑完，用於壓力測試與回歸基準。
+
+用法：
+    python fake_services.py --runs 20 --messages 5 --model-latency lognormal:-1.5,0.4 --model-error-rate 0.05
+"""
+import argparse
+import importlib.util
+import json
+import math
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BOT_SCRIPT = "Daily_Japanese_v0.0.28.py"
+STATE_FILES = ["vocab.jsonl", "user_data.jsonl", "vocab.json", "user_data.json", "TG_MSG.log", "translation_archive.jsonl", "stats_journal.jsonl", "assessments.jsonl", "jlpt_dict_seed.tsv"]
+
+# ================= 模組載入 =================
+
+def load_bot_module(path=None):
+    # 主程式檔名含版本號 (有小數點)，只能用路徑載入
+    path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), BOT_SCRIPT)
+    spec = importlib.util.spec_from_file_location("daily_japanese_bot", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# ================= 延遲分佈 & 錯誤注入 =================
+
+class LatencyModel:
+    """
+    延遲分佈，規格字串格式：
+    - "0" / "fixed:0.05"       固定秒數
+    - "uniform:0.01,0.2"      均勻分佈
+    - "normal:0.1,0.02"       常態分佈 (截斷於 0)
+    - "lognormal:-2.0,0.5"    對數常態 (mu, sigma)，適合模擬長尾
+    """
+    def __init__(self, spec="0", seed=None):
+        self.spec = spec
+        self.rng = random.Random(seed)
+        kind, _, args = spec.partition(":")
+        if not args:
+            kind, args = "fixed", kind
+        self.kind = kind
+        self.args = [float(a) for a in args.split(",") if a]
+
+    def sample(self):
+        if self.kind == "fixed":
+            return self.args[0] if self.args else 0.0
+        if self.kind == "uniform":
+            return self.rng.uniform(self.args[0], self.args[1])
+        if self.kind == "normal":
+            return max(0.0, self.rng.gauss(self.args[0], self.args[1]))
+        if self.kind == "lognormal":
+            return self.rng.lognormvariate(self.args[0], self.args[1])
+        raise ValueError(f"Unknown latency model: {self.spec}")
+
+    def wait(self):
+        delay = self.sample()
+        if delay > 0: time.sleep(delay)
+        return delay
+
+class FaultInjector:
+    def __init__(self, error_rate=0.0, seed=None):
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def should_fail(self):
+        with self.lock:
+            return self.rng.random() < self.error_rate
+
+# ================= Telegram Bot API 替身 =================
+
+class FakeTelegramServer:
+    """
+    在 127.0.0.1 開一個 Bot API 替身，支援 getUpdates / sendMessage / editMessageText / getFile (含檔案下載)。
+    主程式只要把 TG_API_BASE 指到 base_url 即可，送出的訊息都會記在 sent_messages。
+    """
+    def __init__(self, token="TEST_TOKEN", chat_id=10001, latency="0", error_rate=0.0, seed=None):
+        self.token = token
+        self.chat_id = chat_id
+        self.latency = LatencyModel(latency, seed)
+        self.faults = FaultInjector(error_rate, seed)
+        self.lock = threading.Lock()
+        self.updates = []
+        self.sent_messages = []
+        self.edits = []
+        self.files = {}
+        self.request_counts = {}
+        self.next_update_id = 1000
+        self.next_message_id = 1
+        self.httpd = None
+        self.thread = None
+
+    # --- 測資 ---
+
+    def push_message(self, text, date=None, chat_id=None):
+        with self.lock:
+            self.next_update_id += 1
+            self.updates.append({
+                "update_id": self.next_update_id,
+                "message": {
+                    "message_id": self.next_update_id,
+                    "chat": {"id": chat_id or self.chat_id},
+                    "date": int(date or time.time()),
+                    "text": text,
+                },
+            })
+            return self.next_update_id
+
+    def push_document(self, file_name, content, date=None):
+        # 模擬使用者上傳檔案 (getFile + 檔案下載)
+        with self.lock:
+            self.next_update_id += 1
+            file_id = f"file{self.next_update_id}"
+            self.files[file_id] = (f"documents/{file_name}", content)
+            self.updates.append({
+                "update_id": self.next_update_id,
+                "message": {
+                    "message_id": self.next_update_id,
+                    "chat": {"id": self.chat_id},
+                    "date": int(date or time.time()),
+                    "document": {"file_id": file_id, "file_name": file_name, "file_size": len(content)},
+                },
+            })
+            return self.next_update_id
+
+    def push_update(self, update):
+        with self.lock:
+            self.next_update_id = max(self.next_update_id, update["update_id"])
+            self.updates.append(update)
+
+    # --- API ---
+
+    def handle(self, method, params):
+        with self.lock:
+            self.request_counts[method] = self.request_counts.get(method, 0) + 1
+        self.latency.wait()
+        if self.faults.should_fail():
+            return 500, {"ok": False, "error_code": 500, "description": "Injected fault"}
+
+        if method == "getUpdates":
+            offset = int(params.get("offset", 0) or 0)
+            with self.lock:
+                result = [u for u in self.updates if u["update_id"] >= offset]
+            return 200, {"ok": True, "result": result}
+
+        if method == "getFile":
+            with self.lock:
+                stored = self.files.get(params.get("file_id"))
+            if not stored:
+                return 400, {"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"}
+            return 200, {"ok": True, "result": {"file_id": params.get("file_id"), "file_path": stored[0], "file_size": len(stored[1])}}
+
+        if method == "sendMessage":
+            with self.lock:
+                message_id = self.next_message_id
+                self.next_message_id += 1
+                self.sent_messages.append({"message_id": message_id, "chat_id": params.get("chat_id"), "text": params.get("text", "")})
+            return 200, {"ok": True, "result": {"message_id": message_id, "text": params.get("text", "")}}
+
+        if method == "editMessageText":
+            with self.lock:
+                self.edits.append(dict(params))
+                for msg in self.sent_messages:
+                    if str(msg["message_id"]) == str(params.get("message_id")):
+                        msg["text"] = params.get("text", "")
+            return 200, {"ok": True, "result": {"message_id": params.get("message_id"), "text": params.get("text", "")}}
+
+        return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _dispatch(self, params):
+                parsed = urlparse(self.path)
+                prefix = f"/bot{server.token}/"
+                file_prefix = f"/file/bot{server.token}/"
+                if parsed.path.startswith(file_prefix):
+                    self._send_file(parsed.path[len(file_prefix):])
+                    return
+                if not parsed.path.startswith(prefix):
+                    status, body = 401, {"ok": False, "error_code": 401, "description": "Unauthorized"}
+                else:
+                    query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+                    query.update(params)
+                    status, body = server.handle(parsed.path[len(prefix):], query)
+                payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_file(self, file_path):
+                with server.lock:
+                    content = next((c for p, c in server.files.values() if p == file_path), None)
+                self.send_response(200 if content is not None else 404)
+                self.send_header("Content-Length", str(len(content or b"")))
+                self.end_headers()
+                self.wfile.write(content or b"")
+
+            def do_GET(self):
+                self._dispatch({})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0) or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    params = json.loads(raw.decode("utf-8")) if raw else {}
+                except ValueError:
+                    params = {k: v[-1] for k, v in parse_qs(raw.decode("utf-8")).items()}
+                self._dispatch(params)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+# ================= Gemini 假模型 =================
+
+def _canned_quiz(prompt):
+    questions = "\n".join(f"🔹 Q{i}. 測試題目 {i}" for i in range(1, 11))
+    answers = "\n".join(f"🔹 A{i}. 參考答案 {i}" for i in range(1, 11))
+    # 預生成的 prompt 要求開場白後接 |||OPENING||| 分隔線
+    opening = "⚔️ 今日特訓開始！\n|||OPENING|||" if "|||OPENING|||" in prompt else "⚔️ 今日特訓開始！"
+    return f"{opening}\n{questions}\n|||SEPARATOR|||\n{answers}"
+
+def _canned_bonus(prompt):
+    sets = []
+    for idx in range(1, prompt.count("**🎯 第") + 1):
+        sets.append(f"⚔️ Bonus 第 {idx} 組\n🔥 Q1\n🔥 Q2\n🔥 Q3\n|||SEPARATOR|||\n💡 A1\n💡 A2\n💡 A3")
+    return "\n|||SET|||\n".join(sets or ["⚔️ Bonus\n🔥 Q1\n|||SEPARATOR|||\n💡 A1"])
+
+def _canned_correction(prompt, rng):
+    # 從 prompt 中取回使用者的回答，逐句給分
+    start = prompt.find("「") + 1
+    end = prompt.find("」\n", start)
+    user_text = prompt[start:end] if start > 0 and end > start else ""
+    lines = [l.strip() for l in user_text.split("\n") if len(l.strip()) > 1] or [user_text]
+    assessments = []
+    for line in lines:
+        is_japanese = any("぀" <= ch <= "ヿ" for ch in line)
+        score = round(rng.uniform(5.0, 10.0), 1)
+        assessments.append({
+            "input": line[:30],
+            "type": "CN_TO_JP" if is_japanese else "JP_TO_CN",
+            "score": score,
+            "status": "ATTEMPTED",
+        })
+    mistakes = []
+    if lines and rng.random() < 0.3:
+        mistakes.append({"term": lines[0][:2], "type": "word", "meaning": "AI 修正", "skills": [rng.choice(["particle", "conjugation", "tense", "keigo"])]})
+    feedback = "\n".join(f"Q{i}: {a['score']}分 - (教練短評: 假模型評語)" for i, a in enumerate(assessments, start=1))
+    payload = json.dumps({"mistakes": mistakes, "assessments": assessments}, ensure_ascii=False)
+    return f"{feedback}\n```json\n{payload}\n```"
+
+def classify_prompt(prompt):
+    if "|||SET|||" in prompt: return "bonus"
+    if "|||SEPARATOR|||" in prompt: return "quiz"
+    if '"mistakes"' in prompt: return "correction"
+    if '"new_difficulty"' in prompt: return "assess"
+    if '"actions"' in prompt: return "request"
+    return "other"
+
+class FakeUsage:
+    def __init__(self, prompt, text):
+        self.prompt_token_count = len(prompt) // 2
+        self.candidates_token_count = len(text) // 2
+        self.total_token_count = self.prompt_token_count + self.candidates_token_count
+
+class FakeResponse:
+    def __init__(self, prompt, text):
+        self.text = text
+        self.usage_metadata = FakeUsage(prompt, text)
+
+class FakeGeminiModel:
+    """
+    與 genai.GenerativeModel 相容的 generate_content()，依 prompt 類型回傳罐頭回應。
+    responses 可覆寫任一類型：{"quiz": "...", "correction": callable(prompt) -> str}
+    """
+    def __init__(self, latency="0", error_rate=0.0, responses=None, seed=None):
+        self.latency = LatencyModel(latency, seed)
+        self.faults = FaultInjector(error_rate, seed)
+        self.responses = responses or {}
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def generate_content(self, prompt, safety_settings=None):
+        kind = classify_prompt(prompt)
+        started = time.perf_counter()
+        self.latency.wait()
+        failed = self.faults.should_fail()
+        with self.lock:
+            self.calls.append({"kind": kind, "prompt_chars": len(prompt), "failed": failed, "seconds": time.perf_counter() - started})
+        if failed:
+            raise RuntimeError(f"Injected model fault ({kind})")
+
+        override = self.responses.get(kind)
+        if callable(override):
+            text = override(prompt)
+        elif override is not None:
+            text = override
+        elif kind == "quiz":
+            text = _canned_quiz(prompt)
+        elif kind == "bonus":
+            text = _canned_bonus(prompt)
+        elif kind == "correction":
+            with self.lock:
+                text = _canned_correction(prompt, self.rng)
+        elif kind == "assess":
+            text = '{ "new_difficulty": 2.0, "reason": "假模型評估" }'
+        elif kind == "request":
+            text = '收到！\n```json\n{ "actions": { "adjust_difficulty": 0.0, "quiz_instruction": "" } }\n```'
+        else:
+            text = "假模型回應"
+        return FakeResponse(prompt, text)
+
+    def call_counts(self):
+        counts = {}
+        with self.lock:
+            for call in self.calls:
+                counts[call["kind"]] = counts.get(call["kind"], 0) + 1
+        return counts
+
+# ================= 串接主程式 =================
+
+def install_fakes(bot, telegram, model):
+    bot.TG_API_BASE = telegram.base_url
+    bot.TG_BOT_TOKEN = telegram.token
+    bot.TG_CHAT_ID = str(telegram.chat_id)
+    bot.TG_SEND_INTERVAL = 0
+    bot.get_model = lambda: model
+
+def prepare_workdir(source_dir=None):
+    # 複製一份狀態檔到暫存目錄，避免動到真正的學習紀錄
+    workdir = tempfile.mkdtemp(prefix="dj_offline_")
+    if source_dir:
+        for name in STATE_FILES:
+            src = os.path.join(source_dir, name)
+            if os.path.exists(src): shutil.copy(src, workdir)
+    return workdir
+
+def last_update_id(bot, workdir):
+    # 沿用既有狀態時，假更新 ID 必須接在 last_update_id 之後，否則會被當成舊訊息略過
+    try:
+        journal_path = os.path.join(workdir, bot.STATS_JOURNAL_FILE)
+        if os.path.exists(journal_path):
+            return int((bot.StatsJournal(journal_path).load() or {}).get("last_update_id", 0))
+        jsonl_path = os.path.join(workdir, "user_data.jsonl")
+        if os.path.exists(jsonl_path):
+            with open(jsonl_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry.get("key") == "stats": return int(entry["value"].get("last_update_id", 0))
+            return 0
+        with open(os.path.join(workdir, "user_data.json"), "r", encoding="utf-8") as f:
+            return int(json.load(f)["stats"].get("last_update_id", 0))
+    except Exception:
+        return 0
+
+def run_offline_pipeline(bot):
+    bot.LOG_BUFFER.clear()
+    started = time.perf_counter()
+    bot.main()
+    return time.perf_counter() - started
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered: return 0.0
+    idx = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot pipeline offline against fake services.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=3, help="user messages pushed before each run")
+    parser.add_argument("--lines", type=int, default=3, help="answer lines per message")
+    parser.add_argument("--state-dir", default=None, help="copy initial state files from this directory")
+    parser.add_argument("--tg-latency", default="0")
+    parser.add_argument("--tg-error-rate", type=float, default=0.0)
+    parser.add_argument("--model-latency", default="0")
+    parser.add_argument("--model-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="print machine-readable summary")
+    args = parser.parse_args()
+
+    bot = load_bot_module()
+    workdir = prepare_workdir(args.state_dir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    rng = random.Random(args.seed)
+
+    durations = []
+    try:
+        with FakeTelegramServer(latency=args.tg_latency, error_rate=args.tg_error_rate, seed=args.seed) as telegram:
+            model = FakeGeminiModel(latency=args.model_latency, error_rate=args.model_error_rate, seed=args.seed)
+            install_fakes(bot, telegram, model)
+            telegram.next_update_id = max(telegram.next_update_id, last_update_id(bot, workdir))
+            # 第一次執行只會記錄 last_update_id (fresh start)，先暖機
+            telegram.push_message("暖機")
+            run_offline_pipeline(bot)
+            for _ in range(args.runs):
+                for _ in range(args.messages):
+                    lines = [f"テスト{rng.randint(1, 999)}の文です。" for _ in range(args.lines)]
+                    telegram.push_message("\n".join(lines))
+                durations.append(run_offline_pipeline(bot))
+            summary = {
+                "runs": args.runs,
+                "p50_s": round(statistics.median(durations), 4) if durations else 0.0,
+                "p95_s": round(_percentile(durations, 95), 4),
+                "max_s": round(max(durations), 4) if durations else 0.0,
+                "model_calls": model.call_counts(),
+                "tg_requests": dict(telegram.request_counts),
+                "messages_sent": len(telegram.sent_messages),
+            }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print(f"🏁 {summary['runs']} runs | p50 {summary['p50_s']}s | p95 {summary['p95_s']}s | max {summary['max_s']}s")
+        print(f"🤖 model calls: {summary['model_calls']}")
+        print(f"📨 TG requests: {summary['tg_requests']} | sent {summary['messages_sent']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+回放：以 TG_MSG.log 的真實對話紀錄重建 getUpdates 批次，對著 fake_services 的替身重跑整條流程
+
+每個「### 🗓️ YYYY-MM-DD Execution」區塊就是一次執行：
+- 👤 User 行 (含 update ID) 還原成同一批 getUpdates 更新，時間用紀錄上的時間 (虛擬時鐘)
+- ⚙️ AI Feed 行是當時批改合併後的 JSON，拆回逐句後依每次批改呼叫的句子重新組合；用完後改用罐頭回應
+- 上傳的檔案內容沒有留在紀錄裡，只計數不回放
+
+報告：吞吐量、模型呼叫數與 token、各階段延遲 (取自主程式的 TRACER spans)，以及與紀錄 / 預期狀態的差異 (state divergence)。
+
+用法：
+    python replay.py --log TG_MSG.log
+    python replay.py --log TG_MSG.log --expected-dir . --json
+"""
+import argparse
+import json
+import math
+import os
+import re
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from fake_services import FakeGeminiModel, FakeTelegramServer, _canned_correction, install_fakes, load_bot_module
+from simulate import SEED_FILES, VirtualClock, run_bot
+
+EXECUTION_PATTERN = re.compile(r"^### 🗓️ (\d{4}-\d{2}-\d{2}) Execution$", re.M)
+ENTRY_PATTERN = re.compile(r"^\[(\d\d:\d\d:\d\d)\] ([^:\n]+?): ", re.M)
+UPDATE_ID_PATTERN = re.compile(r"\s*\(ID: (\d+)\)\s*$")
+ENTRY_SEPARATOR = "\n----------------------------------------"
+DIVERGENCE_KEYS = ["execution_count", "streak_days", "last_update_id", "difficulty_cn_jp", "difficulty_jp_cn", "daily_answers_count", "bonus_answers_count"]
+
+# ================= 紀錄解析 =================
+
+def read_log_history(bot, path):
+    # 回傳由舊到新排序的對話紀錄 (不含儀表板)；舊版由新到舊的紀錄會先反轉
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    if bot.LOG_SEPARATOR in content:
+        return content.split(bot.LOG_SEPARATOR, 1)[1]
+    if bot.LEGACY_LOG_SEPARATOR in content:
+        return bot.chronological_log_blocks(content.split(bot.LEGACY_LOG_SEPARATOR, 1)[1])
+    return content
+
+def parse_executions(history):
+    """
+    切成執行區塊，每塊再切成 [時間] 角色: 內容 的紀錄 (內容可以跨多行)。
+    """
+    executions = []
+    heads = list(EXECUTION_PATTERN.finditer(history))
+    for i, head in enumerate(heads):
+        block = history[head.end():heads[i + 1].start() if i + 1 < len(heads) else len(history)]
+        block = block.split(ENTRY_SEPARATOR, 1)[0]
+        marks = list(ENTRY_PATTERN.finditer(block))
+        entries = []
+        for j, mark in enumerate(marks):
+            text = block[mark.end():marks[j + 1].start() if j + 1 < len(marks) else len(block)]
+            entries.append({"time": mark.group(1), "role": mark.group(2), "text": text.rstrip("\n")})
+        executions.append({"date": head.group(1), "entries": entries})
+    return executions
+
+def recorded_updates(execution, chat_id, tz):
+    # 還原成 getUpdates 的 update；回傳 (updates, 略過的檔案上傳數)
+    updates, skipped_documents = [], 0
+    for entry in execution["entries"]:
+        if entry["role"] != "👤 User": continue
+        mark = UPDATE_ID_PATTERN.search(entry["text"])
+        if not mark: continue
+        text = entry["text"][:mark.start()]
+        if text.startswith("📎 "):
+            skipped_documents += 1
+            continue
+        sent_at = datetime.strptime(f"{execution['date']} {entry['time']}", "%Y-%m-%d %H:%M:%S").replace(tzinfo=tz)
+        updates.append({
+            "update_id": int(mark.group(1)),
+            "message": {"message_id": int(mark.group(1)), "chat": {"id": chat_id}, "date": int(sent_at.timestamp()), "text": text},
+        })
+    return updates, skipped_documents
+
+def recorded_feeds(execution):
+    feeds = []
+    for entry in execution["entries"]:
+        if entry["role"] == "⚙️ AI Feed" and entry["text"].startswith("JSON: "):
+            try: feeds.append(json.loads(entry["text"][len("JSON: "):]))
+            except ValueError: continue
+    return feeds
+
+def count_role(entries, role):
+    return sum(1 for entry in entries if entry["role"] == role)
+
+def execution_start(execution, tz):
+    # 以該次執行的第一筆紀錄時間當作執行時間 (沒有紀錄時用排程的 12:05)
+    first = execution["entries"][0]["time"] if execution["entries"] else "12:05:00"
+    return datetime.strptime(f"{execution['date']} {first}", "%Y-%m-%d %H:%M:%S").replace(tzinfo=tz)
+
+# ================= 替身模型 =================
+
+class ReplayModel(FakeGeminiModel):
+    """
+    批改優先使用紀錄中的 AI Feed (依序取用)，其餘 prompt 沿用 FakeGeminiModel 的罐頭回應。
+    """
+    def __init__(self, seed=None):
+        super().__init__(seed=seed, responses={"correction": self.correction})
+        self.feeds = []
+        self.recorded_used = 0
+        self.canned_used = 0
+
+    def load_feeds(self, feeds):
+        # 紀錄中的 AI Feed 是整批合併後的結果；批改則是逐句呼叫，所以拆回每句一份 (mistakes 只跟著第一句)
+        pieces = []
+        for feed in feeds:
+            assessments = feed.get("assessments") or [{}]
+            for i, assessment in enumerate(assessments):
+                pieces.append({"mistakes": feed.get("mistakes", []) if i == 0 else [], "assessments": [assessment] if assessment else []})
+        with self.lock: self.feeds = pieces
+
+    def take_feed(self, text):
+        """
+        一次批改呼叫可能包含多句 (分批平行批改或整份作業)：每句優先挑 input 相符的那份，否則依序取用，
+        再合併成這次呼叫的回覆。紀錄已用完時回傳 None。
+        """
+        sentences = [l.strip() for l in text.split("\n") if len(l.strip()) > 1] or [text]
+        merged = {"mistakes": [], "assessments": []}
+        with self.lock:
+            if not self.feeds: return None
+            for sentence in sentences:
+                if not self.feeds: break
+                match = 0
+                for i, piece in enumerate(self.feeds):
+                    recorded = (piece["assessments"] or [{}])[0].get("input", "")
+                    if recorded and sentence and (recorded in sentence or sentence in recorded):
+                        match = i
+                        break
+                piece = self.feeds.pop(match)
+                merged["mistakes"].extend(piece["mistakes"])
+                merged["assessments"].extend(piece["assessments"])
+        return merged
+
+    def correction(self, prompt):
+        start = prompt.find("「") + 1
+        end = prompt.find("」\n", start)
+        feed = self.take_feed(prompt[start:end].strip() if start > 0 and end > start else "")
+        with self.lock:
+            if feed is None:
+                self.canned_used += 1
+                return _canned_correction(prompt, self.rng)
+            self.recorded_used += 1
+        feedback = "\n".join(f"Q{i}: {a.get('score', 0.0)}分 - (教練短評: 回放評語)" for i, a in enumerate(feed["assessments"], start=1))
+        return f"{feedback}\n```json\n{json.dumps(feed, ensure_ascii=False)}\n```"
+
+# ================= 量測 =================
+
+def collect_spans(bot, timings, tokens):
+    """
+    每次執行後讀主程式 TRACER 的報告 (與 run_report.json 同一份資料)：
+    run 底下的各階段與每個 ai.* 呼叫的耗時併入 timings，token 用量累加到 tokens。
+    """
+    report = bot.TRACER.report()
+    root = next((s for s in report["spans"] if s["name"] == "run" and s["parent"] is None), None)
+    for span in report["spans"]:
+        if span["ms"] is None: continue
+        if (root and span["parent"] == root["id"]) or span["name"].startswith("ai."):
+            timings.setdefault(span["name"], []).append(span["ms"] / 1000)
+    for key, value in report["ai"].items():
+        if key.endswith("_tokens"): tokens[key] = tokens.get(key, 0) + value
+
+def summarize_seconds(samples):
+    ordered = sorted(samples)
+    if not ordered: return {}
+    p95 = ordered[min(len(ordered) - 1, max(0, math.ceil(0.95 * len(ordered)) - 1))]
+    return {"n": len(ordered), "p50_ms": round(statistics.median(ordered) * 1000, 3), "p95_ms": round(p95 * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3), "total_s": round(sum(ordered), 4)}
+
+def read_state(bot, directory):
+    """
+    唯讀地讀出某個目錄的 stats 與單字數 (不呼叫 load_user_data，避免動到主程式載入時的全域狀態)。
+    stats 以事件日誌為準；沒有日誌的舊版狀態才退回 user_data 裡的 stats。
+    """
+    stats, vocab_size = None, None
+    journal_path = os.path.join(directory, bot.STATS_JOURNAL_FILE)
+    if os.path.exists(journal_path):
+        stats = bot.StatsJournal(journal_path).load()
+    for name, legacy in [(bot.USER_DATA_FILE, bot.LEGACY_STATE_FILES.get(bot.USER_DATA_FILE)), (bot.VOCAB_FILE, bot.LEGACY_STATE_FILES.get(bot.VOCAB_FILE))]:
+        data = None
+        if os.path.exists(os.path.join(directory, name)):
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                data = bot.parse_jsonl_document(name, f.read())
+        elif legacy and os.path.exists(os.path.join(directory, legacy)):
+            with open(os.path.join(directory, legacy), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        if data is None: continue
+        if name == bot.VOCAB_FILE: vocab_size = len(data.get("words", []))
+        elif stats is None: stats = data.get("stats")
+    return stats or {}, vocab_size
+
+def state_divergence(expected, actual):
+    stats_e, vocab_e = expected
+    stats_a, vocab_a = actual
+    rows = {}
+    for key in DIVERGENCE_KEYS:
+        if key not in stats_e: continue
+        e, a = stats_e.get(key), stats_a.get(key)
+        rows[key] = {"expected": e, "replayed": a, "match": e == a}
+    if vocab_e is not None:
+        rows["vocab_words"] = {"expected": vocab_e, "replayed": vocab_a, "match": vocab_e == vocab_a}
+    return rows
+
+# ================= 回放主流程 =================
+
+def run_replay(bot, args):
+    executions = parse_executions(read_log_history(bot, args.log))
+    if args.limit: executions = executions[:args.limit]
+    if not executions: raise SystemExit(f"No executions found in {args.log}")
+
+    clock = VirtualClock(execution_start(executions[0], bot.TW_TZ))
+    bot.CLOCK = clock
+    timings, tokens, per_execution = {}, {}, []
+    totals = {"executions": len(executions), "messages": 0, "skipped_documents": 0}
+
+    with FakeTelegramServer(seed=args.seed) as telegram:
+        model = ReplayModel(seed=args.seed)
+        install_fakes(bot, telegram, model)
+
+        # 第一次執行只會記錄 last_update_id (fresh start)；暖機訊息的 ID 排在所有紀錄之前
+        all_ids = [u["update_id"] for e in executions for u in recorded_updates(e, telegram.chat_id, bot.TW_TZ)[0]]
+        telegram.push_update({"update_id": max(1, min(all_ids, default=2) - 1), "message": {
+            "message_id": 0, "chat": {"id": telegram.chat_id}, "date": int(clock.now.timestamp()) - 60, "text": "暖機"}})
+        run_bot(bot, args.verbose)
+
+        started = time.perf_counter()
+        for execution in executions:
+            updates, skipped = recorded_updates(execution, telegram.chat_id, bot.TW_TZ)
+            for update in updates: telegram.push_update(update)
+            model.load_feeds(recorded_feeds(execution))
+            clock.now = execution_start(execution, bot.TW_TZ)
+            sent_before, calls_before = len(telegram.sent_messages), len(model.calls)
+
+            run_started = time.perf_counter()
+            run_bot(bot, args.verbose)
+            elapsed = time.perf_counter() - run_started
+            collect_spans(bot, timings, tokens)
+
+            totals["messages"] += len(updates)
+            totals["skipped_documents"] += skipped
+            per_execution.append({
+                "date": execution["date"],
+                "messages": len(updates),
+                "seconds": round(elapsed, 4),
+                "model_calls": len(model.calls) - calls_before,
+                "bot_messages": {"recorded": count_role(execution["entries"], "🤖 Bot"), "replayed": len(telegram.sent_messages) - sent_before},
+                "ai_feeds": {"recorded": count_role(execution["entries"], "⚙️ AI Feed"), "unused": len(model.feeds)},
+            })
+        wall = time.perf_counter() - started
+
+        replayed_state = read_state(bot, os.getcwd())
+        bot_diffs = [e["date"] for e in per_execution if e["bot_messages"]["recorded"] != e["bot_messages"]["replayed"]]
+        report = {
+            "log": args.log,
+            "totals": totals,
+            "throughput": {
+                "wall_s": round(wall, 3),
+                "executions_per_s": round(len(executions) / wall, 2) if wall else None,
+                "messages_per_s": round(totals["messages"] / wall, 2) if wall else None,
+            },
+            "model_calls": model.call_counts(),
+            "tokens": tokens,
+            "grading": {"recorded_feeds_used": model.recorded_used, "canned_feeds_used": model.canned_used},
+            "phases": {name: summarize_seconds(samples) for name, samples in timings.items()},
+            "divergence": {
+                "executions_with_different_bot_messages": bot_diffs,
+                "state": state_divergence(read_state(bot, args.expected_dir), replayed_state) if args.expected_dir else {},
+            },
+            "executions": per_execution if args.per_execution else None,
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded TG_MSG.log traffic through the pipeline against fake services.")
+    parser.add_argument("--log", default="TG_MSG.log", help="recorded log to replay")
+    parser.add_argument("--state-dir", default=None, help="seed vocabulary directory (default: the log's directory)")
+    parser.add_argument("--expected-dir", default=None, help="compare the replayed end state with the state files here")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N executions")
+    parser.add_argument("--per-execution", action="store_true", help="include one row per replayed execution")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="print machine-readable report")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own output")
+    args = parser.parse_args()
+    args.log = os.path.abspath(args.log)
+    if args.expected_dir: args.expected_dir = os.path.abspath(args.expected_dir)
+    state_dir = os.path.abspath(args.state_dir or os.path.dirname(args.log))
+
+    bot = load_bot_module()
+    workdir = tempfile.mkdtemp(prefix="dj_replay_")
+    for name in SEED_FILES:
+        if os.path.exists(os.path.join(state_dir, name)): shutil.copy(os.path.join(state_dir, name), workdir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        report = run_replay(bot, args)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    totals, throughput = report["totals"], report["throughput"]
+    print(f"🎞️ replayed {totals['executions']} executions / {totals['messages']} messages in {throughput['wall_s']}s "
+          f"({throughput['executions_per_s']} runs/s, {throughput['messages_per_s']} msg/s); skipped {totals['skipped_documents']} file uploads")
+    print(f"🤖 model calls: {report['model_calls']} | recorded feeds used {report['grading']['recorded_feeds_used']}, canned {report['grading']['canned_feeds_used']}")
+    if report["tokens"]: print("🔢 tokens: " + ", ".join(f"{k} {v}" for k, v in sorted(report["tokens"].items())))
+    for name, row in sorted(report["phases"].items(), key=lambda kv: -kv[1].get("total_s", 0)):
+        print(f"⏱️ {name:<22} p50 {row['p50_ms']:>9}ms | p95 {row['p95_ms']:>9}ms | max {row['max_ms']:>9}ms | total {row['total_s']}s")
+    diffs = report["divergence"]["executions_with_different_bot_messages"]
+    print(f"🔀 executions with a different number of bot messages: {len(diffs)}" + (f" ({', '.join(diffs[:5])}{' …' if len(diffs) > 5 else ''})" if diffs else ""))
+    for key, row in report["divergence"]["state"].items():
+        print(f"{'✅' if row['match'] else '❌'} {key}: expected {row['expected']} / replayed {row['replayed']}")
+
+if __name__ == "__main__":
+    main()
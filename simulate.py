@@ -0,0 +1,255 @@
+"""
+衝刺模擬器：虛擬時鐘 + 合成學習者 + 假批改
+
+以虛擬時鐘一天跑一次真正的 process_data → run_daily_quiz (與 GitHub Actions 每天中午一次相同)，
+幾秒內跑完整個 SPRINT_DURATION_DAYS，用來調整衝刺天數、難度步長與弱點選字，不必等真實的日子過去。
+
+合成學習者有一個「真實程度」skill (與難度同單位)，每句作答的期望分數為
+    10 · σ(ABILITY_SLOPE · (skill - 難度) + logit(ABILITY_TARGET_SCORE / 10))
+也就是題目難度剛好等於 skill 時，期望得分正好是出題對準的分數。有作答就會進步，偷懶的日子會退步。
+
+用法：
+    python simulate.py --days 180 --diligence 0.85 --learn-rate 0.002
+    python simulate.py --days 60 --json --trajectory trajectory.csv
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import math
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from fake_services import FakeGeminiModel, FakeTelegramServer, _canned_bonus, install_fakes, load_bot_module
+
+SEED_FILES = ["vocab.jsonl", "vocab.json", "jlpt_dict_seed.tsv"] # 只沿用單字庫，使用者狀態從零開始
+ANSWER_MARK = re.compile(r"〔A:(\w+):([\d.]+|SKIP):?([^〕]*)〕")
+QUIZ_MARK = re.compile(r"〔QUIZ#(\d+)〕")
+LEVEL_PATTERN = re.compile(r"Lv (\d+(?:\.\d+)?)")
+
+# ================= 虛擬時鐘 =================
+
+class VirtualClock:
+    def __init__(self, start):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, **kwargs):
+        self.now += timedelta(**kwargs)
+
+# ================= 合成學習者 =================
+
+class SyntheticLearner:
+    def __init__(self, skill, learn_rate, forget_rate, diligence, noise, seed):
+        self.skill = skill
+        self.learn_rate = learn_rate
+        self.forget_rate = forget_rate
+        self.diligence = diligence
+        self.noise = noise
+        self.rng = random.Random(seed)
+
+    def expected_score(self, bot, difficulty):
+        offset = math.log(bot.ABILITY_TARGET_SCORE / (10.0 - bot.ABILITY_TARGET_SCORE))
+        return 10.0 / (1.0 + math.exp(-(bot.ABILITY_SLOPE * (self.skill - difficulty) + offset)))
+
+    def answer_quiz(self, bot, quiz):
+        """
+        回傳一則作答訊息；每行帶一個 〔A:方向:分數:詞〕 標記，假批改照標記給分。
+        偷懶的日子回傳 None。
+        """
+        if self.rng.random() > self.diligence:
+            self.skill -= self.forget_rate
+            return None
+        lines = []
+        plan = [("CN_TO_JP", quiz["levels"][0])] * 7 + [("JP_TO_CN", quiz["levels"][1])] * 3
+        for i, (q_type, difficulty) in enumerate(plan, start=1):
+            word = self.rng.choice(quiz["words"]) if quiz["words"] else ""
+            if self.rng.random() > self.diligence:
+                lines.append(f"Q{i} 不知道 〔A:{q_type}:SKIP〕")
+                continue
+            score = self.expected_score(bot, difficulty) + self.rng.gauss(0, self.noise)
+            score = round(min(10.0, max(0.0, score)), 1)
+            lines.append(f"Q{i} 作答 〔A:{q_type}:{score}:{word}〕")
+            self.skill += self.learn_rate
+        return "\n".join(lines)
+
+# ================= 假模型回應 =================
+
+class SimulatedModel(FakeGeminiModel):
+    """
+    題目卷帶 〔QUIZ#n〕 標記，記住每份題目的雙軌難度與單字列表；
+    批改依作答行的標記給分，低分的句子把該詞收錄為 mistake。
+    """
+    def __init__(self, seed=None):
+        super().__init__(seed=seed, responses={"quiz": self.quiz, "correction": self.correction, "bonus": _canned_bonus})
+        self.quizzes = []
+
+    def quiz(self, prompt):
+        levels = [float(x) for x in LEVEL_PATTERN.findall(prompt)[:2]] or [1.0, 1.0]
+        if len(levels) == 1: levels.append(levels[0])
+        section = prompt.split("【今日單字庫 (含弱點 🔥)】", 1)[-1].split("【", 1)[0]
+        words = []
+        for line in section.splitlines():
+            for item in line.strip().replace(" ⚠️易混淆", "").split(" ⇄ "):
+                term = item.split(" (", 1)[0].strip()
+                if term: words.append(term)
+        with self.lock:
+            self.quizzes.append({"levels": levels, "words": words})
+            quiz_id = len(self.quizzes) - 1
+        questions = "\n".join(f"🔹 Q{i}. 模擬題目 {i}" for i in range(1, 11))
+        answers = "\n".join(f"🔹 A{i}. 參考答案 {i}" for i in range(1, 11))
+        # 標記放在題目卷裡：預生成的開場白可能因推測不符而被換掉
+        opening = "⚔️ 今日特訓開始！\n|||OPENING|||" if "|||OPENING|||" in prompt else "⚔️ 今日特訓開始！"
+        return f"{opening}\n〔QUIZ#{quiz_id}〕\n{questions}\n|||SEPARATOR|||\n{answers}"
+
+    def correction(self, prompt):
+        start = prompt.find("「") + 1
+        end = prompt.find("」\n", start)
+        user_text = prompt[start:end] if start > 0 and end > start else ""
+        assessments, mistakes = [], []
+        for line in user_text.splitlines():
+            mark = ANSWER_MARK.search(line)
+            if not mark: continue
+            q_type, score, term = mark.groups()
+            if score == "SKIP":
+                assessments.append({"input": line, "type": q_type, "score": 0.0, "status": "SKIPPED"})
+                continue
+            assessments.append({"input": line, "type": q_type, "score": float(score), "status": "ATTEMPTED"})
+            if float(score) < 6.0 and term:
+                with self.lock: skill = self.rng.choice(["particle", "conjugation", "tense", "keigo"])
+                mistakes.append({"term": term, "type": "word", "meaning": "模擬錯誤", "skills": [skill]})
+        feedback = "\n".join(f"Q{i}: {a['score']}分 - (教練短評: 模擬評語)" for i, a in enumerate(assessments, start=1))
+        payload = json.dumps({"mistakes": mistakes, "assessments": assessments}, ensure_ascii=False)
+        return f"{feedback}\n```json\n{payload}\n```"
+
+    def latest_sent_quiz(self, telegram):
+        for message in reversed(telegram.sent_messages):
+            mark = QUIZ_MARK.search(message.get("text", ""))
+            if mark: return self.quizzes[int(mark.group(1))]
+        return None
+
+# ================= 模擬主流程 =================
+
+def prepare_sim_workdir(source_dir):
+    workdir = tempfile.mkdtemp(prefix="dj_sim_")
+    for name in SEED_FILES:
+        src = os.path.join(source_dir, name)
+        if os.path.exists(src): shutil.copy(src, workdir)
+    return workdir
+
+def load_vocab_terms(bot):
+    return {bot.normalize_text(w["kanji"]) for w in bot.load_vocab_data()["words"]}
+
+def run_bot(bot, verbose):
+    # 主程式每次執行會印不少進度訊息，模擬數百天時預設收起來
+    bot.LOG_BUFFER.clear()
+    if verbose:
+        bot.main()
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        bot.main()
+
+def run_simulation(bot, args):
+    clock = VirtualClock(datetime.strptime(args.start, "%Y-%m-%d").replace(hour=12, minute=5, tzinfo=bot.TW_TZ))
+    bot.CLOCK = clock
+    learner = SyntheticLearner(args.skill, args.learn_rate, args.forget_rate, args.diligence, args.noise, args.seed)
+    trajectory, covered = [], set()
+
+    with FakeTelegramServer(seed=args.seed) as telegram:
+        model = SimulatedModel(seed=args.seed)
+        install_fakes(bot, telegram, model)
+        # 第一次執行只會記錄 last_update_id (fresh start)
+        telegram.push_message("暖機", date=clock.now.timestamp())
+        run_bot(bot, args.verbose)
+
+        started = time.perf_counter()
+        for day in range(args.days):
+            quiz = model.latest_sent_quiz(telegram)
+            if quiz:
+                covered.update(bot.normalize_text(w) for w in quiz["words"])
+                answer = learner.answer_quiz(bot, quiz)
+                if answer: telegram.push_message(answer, date=(clock.now + timedelta(hours=6)).timestamp())
+            clock.advance(days=1)
+            run_bot(bot, args.verbose)
+
+            stats = bot.load_user_data()["stats"]
+            trajectory.append({
+                "day": day + 1,
+                "date": str(clock.now.date()),
+                "skill": round(learner.skill, 3),
+                "difficulty_cn_jp": float(stats.get("difficulty_cn_jp", bot.START_DIFFICULTY)),
+                "difficulty_jp_cn": float(stats.get("difficulty_jp_cn", bot.START_DIFFICULTY)),
+                "yesterday_main_score": stats.get("yesterday_main_score", 0),
+            })
+            if args.progress and (day + 1) % args.progress == 0:
+                row = trajectory[-1]
+                print(f"Day {row['day']:>3} | skill {row['skill']:.2f} | CN→JP Lv {row['difficulty_cn_jp']:.2f} | JP→CN Lv {row['difficulty_jp_cn']:.2f}")
+        elapsed = time.perf_counter() - started
+
+        vocab_terms = load_vocab_terms(bot)
+        reached = next((row["day"] for row in trajectory if row["difficulty_cn_jp"] >= bot.TARGET_DIFFICULTY), None)
+        summary = {
+            "days": args.days,
+            "wall_seconds": round(elapsed, 2),
+            "final": trajectory[-1] if trajectory else None,
+            "target_reached_day": reached,
+            "word_coverage": round(len(covered & vocab_terms) / len(vocab_terms), 3) if vocab_terms else 0.0,
+            "vocab_size": len(vocab_terms),
+            "model_calls": model.call_counts(),
+            "messages_sent": len(telegram.sent_messages),
+        }
+    return summary, trajectory
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a full sprint with a virtual clock and a synthetic learner.")
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--start", default="2026-01-01", help="virtual sprint start date")
+    parser.add_argument("--state-dir", default=os.path.dirname(os.path.abspath(__file__)), help="directory holding the seed vocabulary")
+    parser.add_argument("--skill", type=float, default=1.5, help="learner's true starting level")
+    parser.add_argument("--learn-rate", type=float, default=0.002, help="skill gained per answered sentence")
+    parser.add_argument("--forget-rate", type=float, default=0.01, help="skill lost per skipped day")
+    parser.add_argument("--diligence", type=float, default=0.85, help="probability of answering (per day and per sentence)")
+    parser.add_argument("--noise", type=float, default=1.0, help="score noise (standard deviation)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--progress", type=int, default=30, help="print a trajectory row every N days (0 = off)")
+    parser.add_argument("--trajectory", default=None, help="write the daily trajectory to this CSV file")
+    parser.add_argument("--json", action="store_true", help="print machine-readable summary")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own output for every simulated day")
+    args = parser.parse_args()
+
+    bot = load_bot_module()
+    workdir = prepare_sim_workdir(args.state_dir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        summary, trajectory = run_simulation(bot, args)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.trajectory and trajectory:
+        with open(args.trajectory, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(trajectory[0].keys()))
+            writer.writeheader()
+            writer.writerows(trajectory)
+
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        final = summary["final"] or {}
+        print(f"🏁 {summary['days']} simulated days in {summary['wall_seconds']}s")
+        print(f"📈 final CN→JP Lv {final.get('difficulty_cn_jp', 0):.2f} / JP→CN Lv {final.get('difficulty_jp_cn', 0):.2f} (learner skill {final.get('skill', 0):.2f})")
+        print(f"🎯 target reached: {'day ' + str(summary['target_reached_day']) if summary['target_reached_day'] else 'not within the run'}")
+        print(f"📚 word coverage: {summary['word_coverage'] * 100:.1f}% of {summary['vocab_size']} words")
+        print(f"🤖 model calls: {summary['model_calls']}")
+
+if __name__ == "__main__":
+    main()